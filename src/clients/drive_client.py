@@ -1,14 +1,18 @@
 # src/clients/drive_client.py
 from __future__ import annotations
 
+import hashlib
+import os
 import re
+import tempfile
 from io import BytesIO
-from typing import Optional
+from typing import Optional, Tuple
 
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
 from src.auth import build_drive_client, build_docs_client
+from src.settings import settings
 from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -92,15 +96,63 @@ def parse_drive_url_to_id(url: str) -> str | None:
     m = re.search(r"/file/d/([a-zA-Z0-9_-]+)/", url)
     return m.group(1) if m else None
 
-def download_file_bytes(file_id: str) -> bytes:
+def _download_chunk_size(chunk_size: Optional[int]) -> int:
+    return max(256 * 1024, int(chunk_size or settings.drive_download_chunk_mb * 1024 * 1024))
+
+def download_file_bytes(file_id: str, *, chunk_size: Optional[int] = None) -> bytes:
     """
     Descarga un archivo (binario) de Drive por fileId (útil para PDFs).
     """
     drive = build_drive_client()
     request = drive.files().get_media(fileId=file_id, supportsAllDrives=True)
     fh = BytesIO()
-    downloader = MediaIoBaseDownload(fd=fh, request=request)
+    downloader = MediaIoBaseDownload(fd=fh, request=request, chunksize=_download_chunk_size(chunk_size))
     done = False
     while not done:
         _, done = downloader.next_chunk()
     return fh.getvalue()
+
+class _HashingFile:
+    """Envuelve un archivo de escritura y calcula SHA-256 mientras se escribe."""
+    def __init__(self, fh):
+        self._fh = fh
+        self._sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._sha.update(data)
+        self.size += len(data)
+        return self._fh.write(data)
+
+    def hexdigest(self) -> str:
+        return self._sha.hexdigest()
+
+def download_file_to_tempfile(
+    file_id: str,
+    *,
+    chunk_size: Optional[int] = None,
+    suffix: str = ".pdf",
+) -> Tuple[str, str]:
+    """
+    Descarga un archivo de Drive en streaming a un archivo temporal (sin BytesIO en memoria).
+    Escribe por bloques de `chunk_size` bytes (default DRIVE_DOWNLOAD_CHUNK_MB) y calcula
+    el SHA-256 al vuelo. Devuelve (ruta, sha256). El caller es dueño del archivo.
+    """
+    drive = build_drive_client()
+    request = drive.files().get_media(fileId=file_id, supportsAllDrives=True)
+    fd, path = tempfile.mkstemp(prefix="regresos-", suffix=suffix, dir=settings.drive_download_dir or None)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            hf = _HashingFile(fh)
+            downloader = MediaIoBaseDownload(fd=hf, request=request, chunksize=_download_chunk_size(chunk_size))
+            done = False
+            while not done:
+                _, done = downloader.next_chunk()
+    except Exception:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    logger.info(f"⬇️ Descargado {file_id} → {path} ({hf.size / 1048576:.1f} MB, streaming).")
+    return path, hf.hexdigest()
@@ -1,18 +1,193 @@
 # src/clients/vertex_client.py
+import asyncio
+import hashlib
+import json
+import threading
 import time
+from datetime import timedelta
 from google.api_core import exceptions as gex
 from vertexai.preview.generative_models import GenerativeModel, Part
 from src.auth import init_vertex_ai
 from src.settings import settings
 from src.utils.logger import get_logger
+from src.utils.json_parse import is_complete_json_object
+from src.utils.response_cache import get_response_cache, response_key
+from src.utils.tokens import CHARS_PER_TOKEN, estimate_tokens
 logger = get_logger(__name__)
 
-def _call_with_retry(make_call, *, desc: str, retries: int = 6, first_wait: float = 3.0, base: float = 2.0):
+# ================== Limitador de cuota compartido (por proceso y por modelo) ==================
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket doble (requests/min y tokens/min) para un modelo, compartido por todos los
+    jobs e hilos del proceso, con AIMD sobre el cupo efectivo:
+      • 429 (ResourceExhausted) → factor *= 0.5 (mínimo `min_factor`) y se vacían los buckets.
+      • Cada éxito → factor += `recover_step` (hasta 1.0).
+    La ráfaga máxima es ~10 s de cupo; los tokens de salida se descuentan después de la llamada.
+    """
+
+    _BURST_S = 10.0
+
+    def __init__(self, model_id: str, *, rpm: float, tpm: float, min_factor: float = 0.1, recover_step: float = 0.05):
+        self.model_id = model_id
+        self.rpm = max(1.0, float(rpm))
+        self.tpm = max(1.0, float(tpm))
+        self.min_factor = min(1.0, max(0.01, float(min_factor)))
+        self.recover_step = max(0.0, float(recover_step))
+        self.factor = 1.0
+        self._lock = threading.Lock()
+        self._req = self._cap(self.rpm)
+        self._tok = self._cap(self.tpm)
+        self._last = time.monotonic()
+
+    def _cap(self, per_min: float) -> float:
+        return max(1.0, per_min * self.factor * self._BURST_S / 60.0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        dt, self._last = now - self._last, now
+        self._req = min(self._cap(self.rpm), self._req + dt * self.rpm * self.factor / 60.0)
+        self._tok = min(self._cap(self.tpm), self._tok + dt * self.tpm * self.factor / 60.0)
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        """Toma cupo si lo hay (devuelve 0.0); si no, los segundos sugeridos de espera (máx. 1 s)."""
+        with self._lock:
+            self._refill()
+            need_tok = min(float(tokens), self._cap(self.tpm))  # un prompt enorme no bloquea para siempre
+            if self._req >= 1.0 and self._tok >= need_tok:
+                self._req -= 1.0
+                self._tok -= need_tok
+                return 0.0
+            wait = max(
+                (1.0 - self._req) * 60.0 / (self.rpm * self.factor),
+                (need_tok - self._tok) * 60.0 / (self.tpm * self.factor),
+                0.01,
+            )
+        return min(wait, 1.0)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Bloquea hasta que haya cupo para 1 request y `tokens` tokens; devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Igual que `acquire` pero cede el event loop mientras espera."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def record_output(self, tokens: int) -> None:
+        with self._lock:
+            self._tok -= max(0, int(tokens))  # puede quedar negativo: "deuda" que frena las siguientes
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.factor = min(1.0, self.factor + self.recover_step)
+
+    def on_throttled(self) -> None:
+        with self._lock:
+            self.factor = max(self.min_factor, self.factor * 0.5)
+            self._req = min(self._req, 0.0)
+            self._tok = min(self._tok, 0.0)
+            factor = self.factor
+        logger.warning(f"🚦 Limitador {self.model_id}: 429 → cupo efectivo {factor:.0%} "
+                       f"(~{self.rpm * factor:.0f} rpm, ~{self.tpm * factor:.0f} tpm).")
+
+
+_limiters: dict = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_id: str) -> AdaptiveRateLimiter | None:
+    """Limitador compartido del modelo (None si VERTEX_LIMITER_ENABLED=false)."""
+    if not settings.vertex_limiter_enabled:
+        return None
+    with _limiters_lock:
+        lim = _limiters.get(model_id)
+        if lim is None:
+            cfg = settings.vertex_rate_limits().get(model_id, {})
+            lim = AdaptiveRateLimiter(
+                model_id,
+                rpm=cfg.get("rpm", settings.vertex_rpm),
+                tpm=cfg.get("tpm", settings.vertex_tpm),
+                min_factor=settings.vertex_limiter_min_factor,
+                recover_step=settings.vertex_limiter_recover_step,
+            )
+            _limiters[model_id] = lim
+        return lim
+
+
+# ================== Clientes GenerativeModel reutilizados ==================
+
+_vertex_ready = False
+_vertex_lock = threading.Lock()
+_models: dict = {}
+_models_lock = threading.Lock()
+_RETRIABLE = (gex.ResourceExhausted, gex.ServiceUnavailable, gex.DeadlineExceeded)
+
+
+def _ensure_vertex() -> None:
+    """`init_vertex_ai()` una sola vez por proceso (refresca credenciales: no es gratis por llamada)."""
+    global _vertex_ready
+    if _vertex_ready:
+        return
+    with _vertex_lock:
+        if not _vertex_ready:
+            _vertex_ready = bool(init_vertex_ai())
+
+
+def get_model(model_id: str, generation_config: dict | None = None) -> GenerativeModel:
+    """GenerativeModel compartido por (modelo, generation_config); es seguro reutilizarlo entre hilos."""
+    _ensure_vertex()
+    key = (model_id, json.dumps(generation_config or {}, sort_keys=True, default=str))
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                if generation_config:
+                    model = GenerativeModel(model_id, generation_config=generation_config)
+                else:
+                    model = GenerativeModel(model_id)
+                _models[key] = model
+    return model
+
+
+def _call_with_retry(
+    make_call,
+    *,
+    desc: str,
+    retries: int = 6,
+    first_wait: float = 3.0,
+    base: float = 2.0,
+    limiter: AdaptiveRateLimiter | None = None,
+    tokens: int = 0,
+):
     wait = first_wait
     for attempt in range(1, retries + 1):
         try:
-            return make_call()
-        except (gex.ResourceExhausted, gex.ServiceUnavailable, gex.DeadlineExceeded) as e:
+            if limiter is not None:
+                waited = limiter.acquire(tokens)
+                if waited >= 1.0:
+                    logger.info(f"🚦 {desc}: esperó {waited:.1f}s por cupo.")
+            result = make_call()
+            if limiter is not None:
+                limiter.on_success()
+                if isinstance(result, str):
+                    limiter.record_output(estimate_tokens(result))
+            return result
+        except _RETRIABLE as e:
+            if limiter is not None and isinstance(e, gex.ResourceExhausted):
+                limiter.on_throttled()
             if attempt == retries:
                 logger.error(f"❌ {desc}: agotados {retries} intentos: {e}")
                 raise
@@ -24,37 +199,150 @@ def _call_with_retry(make_call, *, desc: str, retries: int = 6, first_wait: floa
             # Errores no-retriables
             raise
 
+async def _call_with_retry_async(
+    make_coro,
+    *,
+    desc: str,
+    retries: int = 6,
+    first_wait: float = 3.0,
+    base: float = 2.0,
+    limiter: AdaptiveRateLimiter | None = None,
+    tokens: int = 0,
+):
+    """Versión asyncio de `_call_with_retry` (mismos reintentos y limitador, sin bloquear hilos)."""
+    wait = first_wait
+    for attempt in range(1, retries + 1):
+        try:
+            if limiter is not None:
+                waited = await limiter.acquire_async(tokens)
+                if waited >= 1.0:
+                    logger.info(f"🚦 {desc}: esperó {waited:.1f}s por cupo.")
+            result = await make_coro()
+            if limiter is not None:
+                limiter.on_success()
+                if isinstance(result, str):
+                    limiter.record_output(estimate_tokens(result))
+            return result
+        except _RETRIABLE as e:
+            if limiter is not None and isinstance(e, gex.ResourceExhausted):
+                limiter.on_throttled()
+            if attempt == retries:
+                logger.error(f"❌ {desc}: agotados {retries} intentos: {e}")
+                raise
+            logger.warning(f"🔁 {desc}: {e.__class__.__name__} ({attempt}/{retries}). "
+                           f"Durmiendo {wait:.1f}s…")
+            await asyncio.sleep(wait)
+            wait = min(wait * base, 30.0)
+
+# ================== Cache persistente de respuestas (opt-in) ==================
+
+def _cacheable(config: dict | None, out: str) -> bool:
+    """Sólo se guardan respuestas válidas: no vacías y, si se pidió JSON, un objeto completo
+    (una salida truncada o malformada no se repite en el reintento; se vuelve a llamar al modelo)."""
+    if not out:
+        return False
+    if (config or {}).get("response_mime_type") == "application/json":
+        return is_complete_json_object(out)
+    return True
+
+def _cached(mdl: str, config: dict | None, payload, call) -> str:
+    """Consulta el cache de respuestas antes de `call()` (un hit no consume cuota ni espera al limitador)."""
+    cache = get_response_cache()
+    if cache is None:
+        return call()
+    key = response_key(mdl, config, payload)
+    hit = cache.get(key)
+    if hit is not None:
+        logger.info(f"💾 Cache de respuestas: hit {key[:12]}… ({mdl}).")
+        return hit
+    out = call()
+    if _cacheable(config, out):
+        cache.put(key, out, model_id=mdl)
+    return out
+
+async def _cached_async(mdl: str, config: dict | None, payload, call) -> str:
+    cache = get_response_cache()
+    if cache is None:
+        return await call()
+    key = response_key(mdl, config, payload)
+    hit = cache.get(key)
+    if hit is not None:
+        logger.info(f"💾 Cache de respuestas: hit {key[:12]}… ({mdl}).")
+        return hit
+    out = await call()
+    if _cacheable(config, out):
+        cache.put(key, out, model_id=mdl)
+    return out
+
+def response_cache_stats() -> dict | None:
+    """Contadores hits/misses/writes/evictions del proceso; None si el cache está deshabilitado."""
+    cache = get_response_cache()
+    return cache.stats() if cache is not None else None
+
 def generate_text(prompt: str, *, model_id: str | None = None) -> str:
-    init_vertex_ai()
     mdl = model_id or settings.vertex_model_id
     logger.info(f"🤖 Solicitando respuesta a modelo {mdl}...")
+    model = get_model(mdl)
     def _do():
-        model = GenerativeModel(mdl)
         resp = model.generate_content(prompt)
         return resp.text or ""
-    return _call_with_retry(_do, desc=f"generate_text({mdl})") or ""
+    return _cached(mdl, None, prompt, lambda: _call_with_retry(
+        _do, desc=f"generate_text({mdl})", limiter=get_rate_limiter(mdl), tokens=estimate_tokens(prompt)
+    ) or "")
+
+async def generate_text_async(prompt: str, *, model_id: str | None = None) -> str:
+    """Como `generate_text` pero nativo asyncio (`generate_content_async`): no ocupa un hilo por llamada."""
+    mdl = model_id or settings.vertex_model_id
+    logger.info(f"🤖 (async) Solicitando respuesta a modelo {mdl}...")
+    model = get_model(mdl)
+    async def _do():
+        resp = await model.generate_content_async(prompt)
+        return resp.text or ""
+    async def _call():
+        return await _call_with_retry_async(
+            _do, desc=f"generate_text_async({mdl})", limiter=get_rate_limiter(mdl), tokens=estimate_tokens(prompt)
+        ) or ""
+    return await _cached_async(mdl, None, prompt, _call)
+
+def generate_json(prompt: str, *, model_id: str | None = None, response_schema: dict | None = None) -> str:
+    """Salida JSON restringida (`response_mime_type` + `response_schema` opcional); devuelve el texto crudo."""
+    mdl = model_id or settings.vertex_model_id
+    logger.info(f"🤖 (JSON) Solicitando respuesta a modelo {mdl}...")
+    config = {"response_mime_type": "application/json"}
+    if response_schema:
+        config["response_schema"] = response_schema
+    model = get_model(mdl, config)
+    def _do():
+        resp = model.generate_content(prompt)
+        return resp.text or ""
+    return _cached(mdl, config, prompt, lambda: _call_with_retry(
+        _do, desc=f"generate_json({mdl})", limiter=get_rate_limiter(mdl), tokens=estimate_tokens(prompt)
+    ) or "")
 
 def generate_text_with_files(prompt: str, gcs_uris: list[str], *, model_id: str | None = None) -> str:
-    init_vertex_ai()
     mdl = model_id or settings.vertex_model_id
     logger.info(f"🤖 Modelo {mdl} con {len(gcs_uris)} archivo(s) adjunto(s)...")
+    model = get_model(mdl)
     def _do():
-        model = GenerativeModel(mdl)
         parts = [prompt] + [Part.from_uri(uri, mime_type="application/pdf") for uri in gcs_uris]
         resp = model.generate_content(parts)
         return resp.text or ""
-    return _call_with_retry(_do, desc=f"generate_text_with_files({mdl})") or ""
+    return _cached(mdl, None, [prompt, *gcs_uris], lambda: _call_with_retry(
+        _do, desc=f"generate_text_with_files({mdl})", limiter=get_rate_limiter(mdl), tokens=estimate_tokens(prompt)
+    ) or "")
 
 def generate_json_with_files(prompt: str, gcs_uris: list[str], *, model_id: str | None = None) -> str:
-    init_vertex_ai()
     mdl = model_id or settings.vertex_model_id
     logger.info(f"🤖 (JSON) Modelo {mdl} con {len(gcs_uris)} archivo(s) adjunto(s)...")
+    config = {"response_mime_type": "application/json"}
+    model = get_model(mdl, config)
     def _do():
-        model = GenerativeModel(mdl, generation_config={"response_mime_type": "application/json"})
         parts = [prompt] + [Part.from_uri(uri, mime_type="application/pdf") for uri in gcs_uris]
         resp = model.generate_content(parts)
         return resp.text or "{}"
-    return _call_with_retry(_do, desc=f"generate_json_with_files({mdl})") or ""
+    return _cached(mdl, config, [prompt, *gcs_uris], lambda: _call_with_retry(
+        _do, desc=f"generate_json_with_files({mdl})", limiter=get_rate_limiter(mdl), tokens=estimate_tokens(prompt)
+    ) or "")
 
 def generate_text_from_files_map_reduce(
     system_text: str,
@@ -91,3 +379,165 @@ def generate_text_from_files_map_reduce(
     )
     logger.info(f"🧩 REDUCE ({red_mdl})")
     return generate_text(reduce_prompt, model_id=red_mdl)
+
+# ================== Context caching (prefijos compartidos por job) ==================
+
+class VertexContextCacheBackend:
+    """Context caching explícito de Vertex (`CachedContent`): el prefijo se sube una vez y se referencia."""
+
+    def __init__(self):
+        self._models: dict = {}
+
+    def create(self, model_id: str, text: str, ttl_s: int):
+        from vertexai.preview import caching  # import perezoso: no todas las versiones del SDK lo traen
+        _ensure_vertex()
+        return caching.CachedContent.create(
+            model_name=model_id, contents=[text], ttl=timedelta(seconds=max(60, int(ttl_s)))
+        )
+
+    def generate(self, handle, model_id: str, prompt: str, generation_config: dict | None = None) -> str:
+        key = (handle.name, json.dumps(generation_config or {}, sort_keys=True, default=str))
+        model = self._models.get(key)
+        if model is None:
+            model = self._models[key] = GenerativeModel.from_cached_content(
+                cached_content=handle, generation_config=generation_config or None
+            )
+        resp = model.generate_content(prompt)
+        return resp.text or ""
+
+    def delete(self, handle) -> None:
+        for key in [k for k in self._models if k[0] == handle.name]:
+            self._models.pop(key, None)
+        handle.delete()
+
+
+class FakeContextCacheBackend:
+    """Backend local (tests/desarrollo): guarda prefijos en memoria y responde con `responder(prefijo, prompt)`."""
+
+    def __init__(self, responder=None):
+        self.responder = responder or (lambda prefix, prompt: "")
+        self.prefixes: dict = {}
+        self.calls: list = []   # (handle, prompt) tal como se enviaría al modelo
+        self.deleted: list = []
+
+    def create(self, model_id: str, text: str, ttl_s: int):
+        handle = f"fake-cache-{len(self.prefixes) + 1}"
+        self.prefixes[handle] = text
+        return handle
+
+    def generate(self, handle, model_id: str, prompt: str, generation_config: dict | None = None) -> str:
+        self.calls.append((handle, prompt))
+        return self.responder(self.prefixes[handle], prompt)
+
+    def delete(self, handle) -> None:
+        self.deleted.append(handle)
+        self.prefixes.pop(handle, None)
+
+
+class ContextCache:
+    """
+    Prefijos compartidos de UN job ([SYSTEM] + [PROMPT_BASE], + texto de chunk) registrados una
+    sola vez en el backend y referenciados en las llamadas siguientes.
+      • `segments` se prueban como prefijos acumulados, del más largo al más corto.
+      • Un prefijo se registra en su `min_uses`-ésimo uso (la 1ª llamada va completa: si el
+        prefijo nunca se repite no se paga el registro) y sólo si supera `min_tokens`.
+      • El registro (llamada de red) se hace fuera del lock; mientras está en vuelo, los demás
+        workers usan un prefijo más corto o la llamada completa.
+      • `generate()` devuelve None cuando no hay prefijo cacheable: el caller hace la llamada normal.
+    `close()` borra los prefijos registrados (fin del job).
+    """
+
+    def __init__(self, backend=None, *, min_tokens: int = 2048, ttl_s: int = 3600, min_uses: int = 2):
+        self.backend = backend
+        self.min_tokens = max(0, int(min_tokens))
+        self.ttl_s = int(ttl_s)
+        self.min_uses = max(1, int(min_uses))
+        self._lock = threading.Lock()
+        self._uses: dict = {}
+        self._handles: dict = {}
+        self._failed: set = set()
+        self._pending: set = set()
+        self._stats = {"prefixes": 0, "cached_calls": 0, "tokens_saved": 0}
+
+    def _pick(self, model_id: str, segments) -> tuple | None:
+        """(handle, nº de segmentos del prefijo) del prefijo acumulado más largo utilizable."""
+        digests, h, size = [], hashlib.sha256(model_id.encode("utf-8")), 0
+        for seg in segments:
+            h.update(seg.encode("utf-8"))
+            size += len(seg)
+            digests.append((h.hexdigest(), size))
+        for n in range(len(segments), 0, -1):
+            key, chars = digests[n - 1]
+            if chars < self.min_tokens * CHARS_PER_TOKEN:
+                continue
+            with self._lock:
+                self._uses[key] = self._uses.get(key, 0) + 1
+                handle = self._handles.get(key)
+                create = (
+                    handle is None and key not in self._failed and key not in self._pending
+                    and self._uses[key] >= self.min_uses
+                )
+                if create:
+                    self._pending.add(key)  # en vuelo: los demás workers no esperan ni lo duplican
+            if create:
+                # `create` es una llamada de red: fuera del lock para no frenar al resto del job
+                try:
+                    handle = self.backend.create(model_id, "".join(segments[:n]), self.ttl_s)
+                    logger.info(f"🧊 Context cache: prefijo registrado ({model_id}, ~{chars // CHARS_PER_TOKEN} tokens).")
+                except Exception as e:
+                    logger.warning(f"Context cache: no se pudo registrar el prefijo ({e}); llamada completa.")
+                with self._lock:
+                    self._pending.discard(key)
+                    if handle is None:
+                        self._failed.add(key)
+                    else:
+                        self._handles[key] = handle
+                        self._stats["prefixes"] += 1
+            if handle is not None:
+                return handle, n
+        return None
+
+    def generate(self, segments, suffix: str, *, model_id: str, generation_config: dict | None = None) -> str | None:
+        if self.backend is None or not segments:
+            return None
+        picked = self._pick(model_id, segments)
+        if picked is None:
+            return None
+        handle, n = picked
+        prompt = "".join(segments[n:]) + suffix
+        full = "".join(segments) + suffix
+
+        def _do():
+            return self.backend.generate(handle, model_id, prompt, generation_config)
+
+        out = _cached(model_id, generation_config, full, lambda: _call_with_retry(
+            _do, desc=f"generate_text[cache]({model_id})", limiter=get_rate_limiter(model_id), tokens=estimate_tokens(prompt)
+        ) or "")
+        with self._lock:
+            self._stats["cached_calls"] += 1
+            self._stats["tokens_saved"] += estimate_tokens(full) - estimate_tokens(prompt)
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), {}
+        for handle in handles:
+            try:
+                self.backend.delete(handle)
+            except Exception as e:
+                logger.debug(f"Context cache: no se pudo borrar un prefijo: {e}")
+
+
+def new_context_cache() -> ContextCache:
+    """ContextCache de un job según settings (backend None = sin caching, todas las llamadas completas)."""
+    kind = (settings.vertex_context_cache_backend or "none").strip().lower()
+    backend = {"vertex": VertexContextCacheBackend, "fake": FakeContextCacheBackend}.get(kind)
+    return ContextCache(
+        backend() if backend else None,
+        min_tokens=settings.vertex_context_cache_min_tokens,
+        ttl_s=settings.vertex_context_cache_ttl_s,
+    )
@@ -1,24 +1,35 @@
 # src/services/back_questions.py
 from __future__ import annotations
-from io import BytesIO
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import json
 import re
 import time
 from collections import defaultdict
+import heapq
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import os
 
-from PyPDF2 import PdfReader, PdfWriter
 from google.api_core import exceptions as gex
 
 from src.clients.drive_client import (
     assert_sa_has_access,
     parse_drive_url_to_id,
-    download_file_bytes,
+    download_file_to_tempfile,
 )
 from src.clients.gdocs_client import get_document_content, write_qas_native
-from src.clients.vertex_client import generate_text
+from src.clients.vertex_client import ContextCache, generate_json, generate_text, new_context_cache, response_cache_stats
+from src.services.chunk_index import ChunkIndex, build_chunk_index
+from src.services.passages import PassageIndex
+from src.services.pdf_text import ParsedPdf
+from src.services.question_dedup import dedup_questions, fan_out
+from src.services.section_locator import locate_question_section
 from src.settings import settings
+from src.utils import es_text
+from src.utils.json_parse import parse_json_object, parse_stats
 from src.utils.logger import get_logger
+from src.utils.memory import children_peak_rss_mb, peak_rss_mb
+from src.utils.timing import StageTimer
+from src.utils.tokens import estimate_tokens
 
 logger = get_logger(__name__)
 
@@ -34,6 +45,9 @@ _VARIANTS = [
     r"follow[-\s]up",
     r"preguntas?\s+pendientes?",
 ]
+# Precompilados; se buscan sobre texto plegado (es_text.fold: sin acentos, minúsculas → sin re.I)
+_VARIANT_RES = tuple(re.compile(v.lower()) for v in _VARIANTS)
+_ANY_VARIANT = re.compile("|".join(f"(?:{v.lower()})" for v in _VARIANTS))
 
 # ---------- Helpers de logging (NUEVO) ----------
 def _log_detected_questions(tag: str, questions: List[Dict[str, Any]], *, max_len: int = 160) -> None:
@@ -55,70 +69,76 @@ def _log_detected_questions(tag: str, questions: List[Dict[str, Any]], *, max_le
         logger.info(f"{tag}  [{i:02d}] id={qid} page_hint={ph} heading={sh!r} :: {txt}")
 
 def _first_heading_variant_hit(text: str) -> str | None:
-    for pat in _VARIANTS:
-        if re.search(pat, text, re.I):
-            return pat
-    return None
-
-
-# ================= Utilidades JSON robustas =================
-
-def _extract_first_json_object(raw: str) -> str | None:
-    """
-    Devuelve el primer objeto JSON balanceado a partir del primer '{'.
-    Respeta comillas y escapes. Soporta texto antes/después y fenced code.
-    """
-    s = (raw or "").strip()
-    # Quita fences tipo ```json ... ```
-    if s.startswith("```"):
-        s = re.sub(r"^```(?:json)?\s*|\s*```$", "", s, flags=re.I | re.S).strip()
-
-    start = s.find("{")
-    if start == -1:
+    folded = es_text.fold(text)
+    if not _ANY_VARIANT.search(folded):
         return None
-
-    depth = 0
-    in_str = False
-    esc = False
-    for i in range(start, len(s)):
-        ch = s[i]
-        if in_str:
-            if esc:
-                esc = False
-            elif ch == "\\":
-                esc = True
-            elif ch == '"':
-                in_str = False
-        else:
-            if ch == '"':
-                in_str = True
-            elif ch == "{":
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0:
-                    return s[start:i + 1]
+    for pat, rx in zip(_VARIANTS, _VARIANT_RES):
+        if rx.search(folded):
+            return pat
     return None
 
 
-def _safe_json_loads(raw: str) -> dict:
-    s = (raw or "").strip()
-    # Intento directo
-    try:
-        return json.loads(s)
-    except Exception:
-        pass
-    # Intento con extractor balanceado
-    frag = _extract_first_json_object(s)
-    if frag:
-        return json.loads(frag)
-    raise ValueError("No se encontró JSON válido en la salida del modelo.")
+# ================= Esquemas de salida JSON (response_schema) =================
+
+_DETECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "text": {"type": "string"},
+                    "page_hint": {"type": "integer", "nullable": True},
+                    "section_heading": {"type": "string", "nullable": True},
+                },
+                "required": ["id", "text"],
+            },
+        },
+    },
+    "required": ["questions"],
+}
+
+_MAP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "chunk_id": {"type": "integer"},
+        "answers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "string"}, "answer": {"type": "string"}},
+                "required": ["id", "answer"],
+            },
+        },
+    },
+    "required": ["answers"],
+}
+
+_REDUCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "string"}, "answer": {"type": "string"}},
+                "required": ["id", "answer"],
+            },
+        },
+    },
+    "required": ["answers"],
+}
+
+_NO_EVIDENCE = "_(No se encontró evidencia suficiente en este documento para responder esta pregunta)_"
 
 # ================= Detección de preguntas =================
 
 def _detect_back_questions_via_model_text(sample_text: str, *, max_questions: int) -> List[Dict[str, Any]]:
     """
-    * Detector ML usando SOLO TEXTO (sin adjuntos). Se pasa el sample P40+U40 como texto plano.
+    * Detector ML usando SOLO TEXTO (sin adjuntos). Se pasa el sample P40+U40 como texto plano
+      con marcas [p. N] por página (para que 'page_hint' sea una página real del PDF).
     """
     prompt = f"""
 Eres un extractor de 'Preguntas regreso' en documentos legales.
@@ -134,7 +154,7 @@ Entrega SOLO JSON válido (sin comentarios, sin texto adicional):
 Reglas:
 - Incluye solo preguntas (frases con '?' o bullets interrogativos) o elementos bajo encabezados relevantes.
 - Acepta variantes: "Preguntas de regreso", "Preguntas regreso", "PREGUNTAS REGRESO", "Preguntas de seguimiento", "Preguntas para el cliente", "Seguimiento", "Back questions", "Follow-up".
-- 'page_hint' si el texto sugiere la página; si no, null.
+- 'page_hint': número de página del documento al que se REFIERE la pregunta (p. ej. "en la página 45", "p. 12 de la declaración"); el texto trae marcas [p. N] con la página de cada bloque. Si la pregunta no remite a una página, null.
 - Máximo {max_questions} preguntas.
 
 [SAMPLE_TEXT]
@@ -143,9 +163,9 @@ Reglas:
 >>>
 """.strip()
     model_for_detection = getattr(settings, "map_model_id", settings.vertex_model_id)
-    raw = generate_text(prompt, model_id=model_for_detection)
+    raw = generate_json(prompt, model_id=model_for_detection, response_schema=_DETECTION_SCHEMA)
     try:
-        data = _safe_json_loads(raw)
+        data = parse_json_object(raw, array_key="questions", kind="deteccion")
         questions = data.get("questions", [])
     except Exception as e:
         logger.warning(f"No se pudo parsear JSON de detección (len={len(raw)}). Error: {e}")
@@ -153,12 +173,13 @@ Reglas:
 
     out = []
     for idx, q in enumerate(questions, 1):
+        if not isinstance(q, dict):
+            continue
         txt = (q.get("text") or "").strip()
         if not txt:
             continue
         if "?" not in txt:
-            heading = (q.get("section_heading") or "").lower()
-            if not any(re.search(v, heading, re.I) for v in _VARIANTS):
+            if not _ANY_VARIANT.search(es_text.fold(q.get("section_heading") or "")):
                 continue
         out.append({
             "id": q.get("id") or f"q{idx}",
@@ -168,64 +189,98 @@ Reglas:
         })
     return out[:max_questions]
 
-def _extract_full_text(data: bytes) -> str:
+def _detect_back_questions_regex(sample_text: str) -> List[Dict[str, Any]]:
     """
-    Extrae TEXTO de TODO el PDF (concatenado por páginas).
-    Prioriza PyMuPDF con 'blocks' (mejor orden visual); fallback a PyPDF2.
+    Fallback local: si detecta encabezados candidatos en el sample, extrae líneas con '¿...?'.
     """
-    try:
-        import fitz
-        doc = fitz.open(stream=data, filetype="pdf")
-        parts = []
-        for page in doc:
-            blocks = page.get_text("blocks") or []
-            blk_texts = []
-            for b in blocks:
-                if isinstance(b, (list, tuple)) and len(b) >= 5 and isinstance(b[4], str):
-                    blk_texts.append(b[4])
-            if blk_texts:
-                parts.append("\n".join(blk_texts).replace("\r", ""))
-            else:
-                parts.append((str(page.get_text("text")) or "").replace("\r", ""))
-        doc.close()
-        return "\n".join(parts)
-    except Exception:
-        pass
-
-    r = PdfReader(BytesIO(data))
-    buf = []
-    for i in range(len(r.pages)):
-        try:
-            t = r.pages[i].extract_text() or ""
-            buf.append(t.replace("\r", ""))
-        except Exception:
-            buf.append("")
-    return "\n".join(buf)
+    txt = sample_text or ""
 
+    if _ANY_VARIANT.search(es_text.fold(txt)):
+        qs = es_text.question_lines(txt)
+        for s in qs:
+            logger.info(f"la pregunta agregada es {s}")
+        return [{"id": f"q{i+1}", "text": q, "page_hint": None, "section_heading": None} for i, q in enumerate(qs)]
+    return []
 
+def _locate_detection_window(pdf: ParsedPdf, ranges: List[Tuple[int, int]]) -> Optional[Dict[str, Any]]:
+    """Ventana (0-based, end exclusivo) con la sección de preguntas dentro de `ranges`, o None."""
+    pages = [(i, pdf.page_text(i)) for a, b in ranges for i in range(a, b)]
+    window = locate_question_section(
+        pages,
+        _ANY_VARIANT,
+        before=settings.backq_locator_pages_before,
+        after=settings.backq_locator_pages_after,
+        max_pages=settings.backq_locator_max_pages,
+    )
+    if window:
+        # La sección puede seguir fuera de la muestra: completar las `after` páginas y extender
+        # mientras haya preguntas (la ventana no cambia cuando la muestra crece a su alrededor)
+        while (window["end"] < pdf.page_count and window["end"] - window["start"] < settings.backq_locator_max_pages):
+            n_q = len(es_text.question_lines(pdf.page_text(window["end"])))
+            if not n_q and window["end"] - window["page"] > settings.backq_locator_pages_after:
+                break
+            window["questions"] += n_q
+            window["end"] += 1
+    return window
+
+def _ranges_covered(ranges: List[Tuple[int, int]], windows: List[Tuple[int, int]]) -> bool:
+    """True si todas las páginas de `ranges` caen dentro de alguna ventana ya enviada."""
+    return all(any(s <= i < e for s, e in windows) for a, b in ranges for i in range(a, b))
+
+def _locator_width(sampling_mode: str, take_first: int, take_last: int, params: Dict[str, Any]) -> int:
+    """
+    Ancho inicial de los extremos para `_detect_with_locator`. En modo "fixed" es el mayor de
+    take_first/take_last: una sola pasada (y a lo sumo una llamada) aunque sean distintos.
+    """
+    if sampling_mode != "adaptive":
+        return max(take_first, take_last)
+    return max(1, int(params.get("sampling_initial_pages") or settings.backq_sampling_initial_pages))
 
-def _detect_back_questions_regex(sample_bytes: bytes) -> List[Dict[str, Any]]:
+def _detect_with_locator(
+    pdf: ParsedPdf,
+    *,
+    take_first: int,
+    take_last: int,
+    width: int,
+    max_q: int,
+    timer: StageTimer,
+    sent_windows: List[Tuple[int, int]],
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     """
-    Fallback local: si detecta encabezados candidatos en el sample, extrae líneas con '¿...?'.
+    Localizador + detector sobre extremos de `width` páginas, duplicando hasta el tope
+    (take_first/take_last). Al modelo sólo va una ventana que no esté contenida en otra ya
+    enviada (`sent_windows` se actualiza): si el crecimiento de la muestra no cambia la
+    ventana, no se repite la llamada. Devuelve (preguntas, texto enviado por última vez).
     """
-    r = PdfReader(BytesIO(sample_bytes))
-    buf = []
-    for p in range(len(r.pages)):
-        try:
-            buf.append(r.pages[p].extract_text() or "")
-        except Exception:
-            buf.append("")
-    txt = "\n".join(buf)
-
-    if any(re.search(v, txt, re.I) for v in _VARIANTS):
-        qs = []
-        for line in txt.splitlines():
-            s = line.strip()
-            if s and re.search(r"¿.+\?", s):
-                logger.info(f"la pregunta agregada es {s}")
-                qs.append(s)
-        return [{"id": f"q{i+1}", "text": q, "page_hint": None, "section_heading": None} for i, q in enumerate(qs)]
-    return []
+    questions: List[Dict[str, Any]] = []
+    detect_text: Optional[str] = None
+    while True:
+        f, l = min(width, take_first), min(width, take_last)
+        with timer.stage("localizador"):
+            window = _locate_detection_window(pdf, pdf.sample_ranges(f, l))
+        if window:
+            span = (window["start"], window["end"])
+            if _ranges_covered([span], sent_windows):
+                logger.info(f"🔎 Localizador ({f}/{l} págs.): misma ventana p.{span[0] + 1}–{span[1]}; sin nueva llamada.")
+            else:
+                sent_windows.append(span)
+                detect_text = pdf.text_for_ranges([span], page_marks=True)
+                logger.info(
+                    f"🔎 Localizador ({f}/{l} págs.): sección en p.{window['page'] + 1} → ventana "
+                    f"p.{span[0] + 1}–{span[1]} ({window['questions']} líneas '¿…?'); "
+                    f"~{estimate_tokens(detect_text)} tokens."
+                )
+                with timer.stage("deteccion"):
+                    questions = _detect_back_questions_via_model_text(detect_text, max_questions=max_q)
+                if questions:
+                    break
+                logger.info("🔎 Localizador: el detector no encontró preguntas en la ventana.")
+        if f >= take_first and l >= take_last:
+            break
+        width *= 2
+        logger.info(f"🔎 Muestreo adaptativo: nada en {f}/{l} págs.; ampliando a "
+                    f"{min(width, take_first)}/{min(width, take_last)}.")
+    return questions, detect_text
 
 # =============== Resolución del base_prompt dinámico ===============
 
@@ -265,182 +320,327 @@ def _resolve_base_prompt_doc_id(
         return env_map["default"]
     return None
 
-# ================== Helpers de PDF/Chunking ==================
+# ================== Chunking por presupuesto de tokens ==================
 
-def _extract_sample_pdf_bytes(data: bytes, take_first: int, take_last: int) -> bytes:
+def _build_text_chunks(pdf: ParsedPdf, params: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
-    Devuelve un PDF en bytes con primeras `take_first` y últimas `take_last` páginas (sin solapar).
-    PyMuPDF primero (rápido), PyPDF2 como fallback.
+    Chunks de texto del PDF completo con metadata de páginas y tokens estimados.
+      • chunk_token_budget > 0: empaqueta páginas hasta ese presupuesto (tope backq_chunk_max_pages).
+      • chunk_token_budget = 0: modo clásico de max(5, PDF_MAX_PAGES_PER_CHUNK) páginas fijas.
     """
-    try:
-        import fitz
-        src = fitz.open(stream=data, filetype="pdf")
-        total = src.page_count
-        first = max(0, min(int(take_first or 0), total))
-        last  = max(0, min(int(take_last  or 0), total))
-        first_end  = min(first, total)
-        last_start = max(0, total - last)
-        if last_start < first_end:
-            last_start = first_end
-        out = fitz.open()
-        if first_end > 0:
-            out.insert_pdf(src, from_page=0, to_page=first_end - 1)
-        if last_start < total:
-            out.insert_pdf(src, from_page=last_start, to_page=total - 1)
-        result = out.tobytes()
-        out.close()
-        src.close()
-        return result
-    except Exception:
-        pass
-
-    r = PdfReader(BytesIO(data))
-    n = len(r.pages)
-    w = PdfWriter()
-    first_count = min(max(0, int(take_first or 0)), n)
-    for i in range(first_count):
-        w.add_page(r.pages[i])
-    last_count = min(max(0, int(take_last or 0)), max(0, n - first_count))
-    for i in range(n - last_count, n):
-        if i >= first_count:
-            w.add_page(r.pages[i])
-    out = BytesIO()
-    w.write(out)
-    return out.getvalue()
-
-
-def _split_pdf_to_text_chunks(data: bytes, pages_per_chunk: int) -> List[str]:
-    r = PdfReader(BytesIO(data))
-    n = len(r.pages)
-    chunks = []
-    for start in range(0, n, pages_per_chunk):
-        end = min(start + pages_per_chunk, n)
-        texts = []
-        for i in range(start, end):
-            try:
-                texts.append(r.pages[i].extract_text() or "")
-            except Exception:
-                pass
-        chunks.append("\n".join(texts))
+    # `is None` explícito: un 0 por request (modo clásico / sin solape) no debe caer al default
+    budget = params.get("chunk_token_budget")
+    budget = int(settings.backq_chunk_token_budget if budget is None else budget)
+    overlap = params.get("chunk_overlap_pages")
+    overlap = int(settings.backq_chunk_overlap_pages if overlap is None else overlap)
+    if budget > 0:
+        chunks = pdf.token_chunks(
+            token_budget=budget,
+            max_pages=max(1, settings.backq_chunk_max_pages),
+            overlap_pages=overlap,
+        )
+        mode = f"presupuesto ~{budget} tokens"
+    else:
+        pages_per_chunk = max(5, settings.pdf_max_pages_per_chunk)
+        chunks = pdf.token_chunks(token_budget=0, max_pages=pages_per_chunk, overlap_pages=overlap)
+        mode = f"{pages_per_chunk} páginas/chunk"
+    total_tok = sum(c["est_tokens"] for c in chunks)
+    logger.info(f"Chunking: {len(chunks)} chunks ({mode}, solape={overlap} pág.), ~{total_tok} tokens en total.")
+    for c in chunks:
+        logger.info(f"  • chunk {c['idx']}: p.{c['page_start']}–{c['page_end']} ~{c['est_tokens']} tokens")
     return chunks
 
-def _select_topk_chunks_for_question(question: str, chunk_texts: List[str], k: int = 4) -> List[int]:
+# ================== Scoring de chunks ==================
+
+def _select_topk_chunks_for_question(
+    question: str,
+    chunk_texts: List[str],
+    k: int = 4,
+    *,
+    index: Optional[Any] = None,
+) -> List[int]:
     """
     Selección heurística por coincidencias de tokens (rápido, sin embeddings).
+    Con `index` (uno por job: ChunkIndex o Bm25Index) reutiliza el trabajo entre preguntas.
     """
-    q = re.sub(r"[^\w\sáéíóúüñÁÉÍÓÚÜÑ]", " ", (question or "").lower())
-    tokens = [t for t in q.split() if len(t) > 2]
-    scores = []
-    for idx, txt in enumerate(chunk_texts):
-        t = (txt or "").lower()
-        sc = sum(t.count(tok) for tok in tokens)
-        scores.append((sc, idx))
-    scores.sort(reverse=True)
-    top = [idx for sc, idx in scores[:k] if sc > 0]
-    return top or list(range(0, min(k, len(chunk_texts))))
+    return (index or ChunkIndex(chunk_texts)).topk(question, k)
 
 # ================== Router de preguntas → chunks ==================
 
+_PAGE_REF = re.compile(r"\b(?:p[áa]g(?:ina)?s?\.?|p\.)\s*(\d{1,5})\b", re.I)
+
+
+def _question_page_hints(q: Dict[str, Any]) -> List[int]:
+    """Páginas (1-based) a las que apunta la pregunta: `page_hint` del detector + 'p. 45' / 'página 45' en el texto."""
+    pages: List[int] = []
+    try:
+        ph = int(q.get("page_hint"))
+        if ph > 0:
+            pages.append(ph)
+    except (TypeError, ValueError):
+        pass
+    pages.extend(int(m) for m in _PAGE_REF.findall(q.get("text") or "") if int(m) > 0)
+    return list(dict.fromkeys(pages))
+
+
+def _hint_chunks(pages: List[int], page_ranges: Optional[List[Tuple[int, int]]]) -> List[int]:
+    """Chunks cuyo rango de páginas (1-based, inclusivo) cubre alguna de `pages`."""
+    if not pages or not page_ranges:
+        return []
+    out: List[int] = []
+    for p in pages:
+        out.extend(c for c, (a, b) in enumerate(page_ranges) if a <= p <= b and c not in out)
+    return out
+
+
 def _route_questions_to_chunks(
     questions: List[Dict[str, Any]],
     chunk_texts: List[str],
     *,
     k_top: int,
     min_cover: int,
-    chunk_cap: int
+    chunk_cap: int,
+    index: Optional[Any] = None,
+    page_ranges: Optional[List[Tuple[int, int]]] = None,
+    log_coverage: bool = True,
 ) -> Dict[int, List[Dict[str, str]]]:
+    """
+    Router greedy. Con `page_ranges` (páginas de cada chunk) los chunks que cubren el
+    `page_hint` de la pregunta se fijan primero y ocupan lugares del Top-K.
+    """
     num_chunks = len(chunk_texts)
     if num_chunks == 0:
         return {}
-    sentry = [0, max(0, num_chunks - 1)]
-
-    prelim = defaultdict(list)    # chunk_idx -> [qid]
-    assigned = defaultdict(list)  # qid -> [chunk_idx]
-
-    # Pre-asignación por scorer
-    for q in questions:
-        qid, qtext = q["id"], q["text"]
-        top_idx = _select_topk_chunks_for_question(qtext, chunk_texts, k=k_top)
-        if not top_idx:
-            top_idx = sentry[:]
-        for c in top_idx:
-            c = max(0, min(num_chunks - 1, c))
-            prelim[c].append(qid)
-            assigned[qid].append(c)
-
-    # Cobertura mínima
-    for q in questions:
-        qid = q["id"]
-        cur = list(dict.fromkeys(assigned[qid]))
-        while len(cur) < min_cover:
-            for sc in sentry:
-                if sc not in cur:
-                    prelim[sc].append(qid)
-                    cur.append(sc)
-                if len(cur) >= min_cover:
-                    break
-        assigned[qid] = cur
+    index = index or ChunkIndex(chunk_texts)
+    index.prepare(q["text"] for q in questions)  # BM25: todas las preguntas en una sola operación
+    last = max(0, num_chunks - 1)
+    sentry = [0, last]
 
-    # Cap por chunk y derrame con preferencia
-    routing = defaultdict(list)
-    q_order = {}
+    # Mapas por id (O(1)); dict como conjunto ordenado → nunca la misma pregunta dos veces en un chunk
+    by_id: Dict[str, Dict[str, Any]] = {}
     for q in questions:
-        qid, qtext = q["id"], q["text"]
-        order = _select_topk_chunks_for_question(qtext, chunk_texts, k=max(k_top, min_cover)) or sentry[:]
+        by_id.setdefault(q["id"], q)
+    prelim: Dict[int, Dict[str, None]] = defaultdict(dict)  # chunk_idx -> {qid}
+    q_rank: Dict[str, Dict[int, int]] = {}                 # qid -> {chunk_idx: posición en su ranking}
+    q_order: Dict[str, List[int]] = {}
+
+    # Pre-asignación por scorer + cobertura mínima (no puede exceder el nº de chunks)
+    need = min(min_cover, num_chunks)
+    for qid, q in by_id.items():
+        pins = _hint_chunks(_question_page_hints(q), page_ranges)
+        order = _select_topk_chunks_for_question(q["text"], chunk_texts, k=max(k_top, min_cover), index=index) or sentry
+        order = list(dict.fromkeys(pins + [max(0, min(last, c)) for c in order]))
         q_order[qid] = order
+        q_rank[qid] = {c: i for i, c in enumerate(order)}
+        cur = list(dict.fromkeys(order[:max(k_top, len(pins))] or sentry))
+        for sc in sentry:
+            if len(cur) >= need:
+                break
+            if sc not in cur:
+                cur.append(sc)
+        for c in cur:
+            prelim[c][qid] = None
 
-    overflow = []
+    # Cap por chunk y derrame con preferencia
+    placed: Dict[int, Dict[str, None]] = defaultdict(dict)  # chunk_idx -> {qid} ya ruteadas
+    overflow: List[str] = []
     for cidx in range(num_chunks):
-        qids = prelim[cidx]
-        if len(qids) <= chunk_cap:
-            for qid in qids:
-                qobj = next(x for x in questions if x["id"] == qid)
-                routing[cidx].append({"id": qobj["id"], "text": qobj["text"]})
-        else:
-            def priority(qid): return q_order[qid].index(cidx) if cidx in q_order[qid] else 999
-            qids.sort(key=priority)
-            keep, spill = qids[:chunk_cap], qids[chunk_cap:]
-            for qid in keep:
-                qobj = next(x for x in questions if x["id"] == qid)
-                routing[cidx].append({"id": qobj["id"], "text": qobj["text"]})
-            for qid in spill:
-                placed = False
-                for alt in q_order[qid]:
-                    if alt == cidx:
-                        continue
-                    if len(routing[alt]) < chunk_cap:
-                        qobj = next(x for x in questions if x["id"] == qid)
-                        routing[alt].append({"id": qobj["id"], "text": qobj["text"]})
-                        placed = True
-                        break
-                if not placed:
-                    overflow.append(qid)
-
-    # Derrame final al último chunk si quedó algo
+        qids = [qid for qid in prelim.get(cidx, ()) if qid not in placed[cidx]]
+        room = max(0, chunk_cap - len(placed[cidx]))  # derrames previos ya ocupan lugar
+        if len(qids) > room:
+            qids.sort(key=lambda qid: q_rank[qid].get(cidx, 999))  # estable: empates en orden de llegada
+        keep, spill = qids[:room], qids[room:]
+        for qid in keep:
+            placed[cidx][qid] = None
+        for qid in spill:
+            for alt in q_order[qid]:
+                if alt == cidx or qid in placed[alt] or qid in prelim.get(alt, ()):
+                    continue
+                if len(placed[alt]) < chunk_cap:
+                    placed[alt][qid] = None
+                    break
+            else:
+                overflow.append(qid)
+
+    # Derrame final: último chunk si tiene lugar; si no, el chunk menos cargado (sólo se excede
+    # `chunk_cap` cuando todos los chunks están llenos). Sin duplicar.
     for qid in overflow:
-        last = max(0, num_chunks - 1)
-        qobj = next(x for x in questions if x["id"] == qid)
-        routing[last].append({"id": qobj["id"], "text": qobj["text"]})
+        if any(qid in placed[c] for c in range(num_chunks)):
+            continue
+        target = last if len(placed[last]) < chunk_cap else min(range(num_chunks), key=lambda c: len(placed[c]))
+        placed[target][qid] = None
+
+    routing: Dict[int, List[Dict[str, str]]] = defaultdict(list)
+    for cidx in sorted(placed):
+        if placed[cidx]:
+            routing[cidx] = [{"id": qid, "text": by_id[qid]["text"]} for qid in placed[cidx]]
 
-    # Log de cobertura por pregunta
-    cover = defaultdict(list)
+    if log_coverage:
+        _log_coverage(routing, by_id)
+    return routing
+
+
+def _log_coverage(routing: Dict[int, List[Dict[str, str]]], qids) -> None:
+    """Log de cobertura por pregunta."""
+    cover: Dict[str, List[int]] = defaultdict(list)
     for cidx, lst in routing.items():
         for q in lst:
             cover[q["id"]].append(cidx)
-    for q in questions:
-        logger.info(f"🧭 Q[{q['id']}] cubierta en chunks: {sorted(cover[q['id']])}")
+    for qid in qids:
+        logger.info(f"🧭 Q[{qid}] cubierta en chunks: {cover[qid]}")
 
+
+def _plan_questions_to_chunks(
+    questions: List[Dict[str, Any]],
+    chunk_texts: List[str],
+    *,
+    k_top: int,
+    min_cover: int,
+    chunk_cap: int,
+    index: Optional[Any] = None,
+    page_ranges: Optional[List[Tuple[int, int]]] = None,
+    log_coverage: bool = True,
+) -> Dict[int, List[Dict[str, str]]]:
+    """
+    Planificador (router="planner"): minimiza el nº de llamadas MAP.
+    Set-cover ponderado, greedy perezoso: abre primero el chunk que cubre más demanda
+    pendiente (hasta `chunk_cap` preguntas; empate → mejor posición en los rankings).
+    Candidatos de cada pregunta: sus Top-max(k_top, min_cover) chunks (+0/último si no alcanzan);
+    con `page_ranges`, los chunks que cubren su `page_hint` van primero (mayor peso).
+    La demanda que ya no cabe en sus candidatos se acomoda en chunks ya abiertos con lugar
+    (no suma llamadas); si una pregunta quedara sin cobertura, va al último chunk.
+    """
+    num_chunks = len(chunk_texts)
+    if num_chunks == 0:
+        return {}
+    index = index or ChunkIndex(chunk_texts)
+    index.prepare(q["text"] for q in questions)
+    last = max(0, num_chunks - 1)
+    need_cover = min(min_cover, num_chunks)
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for q in questions:
+        by_id.setdefault(q["id"], q)
+    need: Dict[str, int] = {}
+    cands: Dict[int, Dict[str, int]] = defaultdict(dict)  # chunk_idx -> {qid: posición en su ranking}
+    q_order: Dict[str, List[int]] = {}
+    for qid, q in by_id.items():
+        pins = _hint_chunks(_question_page_hints(q), page_ranges)
+        order = _select_topk_chunks_for_question(q["text"], chunk_texts, k=max(k_top, min_cover), index=index)
+        order = list(dict.fromkeys(pins + [max(0, min(last, c)) for c in order]))
+        for sc in (0, last):
+            if len(order) >= need_cover:
+                break
+            if sc not in order:
+                order.append(sc)
+        q_order[qid] = order
+        need[qid] = need_cover
+        for rank, c in enumerate(order):
+            cands[c][qid] = rank
+
+    def gain(c: int):
+        elig = sorted((rank, qid) for qid, rank in cands[c].items() if need[qid] > 0)[:chunk_cap]
+        return len(elig), sum(1.0 / (1 + rank) for rank, _ in elig), elig
+
+    placed: Dict[int, Dict[str, None]] = {}
+    heap = []
+    for c in cands:
+        n, w, _ = gain(c)
+        heapq.heappush(heap, (-n, -w, c))
+    while heap:
+        _, _, c = heapq.heappop(heap)
+        n, w, elig = gain(c)
+        if n == 0:
+            continue
+        if heap and (-n, -w, c) > heap[0]:
+            heapq.heappush(heap, (-n, -w, c))  # ganancia desactualizada: reevaluar más tarde
+            continue
+        placed[c] = {}
+        for _, qid in elig:
+            placed[c][qid] = None
+            need[qid] -= 1
+
+    # Demanda restante (candidatos llenos): chunks ya abiertos con lugar, luego el último chunk
+    for qid, left in need.items():
+        if left <= 0:
+            continue
+        rank = {c: i for i, c in enumerate(q_order[qid])}
+        for c in sorted(placed, key=lambda c: rank.get(c, num_chunks + c)):
+            if left <= 0:
+                break
+            if qid not in placed[c] and len(placed[c]) < chunk_cap:
+                placed[c][qid] = None
+                left -= 1
+        if left == need_cover:
+            placed.setdefault(last, {})[qid] = None
+
+    routing: Dict[int, List[Dict[str, str]]] = defaultdict(list)
+    for cidx in sorted(placed):
+        routing[cidx] = [{"id": qid, "text": by_id[qid]["text"]} for qid in placed[cidx]]
+    if log_coverage:
+        _log_coverage(routing, by_id)
     return routing
 
+
+def _routing_stats(
+    routing: Dict[int, List[Dict[str, str]]],
+    questions: List[Dict[str, Any]],
+    page_ranges: List[Tuple[int, int]],
+) -> Dict[str, Any]:
+    """Métricas de calidad del ruteo: llamadas MAP, asignaciones y aciertos de page_hint."""
+    cover: Dict[str, set] = defaultdict(set)
+    for cidx, lst in routing.items():
+        for q in lst:
+            cover[q["id"]].add(cidx)
+    calls = sum(1 for lst in routing.values() if lst)
+    assignments = sum(len(lst) for lst in routing.values())
+    hinted = hits = hit_assignments = 0
+    for q in questions:
+        pins = set(_hint_chunks(_question_page_hints(q), page_ranges))
+        if not pins:
+            continue
+        hinted += 1
+        hits += bool(pins & cover[q["id"]])
+        hit_assignments += len(pins & cover[q["id"]])
+    return {
+        "calls": calls,
+        "assignments": assignments,
+        "hinted": hinted,
+        "hint_hits": hits,
+        # fracción de asignaciones que caen en el chunk señalado por la pista
+        "hint_precision": round(hit_assignments / assignments, 3) if assignments else 0.0,
+    }
+
 # ================== MAP/REDUCE específicos del híbrido ==================
 
+def _map_context(
+    chunk: Dict[str, Any], q_subset: List[Dict[str, str]], token_budget: int, window_tokens: int
+) -> Tuple[str, bool]:
+    """
+    Contexto de MAP: solo las ventanas del chunk relevantes para `q_subset` (con marcas de
+    página) hasta `token_budget` tokens. Con presupuesto 0, o chunk ya pequeño → chunk completo.
+    Devuelve (texto, es_chunk_completo): sólo un chunk completo se repite entre preguntas.
+    """
+    if token_budget <= 0 or chunk["est_tokens"] <= token_budget:
+        return chunk["text"], True
+    passages = PassageIndex(
+        chunk["text"],
+        page_start=chunk["page_start"],
+        page_offsets=chunk.get("page_offsets"),
+        window_tokens=window_tokens,
+    )
+    context = passages.context_for([q["text"] for q in q_subset], token_budget)
+    return context, context == chunk["text"]  # sin coincidencias, `context_for` devuelve el chunk completo
+
+
 def _map_chunk_answers_json_from_text(chunk_text: str, chunk_id: int, q_subset: List[Dict[str, str]]) -> Dict[str, Any]:
     prompt = (
         "Eres analista. Te doy el TEXTO de un fragmento (chunk) de un PDF legal y una lista de preguntas.\n"
         "Responde SOLO las preguntas cuya respuesta esté sustentada EN ESTE CHUNK (texto adjunto).\n"
         "Devuelve JSON estricto:\n"
         "{ \"chunk_id\": <int>, \"answers\": [ {\"id\":\"<qid>\", \"answer\":\"<texto>\"} ] }\n"
-        "Si no hay evidencia para una pregunta en este chunk, NO la incluyas. No inventes."
+        "Si no hay evidencia para una pregunta en este chunk, NO la incluyas. No inventes.\n"
+        "El texto puede venir en pasajes separados por [… ] con marcas de página [p. N]."
     )
     qs_json = json.dumps([{"id": q["id"], "text": q["text"]} for q in q_subset], ensure_ascii=False)
     full_prompt = (
@@ -448,32 +648,247 @@ def _map_chunk_answers_json_from_text(chunk_text: str, chunk_id: int, q_subset:
         f"Preguntas:\n{qs_json}\n\n"
         f"[CHUNK_TEXT]\n<<<\n{chunk_text}\n>>>"
     )
-    raw = generate_text(full_prompt, model_id=settings.map_model_id)
+    raw = generate_json(full_prompt, model_id=settings.map_model_id, response_schema=_MAP_SCHEMA)
     try:
-        data = _safe_json_loads(raw)
+        data = parse_json_object(raw, array_key="answers", kind="map")
     except Exception:
-        logger.warning(f"MAP chunk {chunk_id}: JSON inválido.")
+        logger.warning(f"MAP chunk {chunk_id}: JSON inválido (len={len(raw)}).")
         data = {"chunk_id": chunk_id, "answers": []}
     out = {"chunk_id": chunk_id, "answers": []}
     for a in data.get("answers", []):
+        if not isinstance(a, dict):
+            continue
         qid = (a.get("id") or "").strip()
         ans = (a.get("answer") or "").strip()
         if qid and ans:
             out["answers"].append({"id": qid, "answer": ans})
     return out
 
-def _reduce_answers_for_question(system_text: str, base_prompt: str, qtext: str, candidates: List[str]) -> str:
+def _run_map_chunk(
+    cidx: int, context: str, q_subset: List[Dict[str, str]], throttle_s: float
+) -> Tuple[List[Dict[str, str]], float]:
+    """
+    Una llamada MAP (se ejecuta en el pool): 429 → reintento con la mitad de las preguntas.
+    Nunca lanza; devuelve (respuestas, segundos).
+    """
+    t0 = time.perf_counter()
+    answers: List[Dict[str, str]] = []
+    try:
+        answers = _map_chunk_answers_json_from_text(context, cidx, q_subset).get("answers", [])
+    except gex.ResourceExhausted:
+        logger.warning(f"429 en MAP chunk {cidx}. Reintentando con subset reducido…")
+        # Degradación: mitad de preguntas
+        small_subset = q_subset[: max(1, len(q_subset) // 2)]
+        try:
+            answers = _map_chunk_answers_json_from_text(context, cidx, small_subset).get("answers", [])
+        except Exception as e2:
+            logger.warning(f"MAP chunk {cidx} degradado también falló: {e2}")
+    except Exception as e:
+        logger.warning(f"MAP chunk {cidx} falló: {e}")
+    secs = time.perf_counter() - t0
+    if throttle_s > 0:
+        time.sleep(throttle_s)  # pausa por worker (no bloquea a los demás)
+    return answers, secs
+
+def _prompt_header(system_text: str, base_prompt: str) -> str:
+    """[SYSTEM] + [PROMPT_BASE]: prefijo idéntico en todas las llamadas REDUCE/per-pregunta del job."""
+    return f"[SYSTEM]\n{system_text}\n\n[PROMPT_BASE]\n{base_prompt}\n\n"
+
+def _generate_prefixed(
+    segments: List[str],
+    suffix: str,
+    *,
+    model_id: str,
+    ctx_cache: Optional[ContextCache] = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Llamada con prefijos reutilizables: vía context cache si aplica; si no, prompt completo."""
+    config = {"response_mime_type": "application/json", "response_schema": response_schema} if response_schema else None
+    if ctx_cache is not None:
+        out = ctx_cache.generate(segments, suffix, model_id=model_id, generation_config=config)
+        if out is not None:
+            return out
+    if response_schema:
+        return generate_json("".join(segments) + suffix, model_id=model_id, response_schema=response_schema)
+    return generate_text("".join(segments) + suffix, model_id=model_id)
+
+def _run_map_pool(
+    map_jobs: List[Tuple[int, str, List[Dict[str, str]]]],
+    *,
+    workers: int,
+    throttle_s: float,
+    on_progress=None,
+) -> Tuple[Dict[str, List[str]], float]:
+    """
+    Ejecuta las llamadas MAP (cidx, contexto, preguntas) en un pool acotado a `workers`.
+    `on_progress(hechas, total)` se llama a medida que termina cada una. Las respuestas se
+    fusionan por id de chunk (orden determinista, independiente del orden de llegada).
+    Devuelve ({qid: [respuestas]}, segundos de la llamada más lenta).
+    """
+    results: Dict[int, List[Dict[str, str]]] = {}
+    slowest = 0.0
+    total = len(map_jobs)
+    if map_jobs:
+        with ThreadPoolExecutor(max_workers=min(max(1, workers), total), thread_name_prefix="bq-map") as map_pool:
+            futures = {
+                map_pool.submit(_run_map_chunk, cidx, context, q_subset, throttle_s): cidx
+                for cidx, context, q_subset in map_jobs
+            }
+            for done, fut in enumerate(as_completed(futures), 1):
+                results[futures[fut]], secs = fut.result()
+                slowest = max(slowest, secs)
+                if on_progress is not None:
+                    on_progress(done, total)
+    partials: Dict[str, List[str]] = defaultdict(list)
+    for cidx in sorted(results):
+        for a in results[cidx]:
+            partials[a["id"]].append(a["answer"])
+    return partials, slowest
+
+def _reduce_answers_for_question(
+    system_text: str,
+    base_prompt: str,
+    qtext: str,
+    candidates: List[str],
+    *,
+    ctx_cache: Optional[ContextCache] = None,
+    model_id: Optional[str] = None,
+) -> str:
     if not candidates:
-        return "_(No se encontró evidencia suficiente en este documento para responder esta pregunta)_"
-    prompt = (
-        f"[SYSTEM]\n{system_text}\n\n"
-        f"[PROMPT_BASE]\n{base_prompt}\n\n"
+        return _NO_EVIDENCE
+    suffix = (
         f"Pregunta: {qtext}\n\n"
         "Candidatos (extractos provenientes de distintos fragmentos):\n" +
         "\n---\n".join(candidates) + "\n\n"
         "Instrucción: sintetiza UNA respuesta final clara basada SOLO en los candidatos. No inventes."
     )
-    return generate_text(prompt, model_id=settings.reduce_model_id)
+    return _generate_prefixed(
+        [_prompt_header(system_text, base_prompt)], suffix,
+        model_id=model_id or settings.reduce_model_id, ctx_cache=ctx_cache,
+    )
+
+def _reduce_batches(
+    items: List[Tuple[str, str, List[str]]], *, batch_tokens: int, batch_size: int
+) -> List[List[Tuple[str, str, List[str]]]]:
+    """Agrupa (id, pregunta, candidatos) en orden hasta `batch_tokens` tokens o `batch_size` preguntas."""
+    batches: List[List[Tuple[str, str, List[str]]]] = []
+    cur: List[Tuple[str, str, List[str]]] = []
+    cur_tok = 0
+    for item in items:
+        cost = estimate_tokens(item[1]) + sum(estimate_tokens(c) for c in item[2])
+        if cur and (cur_tok + cost > batch_tokens or len(cur) >= batch_size):
+            batches.append(cur)
+            cur, cur_tok = [], 0
+        cur.append(item)
+        cur_tok += cost
+    if cur:
+        batches.append(cur)
+    return batches
+
+def _reduce_batch_call(
+    system_text: str,
+    base_prompt: str,
+    batch: List[Tuple[str, str, List[str]]],
+    *,
+    model_id: str,
+    ctx_cache: Optional[ContextCache] = None,
+) -> Dict[str, str]:
+    """Una llamada REDUCE para varias preguntas → {qid: respuesta}; las que falten quedan fuera."""
+    payload = json.dumps(
+        [{"id": qid, "pregunta": qtext, "candidatos": cands} for qid, qtext, cands in batch], ensure_ascii=False
+    )
+    suffix = (
+        "Preguntas con sus candidatos (extractos provenientes de distintos fragmentos):\n"
+        f"{payload}\n\n"
+        "Instrucción: para CADA pregunta sintetiza UNA respuesta final clara basada SOLO en SUS candidatos. "
+        "No mezcles preguntas. No inventes.\n"
+        "Devuelve JSON: { \"answers\": [ {\"id\":\"<id>\", \"answer\":\"<texto>\"} ] }"
+    )
+    raw = _generate_prefixed(
+        [_prompt_header(system_text, base_prompt)], suffix,
+        model_id=model_id, ctx_cache=ctx_cache, response_schema=_REDUCE_SCHEMA,
+    )
+    data = parse_json_object(raw, array_key="answers", kind="reduce")
+    wanted = {qid for qid, _, _ in batch}
+    out: Dict[str, str] = {}
+    for a in data.get("answers", []):
+        if not isinstance(a, dict):
+            continue
+        qid = str(a.get("id") or "").strip()
+        ans = (a.get("answer") or "").strip()
+        if qid in wanted and ans:
+            out[qid] = ans
+    return out
+
+_REDUCE_SINGLE_MODES = ("skip", "flash", "pro")
+
+def _reduce_answers_batched(
+    system_text: str,
+    base_prompt: str,
+    questions: List[Dict[str, Any]],
+    partials: Dict[str, List[str]],
+    *,
+    batch_tokens: int,
+    batch_size: int,
+    single_mode: str,
+    single_max_tokens: int,
+    ctx_cache: Optional[ContextCache] = None,
+) -> Dict[str, str]:
+    """
+    REDUCE de todas las preguntas → {qid: respuesta final}.
+      • Sin candidatos → sin llamada (mensaje de "sin evidencia").
+      • 1 candidato corto (<= `single_max_tokens`): `single_mode` "skip" lo usa tal cual,
+        "flash" lo sintetiza en lotes con el modelo MAP, "pro" lo trata como el resto.
+      • Resto: lotes de varias preguntas por llamada (Pro) hasta `batch_tokens`/`batch_size`,
+        con salida JSON por id. Un lote de 1, un lote fallido o ids faltantes → REDUCE individual.
+    Un `single_mode` desconocido se avisa en el log y se trata como "skip" (el default).
+    """
+    if single_mode not in _REDUCE_SINGLE_MODES:
+        logger.warning(f"reduce_single_candidate={single_mode!r} no reconocido "
+                       f"(opciones: {', '.join(_REDUCE_SINGLE_MODES)}); se usa 'skip'.")
+        single_mode = "skip"
+    out: Dict[str, str] = {}
+    pro_items: List[Tuple[str, str, List[str]]] = []
+    flash_items: List[Tuple[str, str, List[str]]] = []
+    skipped = 0
+    for q in questions:
+        qid, qtext = q["id"], q["text"]
+        cands = partials.get(qid, [])
+        if not cands:
+            out[qid] = _NO_EVIDENCE
+        elif len(cands) == 1 and single_mode != "pro" and estimate_tokens(cands[0]) <= single_max_tokens:
+            if single_mode == "skip":
+                out[qid] = cands[0]
+                skipped += 1
+            else:
+                flash_items.append((qid, qtext, cands))
+        else:
+            pro_items.append((qid, qtext, cands))
+
+    calls = 0
+    for items, model_id in ((pro_items, settings.reduce_model_id), (flash_items, settings.map_model_id)):
+        for batch in _reduce_batches(items, batch_tokens=batch_tokens, batch_size=batch_size):
+            got: Dict[str, str] = {}
+            if len(batch) > 1:
+                calls += 1
+                try:
+                    got = _reduce_batch_call(system_text, base_prompt, batch, model_id=model_id, ctx_cache=ctx_cache)
+                except Exception as e:
+                    logger.warning(f"REDUCE en lote ({len(batch)} preguntas) falló ({e}); se reduce individualmente.")
+            for qid, qtext, cands in batch:
+                if qid not in got:
+                    calls += 1
+                    got[qid] = _reduce_answers_for_question(
+                        system_text, base_prompt, qtext, cands, ctx_cache=ctx_cache, model_id=model_id
+                    )
+            out.update(got)
+
+    logger.info(
+        f"🧩 REDUCE: {len(questions)} preguntas en {calls} llamadas "
+        f"({len(pro_items)} con Pro, {len(flash_items)} con Flash, {skipped} sin llamada por candidato único, "
+        f"{len(questions) - len(pro_items) - len(flash_items) - skipped} sin evidencia)."
+    )
+    return out
 
 # ================== Fallback per-pregunta ==================
 
@@ -483,34 +898,42 @@ def _answer_one_question_over_text_chunks(
     system_text: str,
     base_prompt: str,
     selected_chunk_texts: List[str],
-    params: Dict[str, Any]
+    params: Dict[str, Any],
+    ctx_cache: Optional[ContextCache] = None,
+    whole_chunks: Optional[List[bool]] = None,
 ) -> str:
+    """
+    MAP + REDUCE de una pregunta sobre `selected_chunk_texts`. `whole_chunks[i]` indica que el
+    texto i es el chunk completo (se repite entre preguntas) y puede ir en el prefijo cacheado;
+    los pasajes propios de la pregunta van en el sufijo y sólo se cachea el header.
+    """
     enriched_params = dict(params or {})
     enriched_params["question"] = question_text
     enriched_params["objetivo"] = "responder_pregunta_de_regreso"
 
     # MAP: respuestas parciales por chunk (texto)
+    header = _prompt_header(system_text, base_prompt)
+    map_model = getattr(settings, "map_model_id", settings.vertex_model_id)
     partials: List[str] = []
-    total = len(selected_chunk_texts)
     for i, txt in enumerate(selected_chunk_texts, start=1):
-        sub_prompt = (
-            f"[SYSTEM]\n{system_text}\n\n"
-            f"[PROMPT_BASE]\n{base_prompt}\n\n"
-            f"[INPUT_CHUNK {i}/{total}]\n<<<\n{txt}\n>>>\n\n"
-            f"[PARAMS]\n{enriched_params}\n"
-        )
-        partial = generate_text(sub_prompt, model_id=getattr(settings, "map_model_id", settings.vertex_model_id))
+        chunk_part = f"[INPUT_CHUNK]\n<<<\n{txt}\n>>>\n\n"
+        params_part = f"[PARAMS]\n{enriched_params}\n"
+        if whole_chunks and whole_chunks[i - 1]:
+            segments, suffix = [header, chunk_part], params_part
+        else:
+            segments, suffix = [header], chunk_part + params_part
+        partial = _generate_prefixed(segments, suffix, model_id=map_model, ctx_cache=ctx_cache)
         partials.append(f"### CHUNK {i}\n{partial}")
 
     # REDUCE
-    reduce_prompt = (
-        f"[SYSTEM]\n{system_text}\n\n"
-        f"[PROMPT_BASE]\n{base_prompt}\n\n"
+    suffix = (
         f"Pregunta: {question_text}\n\n"
         "[PARTIALS]\n" + "\n\n".join(partials) + "\n\n"
         "Instrucción: Fusiona y sintetiza una sola respuesta final basada SOLO en los parciales. No inventes."
     )
-    return generate_text(reduce_prompt, model_id=getattr(settings, "reduce_model_id", settings.vertex_model_id))
+    return _generate_prefixed(
+        [header], suffix, model_id=getattr(settings, "reduce_model_id", settings.vertex_model_id), ctx_cache=ctx_cache
+    )
 
 # =============== Helpers de progreso (Google Sheets) ===============
 
@@ -560,6 +983,87 @@ def process_back_questions_job(
     row: Optional[int] = None,
     col: Optional[int] = None,
     additional_params: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Punto de entrada del job. Envuelve la orquestación para reportar
+    tiempos por etapa y pico de RSS del proceso y de sus workers (éxito o error).
+    Las etapas independientes (descarga ∥ prompts, chunking ∥ detección) corren
+    en un pool de 2 hilos propio del job.
+    """
+    timer = StageTimer()
+    pipeline = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bq-pipeline")
+    ctx_cache = new_context_cache()
+    try:
+        return _run_back_questions_job(
+            timer=timer,
+            pipeline=pipeline,
+            ctx_cache=ctx_cache,
+            system_instructions_doc_id=system_instructions_doc_id,
+            base_prompt_doc_id=base_prompt_doc_id,
+            pdf_url=pdf_url,
+            output_doc_id=output_doc_id,
+            drive_file_id=drive_file_id,
+            sampling_first_pages=sampling_first_pages,
+            sampling_last_pages=sampling_last_pages,
+            sheet_id=sheet_id,
+            row=row,
+            col=col,
+            additional_params=additional_params,
+        )
+    finally:
+        pipeline.shutdown(wait=False, cancel_futures=True)
+        ctx_stats = ctx_cache.stats()
+        if ctx_stats["cached_calls"]:
+            logger.info(f"🧊 Context cache: {ctx_stats['prefixes']} prefijo(s), {ctx_stats['cached_calls']} llamadas "
+                        f"con prefijo cacheado, ~{ctx_stats['tokens_saved']} tokens no reenviados.")
+        ctx_cache.close()
+        logger.info(f"⏱️ Etapas: {timer.summary()}")
+        # Picos del proceso (no del job: incluyen jobs anteriores o concurrentes de la instancia)
+        logger.info(f"📈 Back-Questions: {timer.elapsed():.1f}s | pico RSS proceso = {peak_rss_mb():.0f} MB, "
+                    f"workers = {children_peak_rss_mb():.0f} MB")
+        for kind, c in parse_stats().items():
+            if c["recovered"] or c["failed"]:
+                total = sum(c.values())
+                logger.info(f"🧾 JSON {kind} (proceso): {c['ok']} ok, {c['recovered']} recuperados, "
+                            f"{c['failed']} fallidos ({100.0 * c['failed'] / total:.1f}% de fallas).")
+        cache_stats = response_cache_stats()
+        if cache_stats is not None:
+            logger.info(f"💾 Cache de respuestas (proceso): {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+
+def _download_pdf(fid: str):
+    assert_sa_has_access(fid, use_docs_api=False)  # archivo binario → Drive API
+    return download_file_to_tempfile(fid)
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _discard_download(fut: Future) -> None:
+    """Espera una descarga en curso y borra el archivo (el job abortó antes de usarlo)."""
+    try:
+        path, _ = fut.result()
+    except Exception:
+        return
+    _remove_quietly(path)
+
+def _run_back_questions_job(
+    *,
+    timer: StageTimer,
+    pipeline: ThreadPoolExecutor,
+    ctx_cache: Optional[ContextCache],
+    system_instructions_doc_id: str,
+    base_prompt_doc_id: Optional[str],
+    pdf_url: str,
+    output_doc_id: str,
+    drive_file_id: Optional[str],
+    sampling_first_pages: int,
+    sampling_last_pages: int,
+    sheet_id: Optional[str],
+    row: Optional[int],
+    col: Optional[int],
+    additional_params: Dict[str, Any],
 ) -> Dict[str, Any]:
     logger.info("🏁 Back-Questions: inicio de job.")
 
@@ -567,233 +1071,379 @@ def process_back_questions_job(
     _sheet_update = _make_sheet_updater(sheet_id, row, col)
     _sheet_update(status="10% Inicio")
 
-    # Accesos mínimos
-    for fid in (system_instructions_doc_id, output_doc_id):
-        assert_sa_has_access(fid)
-
-    # System + base prompt dinámico
-    system_text = get_document_content(system_instructions_doc_id)
-    visa_type = (additional_params or {}).get("visa_type")
-    base_prompt_ids_from_req = (additional_params or {}).get("base_prompt_ids") or {}
-    resolved_base_prompt_id = _resolve_base_prompt_doc_id(
-        explicit_base_prompt_doc_id=base_prompt_doc_id,
-        visa_type=visa_type,
-        base_prompt_ids_from_req=base_prompt_ids_from_req,
-    )
-    if not resolved_base_prompt_id:
-        raise ValueError("No se pudo resolver base_prompt_doc_id (ni explícito, ni por visa_type, ni por 'default').")
-    assert_sa_has_access(resolved_base_prompt_id)
-    base_prompt = get_document_content(resolved_base_prompt_id)
-    _sheet_update(status="20% Prompts listos")
-
-    # Resolver PDF (Drive) → bytes locales
+    # Resolver PDF (Drive) → archivo temporal local (descarga en streaming).
+    # La descarga corre en el pipeline mientras se leen los prompts (Docs API).
     if pdf_url.startswith("gs://"):
         raise RuntimeError("Para muestreo por páginas con 'gs://', implemente descarga GCS o use Drive.")
     fid = drive_file_id or parse_drive_url_to_id(pdf_url)
     if not fid:
         raise ValueError("pdf_url no es gs:// y no se pudo extraer drive_file_id.")
-    assert_sa_has_access(fid, use_docs_api=False)
-    bytes_local = download_file_bytes(fid)
+    download_future = pipeline.submit(timer.timed, "descarga(bg)", _download_pdf, fid)
+
+    try:
+        with timer.stage("prompts"):
+            # Accesos mínimos
+            for doc_id in (system_instructions_doc_id, output_doc_id):
+                assert_sa_has_access(doc_id)
+
+            # System + base prompt dinámico
+            system_text = get_document_content(system_instructions_doc_id)
+            visa_type = (additional_params or {}).get("visa_type")
+            base_prompt_ids_from_req = (additional_params or {}).get("base_prompt_ids") or {}
+            resolved_base_prompt_id = _resolve_base_prompt_doc_id(
+                explicit_base_prompt_doc_id=base_prompt_doc_id,
+                visa_type=visa_type,
+                base_prompt_ids_from_req=base_prompt_ids_from_req,
+            )
+            if not resolved_base_prompt_id:
+                raise ValueError("No se pudo resolver base_prompt_doc_id (ni explícito, ni por visa_type, ni por 'default').")
+            assert_sa_has_access(resolved_base_prompt_id)
+            base_prompt = get_document_content(resolved_base_prompt_id)
+    except Exception:
+        _discard_download(download_future)
+        raise
+    _sheet_update(status="20% Prompts listos")
+
+    with timer.stage("espera_descarga"):
+        pdf_path, pdf_sha256 = download_future.result()
     _sheet_update(status="30% PDF descargado")
 
-    # Si es chico, reutiliza pipeline existente (opcional; mantiene compat)
-    reader = PdfReader(BytesIO(bytes_local))
-    n_pages = len(reader.pages)
-    if n_pages < 80:
-        logger.info(f"PDF con {n_pages} páginas (<80). Usando pipeline existente.")
-        from src.services.pdf_processing import process_pdf_documents
-        resp = process_pdf_documents(
-            system_instructions_doc_id=system_instructions_doc_id,
-            base_prompt_doc_id=resolved_base_prompt_id,
-            pdf_url=pdf_url,
-            output_doc_id=output_doc_id,
-            drive_file_id=drive_file_id,
-            additional_params=additional_params or {},
-        )
-        # Escribimos link y estado final
+    # PDF abierto UNA sola vez (por ruta): page count, muestra y chunks salen del mismo objeto.
+    # El archivo temporal se borra al cerrar.
+    with timer.stage("apertura_pdf"):
         try:
-            link = resp.get("output_doc_link")
+            pdf = ParsedPdf(pdf_path, sha256=pdf_sha256, owns_file=True)
         except Exception:
-            link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
-        _sheet_update(status="100% ✔️", link=link)
-        return resp
-
-    # Sample P40 + U40 para detectar preguntas (solo TEXTO, sin GCS)
-    take_first = max(1, sampling_first_pages or settings.backq_first_pages_default)
-    take_last = max(1, sampling_last_pages or settings.backq_last_pages_default)
-
-    logger.info(f"📄 PDF n={n_pages} páginas; sample first/last = {take_first}/{take_last}")
-    sample_bytes = _extract_sample_pdf_bytes(bytes_local, take_first=take_first, take_last=take_last)
-    sample_text = _extract_full_text(sample_bytes)
-    hit = _first_heading_variant_hit(sample_text)
-    logger.info(f"HEADINGS: primer patrón que hizo match = {hit!r}")
-    _sheet_update(status="40% Muestra procesada")
-
-    max_q = int((additional_params or {}).get("detect_limit") or settings.backq_detect_limit)
-    questions = _detect_back_questions_via_model_text(sample_text, max_questions=max_q)
-    _log_detected_questions("DET-ML", questions)
-    if not questions:
-        logger.warning("⚠️ Detector ML no devolvió preguntas. Probando fallback regex local sobre el sample…")
-        questions = _detect_back_questions_regex(sample_bytes)[:max_q]
-        _log_detected_questions("DET-REGEX", questions)
-
-    if not questions:
-        # Sin preguntas → escribir doc básico y salir
-        write_qas_native(output_doc_id, title="Respuestas", qas=[])
-        output_link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
-        _sheet_update(status="100% ✔️ (sin preguntas detectadas)", link=output_link)
-        return {
-            "status": "success",
-            "message": "No se detectaron preguntas regreso en el documento.",
-            "output_doc_link": output_link,
-        }
-
-    # Preparar PDF completo → SOLO TEXTO + textos por chunk (sin GCS)
-    pages_per_chunk = max(5, settings.pdf_max_pages_per_chunk)
-    chunk_texts = _split_pdf_to_text_chunks(bytes_local, pages_per_chunk)
-    logger.info(f"Chunking: {len(chunk_texts)} chunks a ~{pages_per_chunk} páginas/chunk.")
-    _sheet_update(status=f"50% {len(questions)} preguntas detectadas")
-
-    strategy = (additional_params or {}).get("strategy") or settings.backq_strategy
+            _remove_quietly(pdf_path)  # PDF ilegible: el archivo temporal no llega a tener dueño
+            raise
+    chunks_future: Optional[Future] = None
+    try:
+        n_pages = pdf.page_count
+
+        # Si es chico, reutiliza pipeline existente (opcional; mantiene compat)
+        if n_pages < 80:
+            logger.info(f"PDF con {n_pages} páginas (<80). Usando pipeline existente.")
+            pdf.close()
+            from src.services.pdf_processing import process_pdf_documents
+            resp = process_pdf_documents(
+                system_instructions_doc_id=system_instructions_doc_id,
+                base_prompt_doc_id=resolved_base_prompt_id,
+                pdf_url=pdf_url,
+                output_doc_id=output_doc_id,
+                drive_file_id=drive_file_id,
+                additional_params=additional_params or {},
+            )
+            # Escribimos link y estado final
+            try:
+                link = resp.get("output_doc_link")
+            except Exception:
+                link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
+            _sheet_update(status="100% ✔️", link=link)
+            return resp
+
+        # Normalización (boilerplate repetido, guiones de corte, espacios) antes de enviar texto a Vertex
+        strip_boiler = (additional_params or {}).get("strip_boilerplate")
+        if strip_boiler is None:
+            strip_boiler = settings.backq_strip_boilerplate
+        if strip_boiler:
+            with timer.stage("normalizacion_fit"):
+                pdf.enable_normalization(min_ratio=settings.backq_boilerplate_min_ratio)
+
+        # Sample P40 + U40 para detectar preguntas (solo TEXTO, sin GCS); en modo adaptativo es el tope
+        params = additional_params or {}
+        take_first = max(1, sampling_first_pages or settings.backq_first_pages_default)
+        take_last = max(1, sampling_last_pages or settings.backq_last_pages_default)
+        locate = params.get("locate_section", settings.backq_locate_section)
+        sampling_mode = (params.get("sampling_mode") or settings.backq_sampling_mode).lower()
+        if sampling_mode == "adaptive" and not locate:
+            sampling_mode = "fixed"  # crecer la muestra sin localizador costaría una llamada al modelo por paso
+        logger.info(f"📄 PDF n={n_pages} páginas; sample first/last = {take_first}/{take_last} (muestreo {sampling_mode})")
+
+        # Chunking del PDF completo en el pipeline mientras la detección está en vuelo
+        chunks_future = pipeline.submit(timer.timed, "chunking(bg)", _build_text_chunks, pdf, params)
+
+        max_q = int(params.get("detect_limit") or settings.backq_detect_limit)
+        questions: List[Dict[str, Any]] = []
+        detect_text: Optional[str] = None
+        sent_windows: List[Tuple[int, int]] = []
+        if locate:
+            # Localizador local: al modelo solo va la ventana alrededor de la sección de preguntas.
+            # Adaptativo: extremos de N páginas (N = sampling_initial_pages), duplicando hasta el tope.
+            width = _locator_width(sampling_mode, take_first, take_last, params)
+            questions, detect_text = _detect_with_locator(
+                pdf, take_first=take_first, take_last=take_last, width=width, max_q=max_q,
+                timer=timer, sent_windows=sent_windows,
+            )
 
-    # --------- Estrategia híbrida (router + batch por chunk) ---------
-    if strategy != "per_question":
-        k_top = int((additional_params or {}).get("k_top_chunks") or settings.backq_k_top_chunks)
-        min_cov = int((additional_params or {}).get("min_cover") or settings.backq_min_cover)
-        cap = int((additional_params or {}).get("chunk_cap") or settings.backq_chunk_cap)
+        sample_text: Optional[str] = None
+        if not questions:
+            # Sin ventana (o sin preguntas en ella): muestra completa, como siempre
+            sample_ranges = pdf.sample_ranges(take_first, take_last)
+            with timer.stage("muestra"):
+                sample_text = pdf.sample_text(take_first, take_last, page_marks=True)
+            if _ranges_covered(sample_ranges, sent_windows):
+                logger.info("🔎 La muestra completa ya se envió al detector dentro de una ventana; sin nueva llamada.")
+            else:
+                detect_text = sample_text
+                logger.info(f"🔎 Detector con la muestra completa ({take_first}/{take_last} págs., ~{estimate_tokens(sample_text)} tokens).")
+                with timer.stage("deteccion"):
+                    questions = _detect_back_questions_via_model_text(sample_text, max_questions=max_q)
+        hit = _first_heading_variant_hit(detect_text or "")
+        logger.info(f"HEADINGS: primer patrón que hizo match = {hit!r}")
+        _sheet_update(status="40% Muestra procesada")
+
+        _log_detected_questions("DET-ML", questions)
+        if not questions:
+            logger.warning("⚠️ Detector ML no devolvió preguntas. Probando fallback regex local sobre el sample…")
+            questions = _detect_back_questions_regex(sample_text or "")[:max_q]
+            _log_detected_questions("DET-REGEX", questions)
+
+        # Esperar el chunking (normalmente ya terminó: corrió solapado con la detección)
+        with timer.stage("espera_chunking"):
+            chunks = chunks_future.result()
+
+        if not questions:
+            pdf.close()
+            # Sin preguntas → escribir doc básico y salir
+            write_qas_native(output_doc_id, title="Respuestas", qas=[])
+            output_link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
+            _sheet_update(status="100% ✔️ (sin preguntas detectadas)", link=output_link)
+            return {
+                "status": "success",
+                "message": "No se detectaron preguntas regreso en el documento.",
+                "output_doc_link": output_link,
+            }
+
+        # Dedup de preguntas casi idénticas (TOC + cuerpo, redacción levemente distinta):
+        # cada cluster se rutea/responde una vez y la respuesta se replica al escribir el Doc
+        detected_questions = questions
+        q_groups = [[i] for i in range(len(questions))]
+        if params.get("dedup_questions", settings.backq_dedup_questions):
+            with timer.stage("dedup"):
+                questions, q_groups = dedup_questions(
+                    detected_questions,
+                    threshold=float(params.get("dedup_threshold") or settings.backq_dedup_threshold),
+                )
+            if len(questions) < len(detected_questions):
+                logger.info(f"🧬 Dedup: {len(detected_questions)} → {len(questions)} preguntas únicas.")
+
+        # PDF completo → SOLO TEXTO + textos por chunk (sin GCS)
+        chunk_texts = [c["text"] for c in chunks]
+        # Índice único por job para router, fallback y per_question ("heuristic" | "bm25")
+        scorer = (additional_params or {}).get("scorer") or settings.backq_scorer
+        chunk_index = build_chunk_index(chunk_texts, scorer)
+        logger.info(f"Scorer de chunks: {type(chunk_index).__name__} ({scorer}).")
+        if pdf.normalizer is not None:
+            pdf.normalizer.log_stats()
+        pdf.close()
+        _sheet_update(status=f"50% {len(detected_questions)} preguntas detectadas ({len(questions)} únicas)")
+
+        strategy = (additional_params or {}).get("strategy") or settings.backq_strategy
+        # Contexto por pasajes (MAP híbrido y per_question); el fallback usa chunks completos
+        ctx_budget = int((additional_params or {}).get("map_context_tokens") or settings.backq_map_context_tokens)
+        window_tok = int((additional_params or {}).get("passage_window_tokens") or settings.backq_passage_window_tokens)
+
+        # --------- Estrategia híbrida (router + batch por chunk) ---------
+        if strategy != "per_question":
+            k_top = int((additional_params or {}).get("k_top_chunks") or settings.backq_k_top_chunks)
+            min_cov = int((additional_params or {}).get("min_cover") or settings.backq_min_cover)
+            cap = int((additional_params or {}).get("chunk_cap") or settings.backq_chunk_cap)
+            throttle_s = float((additional_params or {}).get("throttle_s") or settings.backq_throttle_s)
+
+            router = ((additional_params or {}).get("router") or settings.backq_router).lower()
+            route_fn = _plan_questions_to_chunks if router == "planner" else _route_questions_to_chunks
+
+            use_hints = (additional_params or {}).get("use_page_hints", settings.backq_use_page_hints)
+            page_ranges = [(c["page_start"], c["page_end"]) for c in chunks]
+            route_questions = [{"id": q["id"], "text": q["text"], "page_hint": q.get("page_hint")} for q in questions]
+            route_kwargs = dict(chunk_texts=chunk_texts, k_top=k_top, min_cover=min_cov, chunk_cap=cap, index=chunk_index)
+
+            with timer.stage("ruteo"):
+                routing = route_fn(route_questions, page_ranges=page_ranges if use_hints else None, **route_kwargs)
+            stats = _routing_stats(routing, route_questions, page_ranges)
+            planned, assignments = stats["calls"], stats["assignments"]
+            logger.info(f"🧮 Ruteo ({router}): {planned} llamadas MAP planeadas de {len(chunk_texts)} chunks "
+                        f"({assignments} asignaciones, {len(questions)} preguntas).")
+            if use_hints and stats["hinted"]:
+                # Comparación contra el ruteo sin pistas (solo scorer), sin llamar al modelo
+                base = _routing_stats(route_fn(route_questions, log_coverage=False, **route_kwargs), route_questions, page_ranges)
+                logger.info(
+                    f"📍 Page hints: {stats['hinted']} preguntas con pista; pista cubierta en "
+                    f"{stats['hint_hits']}/{stats['hinted']} (sin pistas: {base['hint_hits']}/{base['hinted']}); "
+                    f"precisión por asignación {stats['hint_precision']} (sin pistas: {base['hint_precision']}); "
+                    f"llamadas MAP {planned} (sin pistas: {base['calls']})."
+                )
+            _sheet_update(status=f"60% Ruteo listo: {planned} llamadas MAP")
+
+            # MAP por chunk (Flash/JSON) — ahora basado en TEXTO, con pool acotado de llamadas concurrentes
+            partials = defaultdict(list)  # qid -> [respuestas parciales]
+            map_workers = max(1, int(params.get("map_concurrency") or settings.backq_map_concurrency))
+            map_jobs = []
+            map_tokens_full = map_tokens_sent = 0
+            t_stage = time.perf_counter()
+            for cidx, q_subset in routing.items():
+                if not q_subset:
+                    continue
+                c = chunks[cidx]
+                context, _ = _map_context(c, q_subset, ctx_budget, window_tok)
+                ctx_tokens = estimate_tokens(context)
+                map_tokens_full += c["est_tokens"]
+                map_tokens_sent += ctx_tokens
+                logger.info(f"🗺️ MAP chunk {cidx} (p.{c['page_start']}–{c['page_end']}, ~{ctx_tokens}/{c['est_tokens']} tokens): "
+                            f"{len(q_subset)} preguntas")
+                map_jobs.append((cidx, context, q_subset))
+
+            total_chunks = len(map_jobs)
+
+            def _map_progress(done: int, total: int) -> None:
+                # progreso entre 60% y 85% durante MAP, a medida que termina cada llamada
+                _sheet_update(status=f"{60 + int(25 * (done / total))}% MAP {done}/{total}")
+
+            map_partials, slowest = _run_map_pool(
+                map_jobs, workers=map_workers, throttle_s=throttle_s, on_progress=_map_progress
+            )
+            for qid, answers in map_partials.items():
+                partials[qid].extend(answers)
+            logger.info(f"🗺️ MAP: {total_chunks} llamadas (concurrencia {map_workers}) en "
+                        f"{time.perf_counter() - t_stage:.2f}s; la más lenta {slowest:.2f}s.")
+            timer.add("map", time.perf_counter() - t_stage)
+            if map_tokens_full:
+                logger.info(f"✂️ Pasajes: MAP envió ~{map_tokens_sent} de ~{map_tokens_full} tokens "
+                            f"({100.0 * map_tokens_sent / map_tokens_full:.1f}%).")
+
+            # REDUCE (Pro) en lotes de preguntas; candidato único corto → sin llamada o Flash
+            _sheet_update(status="90% REDUCE por pregunta")
+            t_stage = time.perf_counter()
+            reduced = _reduce_answers_batched(
+                system_text,
+                base_prompt,
+                questions,
+                partials,
+                batch_tokens=int(params.get("reduce_batch_tokens") or settings.backq_reduce_batch_tokens),
+                batch_size=max(1, int(params.get("reduce_batch_size") or settings.backq_reduce_batch_size)),
+                single_mode=str(params.get("reduce_single_candidate") or settings.backq_reduce_single_candidate).strip().lower(),
+                single_max_tokens=int(params.get("reduce_single_max_tokens") or settings.backq_reduce_single_max_tokens),
+                ctx_cache=ctx_cache,
+            )
+            qas: List[Dict[str, str]] = []
+            missing: List[Dict[str, Any]] = []
+            for q in questions:
+                final_ans = reduced[q["id"]]
+                if "No se encontró evidencia" in final_ans:
+                    missing.append(q)
+                qas.append({"question": q["text"], "answer": final_ans})
+            timer.add("reduce", time.perf_counter() - t_stage)
+
+            # Fallback dirigido Top-2 (opcional, barato)
+            t_stage = time.perf_counter()
+            if missing:
+                logger.info(f"🛟 Fallback: {len(missing)} preguntas sin candidatos. Intento dirigido Top-2.")
+                for q in missing:
+                    top_idx = _select_topk_chunks_for_question(q["text"], chunk_texts, k=2, index=chunk_index) or [0]
+                    sel_txt = [chunk_texts[i] for i in top_idx]
+                    try:
+                        ans = _answer_one_question_over_text_chunks(
+                            question_text=q["text"],
+                            system_text=system_text,
+                            base_prompt=base_prompt,
+                            selected_chunk_texts=sel_txt,
+                            params={},
+                            ctx_cache=ctx_cache,
+                            whole_chunks=[True] * len(sel_txt),
+                        )
+                        for qa in qas:
+                            if qa["question"] == q["text"] and "No se encontró evidencia" in qa["answer"]:
+                                qa["answer"] = ans
+                                break
+                    except Exception as e:
+                        logger.warning(f"Fallback dirigido falló para {q['id']}: {e}")
+            timer.add("fallback", time.perf_counter() - t_stage)
+
+            with timer.stage("escritura_doc"):
+                write_qas_native(
+                    output_doc_id,
+                    title="Respuestas",
+                    qas=fan_out([qa["answer"] for qa in qas], detected_questions, q_groups),
+                )
+            output_link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
+            logger.info("✅ Back-Questions completado (híbrido).")
+            _sheet_update(status="95% Escribiendo Doc", link=output_link)
+            _sheet_update(status="100% ✔️")
+            return {
+                "status": "success",
+                "message": "Q/A escritos en el documento (modo híbrido).",
+                "output_doc_link": output_link,
+            }
+
+        # --------- Fallback: per-pregunta (más lento) ---------
+        qas: List[Dict[str, str]] = []
         throttle_s = float((additional_params or {}).get("throttle_s") or settings.backq_throttle_s)
-
-        routing = _route_questions_to_chunks(
-            questions=[{"id": q["id"], "text": q["text"], "page_hint": q.get("page_hint")} for q in questions],
-            chunk_texts=chunk_texts,
-            k_top=k_top,
-            min_cover=min_cov,
-            chunk_cap=cap,
-        )
-        _sheet_update(status="60% Ruteo de preguntas listo")
-
-        # MAP por chunk (Flash/JSON) — ahora basado en TEXTO
-        partials = defaultdict(list)  # qid -> [respuestas parciales]
-        total_chunks = len(routing)
-        done = 0
-        for cidx, q_subset in routing.items():
-            if not q_subset:
-                continue
-            logger.info(f"🗺️ MAP chunk {cidx}: {len(q_subset)} preguntas")
+        t_stage = time.perf_counter()
+        for idx, q in enumerate(questions, 1):
+            q_text = q["text"]
+            # Reducimos contexto por pregunta: Top-K chunks más relevantes
+            top_idx = _select_topk_chunks_for_question(q_text, chunk_texts, k=3, index=chunk_index) or [0]
+            contexts = [_map_context(chunks[i], [q], ctx_budget, window_tok) for i in top_idx]
+            selected_texts = [txt for txt, _ in contexts]
+            whole = [is_whole for _, is_whole in contexts]
+            logger.info(f"→ Respondiendo ({idx}/{len(questions)}): {q_text[:80]}… (chunks {top_idx})")
             try:
-                out = _map_chunk_answers_json_from_text(chunk_texts[cidx], cidx, q_subset)
-                for a in out.get("answers", []):
-                    partials[a["id"]].append(a["answer"])
+                ans = _answer_one_question_over_text_chunks(
+                    question_text=q_text,
+                    system_text=system_text,
+                    base_prompt=base_prompt,
+                    selected_chunk_texts=selected_texts,
+                    params={**(additional_params or {})},
+                    ctx_cache=ctx_cache,
+                    whole_chunks=whole,
+                )
             except gex.ResourceExhausted:
-                logger.warning(f"429 en MAP chunk {cidx}. Reintentando con subset reducido…")
-                # Degradación: mitad de preguntas
-                small_subset = q_subset[: max(1, len(q_subset) // 2)]
-                try:
-                    out = _map_chunk_answers_json_from_text(chunk_texts[cidx], cidx, small_subset)
-                    for a in out.get("answers", []):
-                        partials[a["id"]].append(a["answer"])
-                except Exception as e2:
-                    logger.warning(f"MAP chunk {cidx} degradado también falló: {e2}")
-            except Exception as e:
-                logger.warning(f"MAP chunk {cidx} falló: {e}")
-
-            time.sleep(throttle_s)
-            done += 1
-            # progreso entre 60% y 85% durante MAP
-            pct = 60 + int(25 * (done / max(1, total_chunks)))
-            _sheet_update(status=f"{pct}% MAP {done}/{total_chunks}")
-
-        # REDUCE por pregunta (Pro)
-        _sheet_update(status="90% REDUCE por pregunta")
-        qas: List[Dict[str, str]] = []
-        missing: List[Dict[str, Any]] = []
-        for q in questions:
-            qid, qtext = q["id"], q["text"]
-            candidates = partials.get(qid, [])
-            final_ans = _reduce_answers_for_question(system_text, base_prompt, qtext, candidates)
-            if "No se encontró evidencia" in final_ans:
-                missing.append(q)
-            qas.append({"question": qtext, "answer": final_ans})
-
-        # Fallback dirigido Top-2 (opcional, barato)
-        if missing:
-            logger.info(f"🛟 Fallback: {len(missing)} preguntas sin candidatos. Intento dirigido Top-2.")
-            for q in missing:
-                top_idx = _select_topk_chunks_for_question(q["text"], chunk_texts, k=2) or [0]
-                sel_txt = [chunk_texts[i] for i in top_idx]
+                logger.warning(f"429 en pregunta {idx}. Reintentando con solo 1 chunk…")
                 try:
                     ans = _answer_one_question_over_text_chunks(
-                        question_text=q["text"],
+                        question_text=q_text,
                         system_text=system_text,
                         base_prompt=base_prompt,
-                        selected_chunk_texts=sel_txt,
-                        params={},
+                        selected_chunk_texts=selected_texts[:1],
+                        params={**(additional_params or {})},
+                        ctx_cache=ctx_cache,
+                        whole_chunks=whole[:1],
                     )
-                    for qa in qas:
-                        if qa["question"] == q["text"] and "No se encontró evidencia" in qa["answer"]:
-                            qa["answer"] = ans
-                            break
-                except Exception as e:
-                    logger.warning(f"Fallback dirigido falló para {q['id']}: {e}")
+                except Exception as e2:
+                    logger.error(f"❌ Pregunta {idx} falló tras degradación: {e2}")
+                    ans = "_(No se pudo responder por límite temporal de cuota; intente más tarde)_"
+            except Exception as e:
+                logger.error(f"❌ Error en pregunta {idx}: {e}")
+                ans = "_(error al procesar esta pregunta)_"
 
-        write_qas_native(output_doc_id, title="Respuestas", qas=qas)
+            qas.append({"question": q_text, "answer": ans})
+            time.sleep(throttle_s)
+            # progreso entre 60% y 95% en modo per_question
+            pct = 60 + int(35 * (idx / max(1, len(questions))))
+            _sheet_update(status=f"{pct}% ({idx}/{len(questions)})")
+        timer.add("per_question", time.perf_counter() - t_stage)
+
+        with timer.stage("escritura_doc"):
+            write_qas_native(
+                output_doc_id,
+                title="Respuestas",
+                qas=fan_out([qa["answer"] for qa in qas], detected_questions, q_groups),
+            )
         output_link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
-        logger.info("✅ Back-Questions completado (híbrido).")
+        logger.info("✅ Back-Questions completado (per_question).")
         _sheet_update(status="95% Escribiendo Doc", link=output_link)
         _sheet_update(status="100% ✔️")
         return {
             "status": "success",
-            "message": "Q/A escritos en el documento (modo híbrido).",
+            "message": "Q/A escritos en el documento (modo per_question).",
             "output_doc_link": output_link,
         }
-
-    # --------- Fallback: per-pregunta (más lento) ---------
-    qas: List[Dict[str, str]] = []
-    throttle_s = float((additional_params or {}).get("throttle_s") or settings.backq_throttle_s)
-    for idx, q in enumerate(questions, 1):
-        q_text = q["text"]
-        # Reducimos contexto por pregunta: Top-K chunks más relevantes
-        top_idx = _select_topk_chunks_for_question(q_text, chunk_texts, k=3) or [0]
-        selected_texts = [chunk_texts[i] for i in top_idx]
-        logger.info(f"→ Respondiendo ({idx}/{len(questions)}): {q_text[:80]}… (chunks {top_idx})")
-        try:
-            ans = _answer_one_question_over_text_chunks(
-                question_text=q_text,
-                system_text=system_text,
-                base_prompt=base_prompt,
-                selected_chunk_texts=selected_texts,
-                params={**(additional_params or {})},
-            )
-        except gex.ResourceExhausted:
-            logger.warning(f"429 en pregunta {idx}. Reintentando con solo 1 chunk…")
+    finally:
+        # Cierre garantizado (también en errores): espera al chunking en segundo plano, que
+        # lee del mismo documento, y luego cierra el PDF y borra el archivo temporal.
+        if chunks_future is not None and not chunks_future.done():
             try:
-                ans = _answer_one_question_over_text_chunks(
-                    question_text=q_text,
-                    system_text=system_text,
-                    base_prompt=base_prompt,
-                    selected_chunk_texts=selected_texts[:1],
-                    params={**(additional_params or {})},
-                )
-            except Exception as e2:
-                logger.error(f"❌ Pregunta {idx} falló tras degradación: {e2}")
-                ans = "_(No se pudo responder por límite temporal de cuota; intente más tarde)_"
-        except Exception as e:
-            logger.error(f"❌ Error en pregunta {idx}: {e}")
-            ans = "_(error al procesar esta pregunta)_"
-
-        qas.append({"question": q_text, "answer": ans})
-        time.sleep(throttle_s)
-        # progreso entre 60% y 95% en modo per_question
-        pct = 60 + int(35 * (idx / max(1, len(questions))))
-        _sheet_update(status=f"{pct}% ({idx}/{len(questions)})")
-
-    write_qas_native(output_doc_id, title="Respuestas", qas=qas)
-    output_link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
-    logger.info("✅ Back-Questions completado (per_question).")
-    _sheet_update(status="95% Escribiendo Doc", link=output_link)
-    _sheet_update(status="100% ✔️")
-    return {
-        "status": "success",
-        "message": "Q/A escritos en el documento (modo per_question).",
-        "output_doc_link": output_link,
-    }
+                chunks_future.result()
+            except Exception:
+                pass
+        pdf.close()
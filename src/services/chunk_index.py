@@ -0,0 +1,153 @@
+# src/services/chunk_index.py
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from src.utils import es_text
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def query_tokens(question: str) -> List[str]:
+    """Tokens de la pregunta (es_text: sin acentos ni stopwords, con stem; con repetidos)."""
+    return es_text.tokens(question)
+
+
+class ChunkIndex:
+    """
+    Índice invertido por job: token → {chunk_idx: frecuencia}.
+      • Cada chunk se tokeniza con es_text UNA sola vez → Counter de stems.
+      • Las frecuencias son de tokens completos: el stem "amenaz" cuenta "amenazó",
+        "amenazas" y "amenazaron", pero el stem "pas" (de "pasó") no cuenta "pasaporte".
+      • Las postings de cada token se memoizan (compartidas por todas las preguntas).
+      • El ranking completo de cada pregunta se memoiza: top-k para cualquier k es un prefijo.
+    """
+
+    def __init__(self, chunk_texts: List[str]):
+        self._tfs: List[Counter] = [Counter(es_text.tokens(t, cache=False)) for t in chunk_texts]
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._rankings: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tfs)
+
+    def prepare(self, questions: Iterable[str]) -> None:
+        """Precalcula rankings (el heurístico no gana nada en lote; se mantiene por interfaz)."""
+        for q in questions:
+            self.ranking(q)
+
+    def postings(self, tok: str) -> Dict[int, int]:
+        p = self._postings.get(tok)
+        if p is None:
+            p = {}
+            for idx, counts in enumerate(self._tfs):
+                n = counts.get(tok)
+                if n:
+                    p[idx] = n
+            self._postings[tok] = p
+        return p
+
+    def scores(self, question: str) -> Dict[int, int]:
+        """Score > 0 por chunk (suma de frecuencias de los tokens de la pregunta)."""
+        acc: Dict[int, int] = {}
+        for tok in query_tokens(question):
+            for idx, n in self.postings(tok).items():
+                acc[idx] = acc.get(idx, 0) + n
+        return acc
+
+    def ranking(self, question: str) -> List[int]:
+        """Chunks con score > 0, de mayor a menor (empate: índice mayor primero, como el original)."""
+        r = self._rankings.get(question)
+        if r is None:
+            pairs: List[Tuple[int, int]] = [(sc, idx) for idx, sc in self.scores(question).items()]
+            pairs.sort(reverse=True)
+            r = [idx for _, idx in pairs]
+            self._rankings[question] = r
+        return r
+
+    def topk(self, question: str, k: int) -> List[int]:
+        top = self.ranking(question)[:k]
+        return top or list(range(0, min(k, len(self._tfs))))
+
+
+class Bm25Index:
+    """
+    Scorer BM25 vectorizado con NumPy (mismo contrato que ChunkIndex: ranking/topk/prepare).
+      • Los chunks se tokenizan una vez con es_text (stems, sin stopwords) → Counter por chunk.
+      • `prepare(preguntas)` arma la matriz Q×V de la consulta y la matriz V×C de pesos BM25
+        (V = vocabulario de TODAS las preguntas) y puntúa todo con UNA multiplicación.
+      • IDF penaliza palabras legales comunes; la normalización por longitud evita que
+        los chunks más largos ganen sólo por tamaño.
+    (Sin SciPy: al restringir V al vocabulario de las preguntas la matriz densa es pequeña.)
+    """
+
+    def __init__(self, chunk_texts: List[str], *, k1: float = 1.2, b: float = 0.75):
+        import numpy as np  # opcional: solo se necesita con scorer="bm25"
+        self._np = np
+        self.k1, self.b = k1, b
+        self._tfs: List[Counter] = [
+            Counter(es_text.tokens(txt, cache=False)) for txt in chunk_texts
+        ]
+        self._dl = np.array([sum(c.values()) for c in self._tfs], dtype=np.float64)
+        self._avgdl = float(self._dl.mean()) if len(self._dl) and self._dl.mean() > 0 else 1.0
+        self._rankings: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tfs)
+
+    def prepare(self, questions: Iterable[str]) -> None:
+        np = self._np
+        pending = list(dict.fromkeys(q for q in questions if q not in self._rankings))
+        if not pending:
+            return
+        q_tokens = [query_tokens(q) for q in pending]
+        vocab = {t: i for i, t in enumerate(dict.fromkeys(t for toks in q_tokens for t in toks))}
+        n_chunks = len(self._tfs)
+        if not vocab or n_chunks == 0:
+            for q in pending:
+                self._rankings[q] = []
+            return
+
+        # V×C: frecuencias de términos de consulta en cada chunk
+        tf = np.zeros((len(vocab), n_chunks), dtype=np.float64)
+        for c, counts in enumerate(self._tfs):
+            for t, i in vocab.items():
+                n = counts.get(t)
+                if n:
+                    tf[i, c] = n
+        df = (tf > 0).sum(axis=1)
+        idf = np.log1p((n_chunks - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1.0 - self.b + self.b * self._dl / self._avgdl)
+        weights = idf[:, None] * (tf * (self.k1 + 1.0)) / (tf + norm[None, :])
+
+        # Q×V: multiplicidad de cada término en cada pregunta
+        qm = np.zeros((len(pending), len(vocab)), dtype=np.float64)
+        for r, toks in enumerate(q_tokens):
+            for t in toks:
+                qm[r, vocab[t]] += 1.0
+
+        scores = qm @ weights  # Q×C en una sola operación
+        for r, q in enumerate(pending):
+            row = scores[r]
+            order = np.argsort(-row, kind="stable")
+            self._rankings[q] = [int(c) for c in order if row[c] > 0]
+
+    def ranking(self, question: str) -> List[int]:
+        if question not in self._rankings:
+            self.prepare([question])
+        return self._rankings[question]
+
+    def topk(self, question: str, k: int) -> List[int]:
+        top = self.ranking(question)[:k]
+        return top or list(range(0, min(k, len(self._tfs))))
+
+
+def build_chunk_index(chunk_texts: List[str], scorer: str = "heuristic"):
+    """Índice de chunks según `scorer` ("heuristic" | "bm25"); BM25 sin NumPy → heurístico."""
+    if (scorer or "").lower() == "bm25":
+        try:
+            return Bm25Index(chunk_texts)
+        except ImportError:
+            logger.warning("scorer=bm25 requiere NumPy; usando scorer heurístico.")
+    return ChunkIndex(chunk_texts)
@@ -0,0 +1,143 @@
+# src/services/passages.py
+from __future__ import annotations
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+import math
+import re
+
+from src.services.chunk_index import query_tokens
+from src.utils import es_text
+from src.utils.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+_SEPARATOR = "\n[…]\n"
+_SPACE = re.compile(r"\s")
+
+
+class PassageIndex:
+    """
+    Ventanas deslizantes de tamaño fijo dentro de UN chunk (para armar el contexto de MAP).
+      • Ventanas de ~`window_tokens` tokens con paso `stride_tokens`, ajustadas a espacios.
+      • Score por ventana: ocurrencias de los tokens de la pregunta ponderadas por IDF entre
+        ventanas (las palabras que aparecen en todo el chunk casi no suman).
+      • Cada ventana conoce sus páginas (1-based) vía `page_offsets` del chunk.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        *,
+        page_start: int = 1,
+        page_offsets: Optional[Sequence[int]] = None,
+        window_tokens: int = 300,
+        stride_tokens: Optional[int] = None,
+    ):
+        self.text = text or ""
+        self.page_start = page_start
+        self.page_offsets = list(page_offsets or [0])
+        self.window = max(1, int(window_tokens)) * CHARS_PER_TOKEN
+        self.stride = max(1, int(stride_tokens or window_tokens // 2 or 1)) * CHARS_PER_TOKEN
+        self.windows: List[Tuple[int, int]] = self._make_windows()
+        self._starts = [s for s, _ in self.windows]
+        self._hits: Dict[str, Dict[int, int]] = {}
+        self._offsets: Optional[Dict[str, List[int]]] = None
+
+    def _snap(self, pos: int) -> int:
+        """Mueve `pos` al espacio más cercano hacia adelante (sin cortar palabras)."""
+        if pos <= 0 or pos >= len(self.text):
+            return max(0, min(pos, len(self.text)))
+        m = _SPACE.search(self.text, pos, min(len(self.text), pos + 40))
+        return m.start() if m else pos
+
+    def _make_windows(self) -> List[Tuple[int, int]]:
+        n = len(self.text)
+        if n <= self.window:
+            return [(0, n)]
+        out: List[Tuple[int, int]] = []
+        start = 0
+        while start < n:
+            end = self._snap(start + self.window)
+            out.append((start, end))
+            if end >= n:
+                break
+            start = self._snap(start + self.stride)
+        return out
+
+    def pages_of(self, start: int, end: int) -> Tuple[int, int]:
+        first = bisect_right(self.page_offsets, start) - 1
+        last = bisect_right(self.page_offsets, max(start, end - 1)) - 1
+        return self.page_start + max(0, first), self.page_start + max(0, last)
+
+    def _token_hits(self, tok: str) -> Dict[int, int]:
+        """Ventana → ocurrencias del token como palabra completa (igual que el scorer de chunks)."""
+        hits = self._hits.get(tok)
+        if hits is None:
+            if self._offsets is None:
+                self._offsets = es_text.token_offsets(self.text)  # una pasada por chunk
+            hits = {}
+            for pos in self._offsets.get(tok, ()):
+                # ventanas que contienen el inicio de la palabra (inicios y finales son crecientes)
+                w = bisect_right(self._starts, pos) - 1
+                while w >= 0 and self.windows[w][1] > pos:
+                    hits[w] = hits.get(w, 0) + 1
+                    w -= 1
+            self._hits[tok] = hits
+        return hits
+
+    def ranking(self, question: str) -> List[int]:
+        """Ventanas con score > 0, de mayor a menor (empate: la más temprana)."""
+        n = len(self.windows)
+        acc: Dict[int, float] = {}
+        for tok in set(query_tokens(question)):
+            hits = self._token_hits(tok)
+            if not hits:
+                continue
+            idf = math.log(1.0 + (n - len(hits) + 0.5) / (len(hits) + 0.5))
+            for w, c in hits.items():
+                acc[w] = acc.get(w, 0.0) + idf * (1.0 + math.log(c))
+        return [w for w, _ in sorted(acc.items(), key=lambda kv: (-kv[1], kv[0]))]
+
+    def context_for(self, questions: Sequence[str], token_budget: int) -> str:
+        """
+        Contexto compacto para las preguntas dadas: las mejores ventanas de cada pregunta
+        en round-robin (1ª de cada una, luego 2ª…) hasta `token_budget`, fusionadas, en
+        orden de aparición y con marcas de página. Sin coincidencias → texto completo.
+        """
+        if token_budget <= 0 or estimate_tokens(self.text) <= token_budget:
+            return self.text
+        rankings = [r for r in (self.ranking(q) for q in questions) if r]
+        if not rankings:
+            return self.text
+
+        budget_chars = token_budget * CHARS_PER_TOKEN
+        chosen: List[Tuple[int, int]] = []
+        for depth in range(max(len(r) for r in rankings)):
+            full = False
+            for r in rankings:
+                if depth >= len(r):
+                    continue
+                cand = _merge(chosen + [self.windows[r[depth]]])
+                if sum(e - s for s, e in cand) > budget_chars:
+                    full = True
+                    continue
+                chosen = cand
+            if full:
+                break
+        if not chosen:
+            chosen = [self.windows[rankings[0][0]]]
+
+        parts = []
+        for s, e in chosen:
+            p0, p1 = self.pages_of(s, e)
+            label = f"[p. {p0}]" if p0 == p1 else f"[p. {p0}–{p1}]"
+            parts.append(f"{label}\n{self.text[s:e].strip()}")
+        return _SEPARATOR.join(parts)
+
+
+def _merge(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out: List[Tuple[int, int]] = []
+    for s, e in sorted(intervals):
+        if out and s <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], e))
+        else:
+            out.append((s, e))
+    return out
@@ -0,0 +1,438 @@
+# src/services/pdf_text.py
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import weakref
+
+from PyPDF2 import PdfReader
+
+from src.settings import settings
+from src.utils.logger import get_logger
+from src.services.text_normalize import TextNormalizer
+from src.utils.page_text_cache import PageTextCache, get_page_text_cache, sha256_of_bytes
+from src.utils.tokens import estimate_tokens
+
+logger = get_logger(__name__)
+
+
+def _fitz_page_text(page) -> str:
+    """
+    Texto de una página PyMuPDF priorizando 'blocks' (mejor orden visual).
+    """
+    blocks = page.get_text("blocks") or []
+    blk_texts = []
+    for b in blocks:
+        if isinstance(b, (list, tuple)) and len(b) >= 5 and isinstance(b[4], str):
+            blk_texts.append(b[4])
+    if blk_texts:
+        return "\n".join(blk_texts).replace("\r", "")
+    return (str(page.get_text("text")) or "").replace("\r", "")
+
+
+PdfSource = Union[bytes, str]  # bytes en memoria o ruta a archivo local
+
+
+def _open_fitz(source: PdfSource):
+    import fitz
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def _open_pypdf2(source: PdfSource) -> PdfReader:
+    return PdfReader(source if isinstance(source, str) else BytesIO(source))
+
+
+def _sha256_of_source(source: PdfSource) -> str:
+    if not isinstance(source, str):
+        return sha256_of_bytes(source)
+    h = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _extract_range_worker(source: PdfSource, backend: str, start: int, end: int) -> List[str]:
+    """
+    Worker de proceso: abre su propia copia del PDF y extrae las páginas [start, end).
+    PyMuPDF primero, PyPDF2 como fallback (igual que en el proceso principal).
+    `ParsedPdf` le pasa siempre una ruta: el worker abre el archivo sin copiar bytes entre procesos.
+    """
+    if backend == "pymupdf":
+        try:
+            doc = _open_fitz(source)
+            try:
+                out = []
+                for i in range(start, end):
+                    try:
+                        out.append(_fitz_page_text(doc.load_page(i)))
+                    except Exception:
+                        out.append("")
+                return out
+            finally:
+                doc.close()
+        except Exception:
+            pass
+    r = _open_pypdf2(source)
+    out = []
+    for i in range(start, end):
+        try:
+            out.append((r.pages[i].extract_text() or "").replace("\r", ""))
+        except Exception:
+            out.append("")
+    return out
+
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except Exception:
+        return os.cpu_count() or 1
+
+
+def _shard_ranges(pages: List[int], n_shards: int) -> List[Tuple[int, int]]:
+    """Agrupa índices (ordenados) en rangos contiguos [start, end) de tamaño similar."""
+    runs: List[Tuple[int, int]] = []
+    for i in pages:
+        if runs and runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], i + 1)
+        else:
+            runs.append((i, i + 1))
+    size = max(1, -(-len(pages) // max(1, n_shards)))
+    shards: List[Tuple[int, int]] = []
+    for s, e in runs:
+        for a in range(s, e, size):
+            shards.append((a, min(a + size, e)))
+    return shards
+
+
+class ParsedPdf:
+    """
+    PDF abierto UNA sola vez por job y compartido por todas las etapas.
+      • Abre con PyMuPDF (fitz); fallback a PyPDF2.
+      • Extrae el texto de cada página una sola vez (lazy + cache por página).
+      • Expone page_count, rangos de páginas, texto de muestra y chunks (`token_chunks`).
+      • Rangos grandes se extraen en paralelo con un pool de procesos (ver `prefetch`).
+      • Cache en disco por SHA-256: si el PDF ya se procesó, no se vuelve a parsear.
+      • Normalización opcional (boilerplate/espacios) aplicada al texto que sale hacia el modelo;
+        el cache guarda siempre el texto crudo.
+      • `source` puede ser bytes o la ruta de un archivo local (descarga en streaming);
+        con `owns_file=True` el archivo se borra al cerrar.
+      • Un solo pool de procesos por PDF (se crea en el primer `prefetch` paralelo y se cierra
+        en `close`); los workers reciben siempre una ruta, nunca los bytes del PDF.
+    """
+
+    def __init__(
+        self,
+        source: PdfSource,
+        *,
+        sha256: Optional[str] = None,
+        owns_file: bool = False,
+        workers: Optional[int] = None,
+        parallel_min_pages: Optional[int] = None,
+        use_cache: bool = True,
+        cache: Optional[PageTextCache] = None,
+    ):
+        self._source = source
+        self._file_finalizer = (
+            weakref.finalize(self, _remove_file, source) if owns_file and isinstance(source, str) else None
+        )
+        w = settings.pdf_text_workers if workers is None else workers
+        self.workers = int(w) if w and int(w) > 0 else _available_cpus()
+        self.parallel_min_pages = int(
+            settings.pdf_text_parallel_min_pages if parallel_min_pages is None else parallel_min_pages
+        )
+        self._fitz_doc = None
+        self._reader: Optional[PdfReader] = None
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_finalizer = None
+        self._worker_path: Optional[str] = source if isinstance(source, str) else None
+        self._spill_finalizer = None
+        self.normalizer: Optional[TextNormalizer] = None
+        self._clean: List[Optional[str]] = []
+
+        self._cache = (cache or get_page_text_cache()) if use_cache else None
+        self.sha256 = (sha256 or _sha256_of_source(source)) if self._cache is not None else sha256
+        cached = self._cache.get(self.sha256) if self._cache is not None else None
+        if cached is not None:
+            self.backend = "cache"
+            self._page_count = len(cached)
+            self._pages: List[Optional[str]] = list(cached)
+            self._stored = True
+            logger.info(f"🗄️ Cache de texto: hit {self.sha256[:12]}… ({self._page_count} páginas, sin parseo).")
+            return
+
+        try:
+            self._fitz_doc = _open_fitz(source)
+            self._page_count = self._fitz_doc.page_count
+            self.backend = "pymupdf"
+        except Exception:
+            self._reader = _open_pypdf2(source)
+            self._page_count = len(self._reader.pages)
+            self.backend = "pypdf2"
+        self._pages = [None] * self._page_count
+        self._stored = False
+        logger.info(f"📖 PDF abierto una vez ({self.backend}): {self._page_count} páginas.")
+
+    # ---------- Ciclo de vida ----------
+    def close(self) -> None:
+        self._shutdown_pool()
+        if self._spill_finalizer is not None:
+            self._spill_finalizer()  # copia en disco de un PDF en bytes (idempotente)
+        if self._fitz_doc is not None:
+            try:
+                self._fitz_doc.close()
+            except Exception:
+                pass
+            self._fitz_doc = None
+        self._reader = None
+        if self._file_finalizer is not None:
+            self._file_finalizer()  # borra el archivo temporal (idempotente)
+
+    def __enter__(self) -> "ParsedPdf":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ---------- Páginas ----------
+    @property
+    def page_count(self) -> int:
+        return self._page_count
+
+    def _extract_page(self, i: int) -> str:
+        try:
+            if self._fitz_doc is not None:
+                return _fitz_page_text(self._fitz_doc.load_page(i))
+            if self._reader is not None:
+                return (self._reader.pages[i].extract_text() or "").replace("\r", "")
+        except Exception as e:
+            logger.debug(f"Página {i}: no se pudo extraer texto: {e}")
+        return ""
+
+    def raw_page_text(self, i: int) -> str:
+        """Texto crudo de la página `i` (0-based); se extrae solo la primera vez."""
+        txt = self._pages[i]
+        if txt is None:
+            with self._lock:
+                txt = self._pages[i]
+                if txt is None:
+                    txt = self._extract_page(i)
+                    self._pages[i] = txt
+        return txt
+
+    def page_text(self, i: int) -> str:
+        """Texto de la página `i` listo para el modelo (normalizado si hay normalizador)."""
+        if self.normalizer is None:
+            return self.raw_page_text(i)
+        txt = self._clean[i]
+        if txt is None:
+            txt = self.normalizer.normalize(self.raw_page_text(i))
+            self._clean[i] = txt
+        return txt
+
+    def enable_normalization(self, *, min_ratio: float = 0.3, fit_pages: int = 60) -> TextNormalizer:
+        """
+        Aprende el boilerplate (líneas repetidas) sobre hasta `fit_pages` páginas repartidas
+        uniformemente en el documento y activa la normalización para el resto de etapas.
+        """
+        n = self._page_count
+        k = max(1, min(n, int(fit_pages)))
+        idx = sorted({(j * n) // k for j in range(k)}) if n else []
+        self.normalizer = TextNormalizer.fit((self.raw_page_text(i) for i in idx), min_ratio=min_ratio)
+        self._clean = [None] * n
+        return self.normalizer
+
+    def _store_if_complete(self) -> None:
+        """Guarda en cache el texto de todas las páginas (una vez, cuando ya están todas)."""
+        if self._stored or self._cache is None or any(p is None for p in self._pages):
+            return
+        self._stored = True
+        try:
+            self._cache.put(self.sha256, [p or "" for p in self._pages], backend=self.backend)
+        except Exception as e:
+            logger.warning(f"Cache de texto: no se pudo guardar ({e}).")
+
+    # ---------- Pool de extracción ----------
+    def _worker_source(self) -> str:
+        """Ruta que abren los workers; un PDF en bytes se vuelca UNA vez a un archivo temporal."""
+        if self._worker_path is None:
+            fd, path = tempfile.mkstemp(prefix="regresos-pdf-", suffix=".pdf")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self._source)
+            except Exception:
+                _remove_file(path)
+                raise
+            self._spill_finalizer = weakref.finalize(self, _remove_file, path)
+            self._worker_path = path
+        return self._worker_path
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Pool de procesos del PDF: se crea una vez y se reutiliza en cada `prefetch`."""
+        if self._pool is None:
+            # 'spawn': seguro aunque el proceso tenga hilos activos (fork + locks = deadlocks)
+            ctx = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            self._pool_finalizer = weakref.finalize(self, self._pool.shutdown, False)
+        return self._pool
+
+    def _shutdown_pool(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            self._pool_finalizer.detach()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def prefetch(self, start: int = 0, end: Optional[int] = None) -> None:
+        """
+        Extrae de una vez las páginas pendientes de [start, end).
+        Si son muchas (>= parallel_min_pages) y hay >1 worker, reparte rangos en un
+        pool de procesos y une los resultados en orden de página; si no, serial.
+        """
+        end = self._page_count if end is None else min(end, self._page_count)
+        missing = [i for i in range(max(0, start), end) if self._pages[i] is None]
+        if not missing:
+            return
+        if self.workers <= 1 or len(missing) < max(1, self.parallel_min_pages):
+            for i in missing:
+                self.raw_page_text(i)
+            self._store_if_complete()
+            return
+
+        workers = min(self.workers, len(missing))
+        shards = _shard_ranges(missing, workers * 2)
+        logger.info(f"⚙️ Extracción paralela: {len(missing)} páginas en {len(shards)} rangos / {workers} procesos.")
+        try:
+            with self._lock:
+                ex = self._get_pool()
+                path = self._worker_source()
+            futs = [(s, ex.submit(_extract_range_worker, path, self.backend, s, e)) for s, e in shards]
+            results = [(s, f.result()) for s, f in futs]
+        except Exception as e:
+            logger.warning(f"Extracción paralela falló ({e}); usando modo serial.")
+            self._shutdown_pool()  # p. ej. BrokenProcessPool: el próximo prefetch crea uno nuevo
+            for i in missing:
+                self.raw_page_text(i)
+            self._store_if_complete()
+            return
+        with self._lock:
+            for s, texts in results:
+                for off, txt in enumerate(texts):
+                    if self._pages[s + off] is None:
+                        self._pages[s + off] = txt
+        self._store_if_complete()
+
+    def page_texts(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """Textos de las páginas [start, end) en orden."""
+        end = self._page_count if end is None else min(end, self._page_count)
+        self.prefetch(start, end)
+        return [self.page_text(i) for i in range(max(0, start), end)]
+
+    # ---------- Rangos ----------
+    def normalize_ranges(self, ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Recorta rangos [start, end) a [0, page_count), los ordena y fusiona solapes/contiguos."""
+        clipped = sorted(
+            (max(0, int(a)), min(int(b), self._page_count)) for a, b in ranges
+        )
+        merged: List[Tuple[int, int]] = []
+        for a, b in clipped:
+            if a >= b:
+                continue
+            if merged and a <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+            else:
+                merged.append((a, b))
+        return merged
+
+    def sample_ranges(self, take_first: int, take_last: int) -> List[Tuple[int, int]]:
+        """Rangos de las primeras `take_first` y últimas `take_last` páginas (sin solapar)."""
+        total = self._page_count
+        first = max(0, int(take_first or 0))
+        last = max(0, int(take_last or 0))
+        return self.normalize_ranges([(0, first), (total - last, total)])
+
+    # ---------- Texto ----------
+    def text_for_ranges(self, ranges: Iterable[Tuple[int, int]], *, page_marks: bool = False) -> str:
+        """
+        Texto de las páginas en `ranges`, directo del documento ya abierto (sin construir
+        un PDF intermedio). Cada página se extrae una sola vez y queda cacheada.
+        Con `page_marks`, cada página va precedida de "[p. N]" (1-based).
+        """
+        parts: List[str] = []
+        for a, b in self.normalize_ranges(ranges):
+            if page_marks:
+                parts.extend(f"[p. {a + i + 1}]\n{t}" for i, t in enumerate(self.page_texts(a, b)))
+            else:
+                parts.extend(self.page_texts(a, b))
+        return "\n".join(parts)
+
+    def sample_text(self, take_first: int, take_last: int, *, page_marks: bool = False) -> str:
+        return self.text_for_ranges(self.sample_ranges(take_first, take_last), page_marks=page_marks)
+
+    def token_chunks(
+        self,
+        *,
+        token_budget: int,
+        max_pages: int,
+        overlap_pages: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Empaqueta páginas consecutivas hasta `token_budget` tokens estimados (o `max_pages`).
+        Con `token_budget` <= 0 sólo cuenta `max_pages` (chunks de páginas fijas, modo clásico).
+        Una página que por sí sola excede el presupuesto va en su propio chunk.
+        `overlap_pages` repite las últimas N páginas de un chunk al inicio del siguiente.
+        Devuelve dicts: {idx, page_start, page_end (1-based, inclusivos), text, est_tokens,
+        page_offsets (offset en `text` donde empieza cada página)}.
+        """
+        self.prefetch()
+        n = self._page_count
+        budget = int(token_budget) if int(token_budget) > 0 else None
+        max_pages = max(1, int(max_pages))
+        overlap = max(0, int(overlap_pages))
+        page_tokens = [estimate_tokens(self.page_text(i)) for i in range(n)]
+
+        chunks: List[Dict[str, Any]] = []
+        start = 0
+        while start < n:
+            end, tokens = start, 0
+            while end < n and end - start < max_pages:
+                if budget is not None and end > start and tokens + page_tokens[end] > budget:
+                    break
+                tokens += page_tokens[end]
+                end += 1
+            pages = self.page_texts(start, end)
+            text = "\n".join(pages)
+            offsets, pos = [], 0
+            for t in pages:
+                offsets.append(pos)
+                pos += len(t) + 1
+            chunks.append({
+                "idx": len(chunks),
+                "page_start": start + 1,
+                "page_end": end,
+                "text": text,
+                "est_tokens": estimate_tokens(text),
+                "page_offsets": offsets,
+            })
+            if end >= n:
+                break
+            start = max(start + 1, end - overlap)
+        return chunks
+
+    def full_text(self) -> str:
+        return "\n".join(self.page_texts())
@@ -0,0 +1,176 @@
+# src/services/question_dedup.py
+from __future__ import annotations
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Set, Tuple
+import re
+import zlib
+
+from src.utils import es_text
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_SHINGLE = 5
+_NUM_PERM = 64
+_BANDS = 16  # 16 bandas × 4 filas: pares con Jaccard >= 0.7 casi siempre son candidatos
+_ROWS = _NUM_PERM // _BANDS
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Pocas letras de diferencia pero sentido opuesto: "¿Usaron armas?" vs "¿No usaron armas?"
+_NEGATIONS = frozenset("no nunca jamas ni tampoco nadie nada ningun ninguna ninguno sin".split())
+_NUMBER = re.compile(r"\d+")
+# Palabra con mayúscula inicial que no abre la oración (nombres propios: "Flaca", "Tijuana")
+_PROPER = re.compile(r"(?<![¿¡.!?:;]\s)(?<![¿¡.!?:;])(?<!^)\b[A-ZÁÉÍÓÚÜÑ][a-záéíóúüñ]+")
+
+
+def _perm_params(n: int) -> List[Tuple[int, int]]:
+    # Coeficientes deterministas (no dependen de PYTHONHASHSEED)
+    out, x = [], 0x9E3779B97F4A7C15
+    for _ in range(n):
+        x = (x * 6364136223846793005 + 1442695040888963407) & ((1 << 64) - 1)
+        a = (x >> 3) % _PRIME or 1
+        x = (x * 6364136223846793005 + 1442695040888963407) & ((1 << 64) - 1)
+        out.append((a, (x >> 3) % _PRIME))
+    return out
+
+
+_PERMS = _perm_params(_NUM_PERM)
+
+
+def normalize_question(text: str) -> str:
+    """Texto plegado (sin acentos, minúsculas) y sin signos: '¿Mencionó la "Flaca"…?' ≈ 'menciono la flaca …'."""
+    return _NON_WORD.sub(" ", es_text.fold(text)).strip()
+
+
+def shingles(text: str, k: int = _SHINGLE) -> Set[str]:
+    norm = normalize_question(text)
+    if len(norm) <= k:
+        return {norm} if norm else set()
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+
+def minhash(sh: Set[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) & _MASK for s in sh] or [0]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+
+def _negations(text: str) -> frozenset:
+    return frozenset(w for w in normalize_question(text).split() if w in _NEGATIONS)
+
+
+def _numbers(text: str) -> Tuple[str, ...]:
+    """Multiconjunto de números (fechas, montos, páginas): "día 12" y "día 13" no son la misma pregunta."""
+    return tuple(sorted(n.lstrip("0") or "0" for n in _NUMBER.findall(text or "")))
+
+
+def _proper_nouns(text: str) -> Tuple[str, ...] | None:
+    """Nombres propios (plegados); None si el texto está todo en mayúsculas (no se puede distinguir)."""
+    body = (text or "").strip()
+    if not body or body.upper() == body:
+        return None
+    return tuple(sorted(es_text.fold(w) for w in _PROPER.findall(body)))
+
+
+def _same_entities(a: Tuple, b: Tuple) -> bool:
+    """
+    Mismas negaciones, números y nombres propios. Si un texto está todo en mayúsculas, los
+    nombres propios del otro deben aparecer entre sus palabras (evita puentes transitivos).
+    """
+    neg_a, num_a, prop_a, words_a = a
+    neg_b, num_b, prop_b, words_b = b
+    if neg_a != neg_b or num_a != num_b:
+        return False
+    if prop_a is None and prop_b is None:
+        return True
+    if prop_a is None:
+        return set(prop_b) <= words_a
+    if prop_b is None:
+        return set(prop_a) <= words_b
+    return prop_a == prop_b
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def dedup_questions(
+    questions: Sequence[Dict[str, Any]],
+    *,
+    threshold: float = 0.85,
+) -> Tuple[List[Dict[str, Any]], List[List[int]]]:
+    """
+    Agrupa preguntas casi duplicadas (índice del TOC + cuerpo, redacción levemente distinta).
+      • Shingles de 5 caracteres sobre texto normalizado → MinHash (64 permutaciones).
+      • LSH por bandas para pares candidatos; el par se confirma con Jaccard exacto >= threshold
+        y las mismas negaciones ("no", "nunca"…), números (fechas, montos) y nombres propios,
+        que cambian la respuesta con pocas letras.
+      • Clusters por unión transitiva (union-find).
+    Devuelve (representantes, grupos): un representante por cluster (la primera aparición,
+    con la pista de página del primer miembro que la tenga) y, por representante, los índices
+    de las preguntas originales que responde.
+    """
+    n = len(questions)
+    sets = [shingles(q.get("text") or "") for q in questions]
+    sigs = [minhash(s) for s in sets]
+    ents = [
+        (_negations(t), _numbers(t), _proper_nouns(t), frozenset(normalize_question(t).split()))
+        for t in (q.get("text") or "" for q in questions)
+    ]
+
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked: Set[Tuple[int, int]] = set()
+    for band in range(_BANDS):
+        buckets: Dict[Tuple[int, ...], List[int]] = defaultdict(list)
+        for i, sig in enumerate(sigs):
+            buckets[sig[band * _ROWS:(band + 1) * _ROWS]].append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    i, j = members[x], members[y]
+                    if (i, j) in checked:
+                        continue
+                    checked.add((i, j))
+                    if _same_entities(ents[i], ents[j]) and jaccard(sets[i], sets[j]) >= threshold:
+                        ri, rj = find(i), find(j)
+                        if ri != rj:
+                            parent[max(ri, rj)] = min(ri, rj)  # raíz = primera aparición
+
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(n):
+        groups[find(i)].append(i)
+
+    reps: List[Dict[str, Any]] = []
+    out_groups: List[List[int]] = []
+    for root in sorted(groups):
+        idxs = groups[root]
+        rep = dict(questions[root])
+        if not rep.get("page_hint"):
+            rep["page_hint"] = next((questions[i].get("page_hint") for i in idxs if questions[i].get("page_hint")), None)
+        reps.append(rep)
+        out_groups.append(idxs)
+        if len(idxs) > 1:
+            logger.info(f"🧬 Duplicados: {[questions[i].get('id') for i in idxs]} → se responde una vez como {rep.get('id')}")
+    return reps, out_groups
+
+
+def fan_out(
+    answers: Sequence[str],
+    questions: Sequence[Dict[str, Any]],
+    groups: Sequence[Sequence[int]],
+) -> List[Dict[str, str]]:
+    """Q/A en el orden original: cada pregunta recibe la respuesta de su cluster."""
+    by_idx: Dict[int, str] = {}
+    for ans, idxs in zip(answers, groups):
+        for i in idxs:
+            by_idx[i] = ans
+    return [{"question": q["text"], "answer": by_idx.get(i, "")} for i, q in enumerate(questions)]
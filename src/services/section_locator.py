@@ -0,0 +1,62 @@
+# src/services/section_locator.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple
+
+from src.utils import es_text
+
+# Una página sin encabezado necesita al menos estas preguntas '¿…?' para contar como sección
+_MIN_QUESTIONS_NO_HEADING = 3
+_HEADING_WEIGHT = 5
+
+
+def score_pages(pages: Sequence[Tuple[int, str]], heading_re: Pattern) -> List[Dict[str, Any]]:
+    """Score por página: encabezado de `_VARIANTS` (texto plegado) + densidad de líneas '¿…?'."""
+    out = []
+    for idx, txt in pages:
+        heading = bool(heading_re.search(es_text.fold(txt)))
+        n_q = len(es_text.question_lines(txt))
+        out.append({"page": idx, "heading": heading, "questions": n_q, "score": _HEADING_WEIGHT * heading + n_q})
+    return out
+
+
+def locate_question_section(
+    pages: Sequence[Tuple[int, str]],
+    heading_re: Pattern,
+    *,
+    before: int = 1,
+    after: int = 3,
+    max_pages: int = 12,
+) -> Optional[Dict[str, Any]]:
+    """
+    Ventana de páginas (índices 0-based, `end` exclusivo) alrededor de la mejor página
+    candidata a sección de "Preguntas de regreso".
+      • Candidata: encabezado + al menos una pregunta, o >= 3 preguntas '¿…?' sin encabezado.
+      • La ventana toma `before` páginas antes y se extiende mientras las páginas siguientes
+        sigan teniendo preguntas (mínimo `after`), con tope `max_pages` y sin salir de las
+        páginas dadas (la muestra puede tener huecos).
+    Devuelve None si no hay candidata (el caller usa la muestra completa).
+    """
+    scored = score_pages(pages, heading_re)
+    cands = [
+        s for s in scored
+        if (s["heading"] and s["questions"] > 0) or s["questions"] >= _MIN_QUESTIONS_NO_HEADING
+    ]
+    if not cands:
+        return None
+    best = max(cands, key=lambda s: (s["score"], -s["page"]))
+    by_page = {s["page"]: s for s in scored}
+
+    start = best["page"]
+    while start - 1 in by_page and best["page"] - (start - 1) <= before:
+        start -= 1
+    end = best["page"] + 1
+    while end in by_page and end - start < max_pages and (end - best["page"] <= after or by_page[end]["questions"] > 0):
+        end += 1
+    return {
+        "start": start,
+        "end": end,
+        "page": best["page"],
+        "score": best["score"],
+        "heading": best["heading"],
+        "questions": sum(by_page[p]["questions"] for p in range(start, end)),
+    }
@@ -0,0 +1,132 @@
+# src/services/text_normalize.py
+from __future__ import annotations
+from collections import Counter
+from typing import Iterable, List, Set
+import re
+import threading
+
+from src.utils.logger import get_logger
+from src.utils.tokens import CHARS_PER_TOKEN
+
+logger = get_logger(__name__)
+
+_DIGITS = re.compile(r"\d+")
+# Patrones de numeración donde los dígitos sí varían entre páginas: "Página 3 de 300", "p. 12",
+# "3/300", "- 12 -", una línea que es sólo el número, Bates "ORT000123".
+_PAGE_NUMBER = re.compile(
+    r"\b(?:p[áa]g(?:ina)?s?|p|page)\.?\s*\d+(?:\s*(?:de|of|/)\s*\d+)?"
+    r"|\b\d+\s*/\s*\d+\b"
+    r"|^[\s\-–—]*\d+[\s\-–—]*$"
+    r"|\b[a-z]{2,}[\s\-_]?\d{4,}\b",
+    re.I,
+)
+_LETTERS = re.compile(r"[^\W\d_]")
+_SPACES = re.compile(r"[ \t\u00a0\f\v]+")
+_HYPHEN_BREAK = re.compile(r"(\w)-[ \t]*\n[ \t]*(\w)")
+_MANY_NEWLINES = re.compile(r"\n{3,}")
+
+# Líneas más largas que esto no se consideran encabezado/pie (son contenido).
+_MAX_BOILERPLATE_LINE = 160
+# Sólo las primeras/últimas líneas no vacías de cada página pueden ser encabezado/pie.
+_EDGE_LINES = 3
+# Mínimo de letras (sin contar dígitos): "R. Sí." o "R. No." nunca son boilerplate.
+_MIN_BOILERPLATE_LETTERS = 5
+
+
+def _line_signature(line: str) -> str:
+    """
+    Firma de línea para detectar repetición entre páginas: minúsculas, espacios colapsados
+    y dígitos → '#' SÓLO dentro de patrones de numeración ('Página 3 de 300' y 'Página 4 de 300',
+    o Bates ABC000123/ABC000124, coinciden; 'el día 12 de marzo' y 'el día 13' no).
+    """
+    norm = _SPACES.sub(" ", line).strip().lower()
+    return _PAGE_NUMBER.sub(lambda m: _DIGITS.sub("#", m.group()), norm)
+
+
+def _is_protected(line: str) -> bool:
+    # Nunca quitar líneas interrogativas: son justo lo que buscamos.
+    return "?" in line or "¿" in line
+
+
+def _edge_lines(lines: List[str]) -> Set[int]:
+    """Índices de las primeras/últimas `_EDGE_LINES` líneas no vacías (zona de encabezado/pie)."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:_EDGE_LINES] + filled[-_EDGE_LINES:])
+
+
+def _is_candidate(line: str) -> bool:
+    return (
+        len(line) <= _MAX_BOILERPLATE_LINE
+        and not _is_protected(line)
+        and len(_LETTERS.findall(line)) >= _MIN_BOILERPLATE_LETTERS
+    )
+
+
+class TextNormalizer:
+    """
+    Normalización de texto por página antes de enviarlo a Vertex:
+      • Quita líneas repetidas en muchas páginas (Bates, membretes, nº de página, pies de
+        confidencialidad), sólo en la zona de encabezado/pie de cada página: el cuerpo
+        (p. ej. "R. No recuerdo." en una transcripción) nunca se toca.
+      • Une palabras cortadas con guion al final de línea.
+      • Colapsa espacios y saltos de línea.
+    Lleva estadísticas de caracteres/tokens ahorrados.
+    """
+
+    def __init__(self, boilerplate: Set[str] | None = None):
+        self.boilerplate: Set[str] = set(boilerplate or ())
+        self.chars_in = 0
+        self.chars_out = 0
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fit(cls, pages: Iterable[str], *, min_ratio: float = 0.3, min_pages: int = 3) -> "TextNormalizer":
+        """Aprende las firmas de encabezados/pies que se repiten en >= min_ratio de las páginas dadas."""
+        pages = list(pages)
+        df: Counter = Counter()
+        for txt in pages:
+            lines = (txt or "").splitlines()
+            sigs = {_line_signature(lines[i]) for i in _edge_lines(lines) if _is_candidate(lines[i])}
+            df.update(sigs)
+        threshold = max(min_pages, int(min_ratio * len(pages) + 0.999))
+        boiler = {sig for sig, n in df.items() if sig and n >= threshold}
+        if boiler:
+            logger.info(f"🧹 Boilerplate: {len(boiler)} líneas repetidas detectadas en {len(pages)} páginas.")
+        return cls(boiler)
+
+    def normalize(self, text: str) -> str:
+        raw = text or ""
+        src = raw.splitlines()
+        edges = _edge_lines(src) if self.boilerplate else set()
+        lines: List[str] = []
+        for i, line in enumerate(src):
+            if i in edges and not _is_protected(line) and _line_signature(line) in self.boilerplate:
+                continue
+            lines.append(_SPACES.sub(" ", line).strip())
+        out = "\n".join(lines)
+        out = _HYPHEN_BREAK.sub(r"\1\2", out)
+        out = _MANY_NEWLINES.sub("\n\n", out).strip()
+        with self._lock:
+            self.chars_in += len(raw)
+            self.chars_out += len(out)
+            self.pages += 1
+        return out
+
+    def stats(self) -> dict:
+        saved = max(0, self.chars_in - self.chars_out)
+        return {
+            "pages": self.pages,
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+            "chars_saved": saved,
+            "tokens_saved": (saved + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN,
+            "pct_saved": round(100.0 * saved / self.chars_in, 1) if self.chars_in else 0.0,
+        }
+
+    def log_stats(self, tag: str = "🧹 Normalización") -> None:
+        st = self.stats()
+        logger.info(
+            f"{tag}: {st['pages']} páginas, -{st['chars_saved']} caracteres "
+            f"(~{st['tokens_saved']} tokens, {st['pct_saved']}%)."
+        )
@@ -32,11 +32,37 @@ class Settings(BaseSettings):
     pdf_staging_bucket: Optional[str] = Field(None, env="PDF_STAGING_BUCKET")
     pdf_max_pages_per_chunk: int = Field(60, env="PDF_MAX_PAGES_PER_CHUNK")
     pdf_use_file_api: bool = Field(True, env="PDF_USE_FILE_API")
+    pdf_text_workers: int = Field(0, env="PDF_TEXT_WORKERS")                        # 0 = nº de CPUs
+    pdf_text_parallel_min_pages: int = Field(120, env="PDF_TEXT_PARALLEL_MIN_PAGES")  # debajo: serial
+    pdf_text_cache_enabled: bool = Field(True, env="PDF_TEXT_CACHE_ENABLED")
+    pdf_text_cache_dir: Optional[str] = Field("/tmp/regresos-text-cache", env="PDF_TEXT_CACHE_DIR")
+    pdf_text_cache_max_mb: int = Field(512, env="PDF_TEXT_CACHE_MAX_MB")              # LRU por tamaño total
+    drive_download_chunk_mb: int = Field(8, env="DRIVE_DOWNLOAD_CHUNK_MB")
+    drive_download_dir: Optional[str] = Field(None, env="DRIVE_DOWNLOAD_DIR")              # None = tempdir del sistema
 
     # --- Vertex AI (compat) ---
     vertex_model_id: str = Field("gemini-2.5-flash", env="VERTEX_MODEL_ID")
     vertex_model_id_pro: str = Field("gemini-2.5-pro", env="VERTEX_MODEL_ID_PRO")
 
+    # --- Limitador de cuota Vertex (token bucket por modelo + AIMD ante 429; compartido por el proceso) ---
+    vertex_limiter_enabled: bool = Field(True, env="VERTEX_LIMITER_ENABLED")
+    vertex_rpm: int = Field(60, env="VERTEX_RPM")                     # requests/min por modelo
+    vertex_tpm: int = Field(1_000_000, env="VERTEX_TPM")              # tokens/min (estimados) por modelo
+    vertex_rate_limits_json: Optional[str] = Field(None, env="VERTEX_RATE_LIMITS_JSON")  # {"modelo": {"rpm":..,"tpm":..}}
+    vertex_limiter_min_factor: float = Field(0.1, env="VERTEX_LIMITER_MIN_FACTOR")
+    vertex_limiter_recover_step: float = Field(0.05, env="VERTEX_LIMITER_RECOVER_STEP")
+
+    # --- Cache persistente prompt → respuesta (SQLite; opt-in) ---
+    vertex_response_cache_enabled: bool = Field(False, env="VERTEX_RESPONSE_CACHE_ENABLED")
+    vertex_response_cache_path: Optional[str] = Field("/tmp/regresos-vertex-cache.sqlite", env="VERTEX_RESPONSE_CACHE_PATH")
+    vertex_response_cache_max_mb: int = Field(256, env="VERTEX_RESPONSE_CACHE_MAX_MB")      # LRU por tamaño total
+    vertex_response_cache_ttl_s: int = Field(7 * 24 * 3600, env="VERTEX_RESPONSE_CACHE_TTL_S")  # 0 = sin TTL
+
+    # --- Context caching de prefijos ([SYSTEM] + [PROMPT_BASE], texto de chunk) por job ---
+    vertex_context_cache_backend: str = Field("none", env="VERTEX_CONTEXT_CACHE_BACKEND")  # "vertex" | "fake" | "none" (opt-in: CachedContent se factura)
+    vertex_context_cache_min_tokens: int = Field(2048, env="VERTEX_CONTEXT_CACHE_MIN_TOKENS")  # mínimo de Vertex
+    vertex_context_cache_ttl_s: int = Field(3600, env="VERTEX_CONTEXT_CACHE_TTL_S")
+
     # --- Modelos para el pipeline híbrido ---
     map_model_id: str = Field("gemini-2.5-flash", env="MAP_MODEL_ID")     # rápido (Flash)
     reduce_model_id: str = Field("gemini-2.5-pro", env="REDUCE_MODEL_ID") # calidad (Pro)
@@ -52,13 +78,47 @@ class Settings(BaseSettings):
     backq_detect_limit: int = Field(100, env="BACKQ_DETECT_LIMIT")
     backq_strategy: str = Field("hybrid", env="BACKQ_STRATEGY")  # "hybrid" | "per_question"
 
+    # --- Localizador de la sección de preguntas dentro de la muestra (ventana para el detector) ---
+    backq_locate_section: bool = Field(True, env="BACKQ_LOCATE_SECTION")
+    backq_locator_pages_before: int = Field(1, env="BACKQ_LOCATOR_PAGES_BEFORE")
+    backq_locator_pages_after: int = Field(3, env="BACKQ_LOCATOR_PAGES_AFTER")
+    backq_locator_max_pages: int = Field(12, env="BACKQ_LOCATOR_MAX_PAGES")
+    # Muestreo adaptativo: extremos de N páginas, duplicando hasta first/last_pages si no hay sección
+    backq_sampling_mode: str = Field("adaptive", env="BACKQ_SAMPLING_MODE")  # "adaptive" | "fixed"
+    backq_sampling_initial_pages: int = Field(5, env="BACKQ_SAMPLING_INITIAL_PAGES")
+
+    # --- Dedup de preguntas casi duplicadas (MinHash sobre shingles del texto normalizado) ---
+    backq_dedup_questions: bool = Field(True, env="BACKQ_DEDUP_QUESTIONS")
+    backq_dedup_threshold: float = Field(0.85, env="BACKQ_DEDUP_THRESHOLD")
+
     # --- Routing (router + batch por chunk) ---
     backq_k_top_chunks: int = Field(3, env="BACKQ_K_TOP_CHUNKS")
     backq_min_cover: int = Field(2, env="BACKQ_MIN_COVER")
     backq_chunk_cap: int = Field(20, env="BACKQ_CHUNK_CAP")
+    backq_scorer: str = Field("heuristic", env="BACKQ_SCORER")  # "heuristic" | "bm25"
+    backq_router: str = Field("greedy", env="BACKQ_ROUTER")  # "greedy" | "planner"
+    backq_use_page_hints: bool = Field(True, env="BACKQ_USE_PAGE_HINTS")
+
+    # --- Chunking por presupuesto de tokens (0 = páginas fijas PDF_MAX_PAGES_PER_CHUNK) ---
+    backq_chunk_token_budget: int = Field(30000, env="BACKQ_CHUNK_TOKEN_BUDGET")
+    backq_chunk_max_pages: int = Field(120, env="BACKQ_CHUNK_MAX_PAGES")
+    backq_chunk_overlap_pages: int = Field(0, env="BACKQ_CHUNK_OVERLAP_PAGES")
+
+    # --- Normalización de texto (boilerplate: Bates, membretes, nº de página, pies) ---
+    backq_strip_boilerplate: bool = Field(True, env="BACKQ_STRIP_BOILERPLATE")
+    backq_boilerplate_min_ratio: float = Field(0.3, env="BACKQ_BOILERPLATE_MIN_RATIO")
+
+    # --- Contexto de MAP por pasajes (ventanas relevantes del chunk; 0 = chunk completo) ---
+    backq_map_context_tokens: int = Field(6000, env="BACKQ_MAP_CONTEXT_TOKENS")
+    backq_passage_window_tokens: int = Field(300, env="BACKQ_PASSAGE_WINDOW_TOKENS")
 
     # --- Throttling para llamadas MAP ---
-    backq_throttle_s: float = Field(1.0, env="BACKQ_THROTTLE_S")
+    backq_throttle_s: float = Field(0.0, env="BACKQ_THROTTLE_S")  # el limitador de vertex_client regula la cuota
+    backq_map_concurrency: int = Field(4, env="BACKQ_MAP_CONCURRENCY")  # llamadas MAP en vuelo por job
+    backq_reduce_batch_tokens: int = Field(12000, env="BACKQ_REDUCE_BATCH_TOKENS")   # tope por llamada REDUCE en lote
+    backq_reduce_batch_size: int = Field(8, env="BACKQ_REDUCE_BATCH_SIZE")            # preguntas por llamada (1 = sin lotes)
+    backq_reduce_single_candidate: str = Field("skip", env="BACKQ_REDUCE_SINGLE_CANDIDATE")  # "skip" | "flash" | "pro"
+    backq_reduce_single_max_tokens: int = Field(150, env="BACKQ_REDUCE_SINGLE_MAX_TOKENS")
 
     # --- Mapping BasePrompts por tipo de visa ---
     base_prompt_ids_json: Optional[str] = Field(None, env="BASE_PROMPT_IDS_JSON")
@@ -78,6 +138,19 @@ class Settings(BaseSettings):
         except Exception:
             return {}
 
+    def vertex_rate_limits(self) -> Dict[str, Dict[str, float]]:
+        """Overrides por modelo {model_id: {"rpm": n, "tpm": n}} desde env JSON; dict vacío si falta o es inválido."""
+        import json
+        if not self.vertex_rate_limits_json:
+            return {}
+        try:
+            return {
+                str(k): {kk: float(vv) for kk, vv in dict(v).items() if kk in ("rpm", "tpm")}
+                for k, v in json.loads(self.vertex_rate_limits_json).items()
+            }
+        except Exception:
+            return {}
+
     @property
     def use_adc(self) -> bool:
         """True si se usa ADC (Cloud Run/gcloud) en lugar de SA JSON local."""
@@ -0,0 +1,112 @@
+# src/utils/es_text.py
+"""
+Tokenizer/normalizador de español compartido por router, scorers, pasajes y detección.
+  • fold(): minúsculas + sin acentos (á→a, ü→u, ñ→n); `lower()` en C y solo los caracteres
+    acentuados pasan por Python.
+  • tokens(): palabras de >= 3 letras, sin stopwords, con stemming ligero por sufijos
+    ("amenazó", "amenazas", "amenazaron" → "amenaz"). Cacheado por texto.
+  • token_offsets(): token → offsets de sus ocurrencias (ventanas de pasajes).
+  • question_lines(): líneas interrogativas '¿…?' (detector regex y localizador).
+Todo precompilado a nivel de módulo.
+"""
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import re
+import unicodedata
+
+
+def _build_fold_table() -> dict:
+    table = {}
+    for ch in "ÁÉÍÓÚÜÑÀÈÌÒÙÂÊÎÔÛÄËÏÖáéíóúüñàèìòùâêîôûäëïö":
+        base = unicodedata.normalize("NFD", ch)[0].lower()
+        table[ord(ch)] = base
+    for ch in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+        table[ord(ch)] = ch.lower()
+    return table
+
+
+_FOLD = _build_fold_table()
+_ACCENTED = re.compile("[" + "".join(chr(c) for c in _FOLD if chr(c).islower()) + "]")
+_WORD = re.compile(r"[a-z0-9]{3,}")  # el mínimo de 3 letras se aplica en la regex
+_QUESTION = re.compile(r"¿.+\?")
+MIN_TOKEN_LEN = 3
+
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada como con contra cual cuales
+cuando de del desde donde dos el ella ellas ello ellos en entre era eran es esa esas ese eso esos esta
+estaba estaban estan estar este esto estos fue fueron ha habia han hasta hay la las le les lo los mas me
+mi mis mucho muy nada ni no nos o otra otras otro otros para pero poco por porque que quien quienes se
+sea segun ser si sin sobre solo son su sus tambien tan te tenia tiene tienen todo todos tu tus un una
+uno unos usted ustedes y ya yo
+""".split())
+
+# Sufijos flexivos/derivativos comunes (más largos primero); el stem conserva >= 3 letras.
+_SUFFIXES: Tuple[str, ...] = tuple(sorted("""
+amientos imientos aciones uciones amiento imiento adoras adores ancias encias idades
+mente acion ucion adora ador ancia encia ables ibles istas idad able ible ista
+osos osas oso osa
+aron ieron ando iendo aban iban aba ados adas idos idas ado ada ido ida
+ara iera aria amos emos imos ais eis
+an en ar er ir as es os a e o s
+""".split(), key=len, reverse=True))
+
+
+def _unaccent(m: "re.Match") -> str:
+    return _FOLD[ord(m.group())]
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin acentos (misma longitud que el original: offsets intercambiables)."""
+    text = text or ""
+    low = text.lower()
+    if len(low) != len(text):  # p. ej. 'İ' → 2 caracteres: tabla char→char, más lenta
+        return text.translate(_FOLD)
+    return low if low.isascii() else _ACCENTED.sub(_unaccent, low)
+
+
+@lru_cache(maxsize=65536)
+def stem(token: str) -> str:
+    for suf in _SUFFIXES:
+        if token.endswith(suf) and len(token) - len(suf) >= MIN_TOKEN_LEN:
+            return token[: -len(suf)]
+    return token
+
+
+def _tokenize(text: str, use_stem: bool) -> Tuple[str, ...]:
+    words = _WORD.findall(fold(text))
+    if use_stem:
+        return tuple(stem(t) for t in words if t not in STOPWORDS)
+    return tuple(t for t in words if t not in STOPWORDS)
+
+
+@lru_cache(maxsize=4096)
+def _tokens_cached(text: str, use_stem: bool) -> Tuple[str, ...]:
+    return _tokenize(text, use_stem)
+
+
+def tokens(text: str, *, use_stem: bool = True, cache: bool = True) -> List[str]:
+    """Tokens normalizados (con repetidos, en orden). `cache=False` para textos grandes de un solo uso."""
+    toks = _tokens_cached(text or "", use_stem) if cache else _tokenize(text or "", use_stem)
+    return list(toks)
+
+
+def token_offsets(text: str, *, use_stem: bool = True) -> Dict[str, List[int]]:
+    """Token normalizado → offsets de inicio de cada ocurrencia (palabras completas, sobre fold(text))."""
+    out: Dict[str, List[int]] = {}
+    for m in _WORD.finditer(fold(text)):
+        t = m.group()
+        if t in STOPWORDS:
+            continue
+        out.setdefault(stem(t) if use_stem else t, []).append(m.start())
+    return out
+
+
+def question_lines(text: str) -> List[str]:
+    """Líneas (strip) que contienen una pregunta '¿…?'."""
+    out = []
+    for line in (text or "").splitlines():
+        s = line.strip()
+        if s and _QUESTION.search(s):
+            out.append(s)
+    return out
@@ -0,0 +1,96 @@
+# src/utils/json_parse.py
+"""
+Parser tolerante para la salida JSON de los modelos (detección, MAP).
+  • Camino rápido: `json.loads` directo (lo normal con `response_mime_type="application/json"`).
+  • Fallback único: quita fences ```json, ubica el primer '{' y decodifica con
+    `JSONDecoder.raw_decode` (en C; ignora texto antes/después).
+  • Salida truncada (límite de tokens): rescata los elementos completos del arreglo
+    `array_key` ("answers", "questions") en vez de descartar el chunk entero.
+  • Contadores por tipo de llamada: ok / recuperado / fallido (`parse_stats()`).
+  • `is_complete_json_object`: chequeo estricto (sin rescate ni contadores) para decidir
+    si una respuesta puede guardarse en el cache de respuestas.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import json
+import re
+import threading
+
+_DECODER = json.JSONDecoder()
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.I)
+_WS = re.compile(r"[\s,]*")
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(kind: str, outcome: str) -> None:
+    with _stats_lock:
+        bucket = _stats.setdefault(kind, {"ok": 0, "recovered": 0, "failed": 0})
+        bucket[outcome] += 1
+
+
+def parse_stats() -> Dict[str, Dict[str, int]]:
+    """{kind: {"ok", "recovered", "failed"}} del proceso."""
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+def is_complete_json_object(raw: str) -> bool:
+    """True si `raw` (sin fences ```json) es un objeto JSON completo; una salida truncada no lo es."""
+    try:
+        return isinstance(json.loads(_FENCE.sub("", (raw or "").strip())), dict)
+    except ValueError:
+        return False
+
+
+def _salvage_array(s: str, array_key: str) -> Optional[List[Any]]:
+    """Elementos completos de `"array_key": [ ... ` aunque el arreglo (o el objeto) quede cortado."""
+    m = re.search(r'"%s"\s*:\s*\[' % re.escape(array_key), s)
+    if not m:
+        return None
+    items: List[Any] = []
+    pos = m.end()
+    while True:
+        pos = _WS.match(s, pos).end()
+        if pos >= len(s) or s[pos] == "]":
+            break
+        try:
+            item, pos = _DECODER.raw_decode(s, pos)
+        except ValueError:
+            break  # elemento truncado: se queda lo anterior
+        items.append(item)
+    return items
+
+
+def parse_json_object(raw: str, *, array_key: Optional[str] = None, kind: str = "json") -> Dict[str, Any]:
+    """
+    Objeto JSON de la salida del modelo. Con `array_key`, una salida truncada devuelve
+    `{array_key: [elementos completos]}`. Lanza ValueError si no hay nada rescatable.
+    """
+    s = (raw or "").strip()
+    try:
+        data = json.loads(s)
+        if isinstance(data, dict):
+            _count(kind, "ok")
+            return data
+    except ValueError:
+        pass
+
+    s = _FENCE.sub("", s).strip()
+    start = s.find("{")
+    if start != -1:
+        try:
+            data, _ = _DECODER.raw_decode(s, start)
+            if isinstance(data, dict):
+                _count(kind, "recovered")
+                return data
+        except ValueError:
+            pass
+        if array_key:
+            items = _salvage_array(s[start:], array_key)
+            if items:
+                _count(kind, "recovered")
+                return {array_key: items}
+    _count(kind, "failed")
+    raise ValueError("No se encontró JSON válido en la salida del modelo.")
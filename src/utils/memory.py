@@ -0,0 +1,23 @@
+# src/utils/memory.py
+from __future__ import annotations
+import resource
+
+
+def peak_rss_mb() -> float:
+    """
+    Pico de RSS del proceso en MB (VmHWM; fallback a ru_maxrss). Es del proceso completo:
+    acumula todos los jobs que corrieron (o corren en paralelo) en esta instancia.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except Exception:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def children_peak_rss_mb() -> float:
+    """Pico de RSS (MB) del mayor proceso hijo ya terminado (p. ej. workers de extracción de texto)."""
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
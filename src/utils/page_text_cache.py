@@ -0,0 +1,122 @@
+# src/utils/page_text_cache.py
+from __future__ import annotations
+from functools import lru_cache
+from typing import List, Optional
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def sha256_of_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class PageTextCache:
+    """
+    Cache en disco, direccionado por contenido, del texto extraído de un PDF.
+      • Clave: SHA-256 de los bytes del PDF.
+      • Valor: JSON comprimido (zlib) con page_count + texto por página.
+      • Tope de tamaño total con desalojo LRU (mtime se actualiza en cada hit).
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json.z")
+
+    def get(self, key: str) -> Optional[List[str]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            pages = payload.get("pages")
+            if not isinstance(pages, list) or len(pages) != payload.get("page_count"):
+                raise ValueError("entrada inconsistente")
+            os.utime(path, None)  # LRU: marca como usado recientemente
+            return [str(p or "") for p in pages]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Cache de texto: entrada corrupta {key[:12]}… ({e}); se descarta.")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, key: str, pages: List[str], *, backend: str = "") -> None:
+        path = self._path(key)
+        blob = zlib.compress(
+            json.dumps({"page_count": len(pages), "backend": backend, "pages": pages}, ensure_ascii=False).encode("utf-8"),
+            6,
+        )
+        if self.max_bytes and len(blob) > self.max_bytes:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)  # escritura atómica
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        logger.info(f"🗄️ Cache de texto: guardado {key[:12]}… ({len(pages)} páginas, {len(blob) // 1024} KiB).")
+        self._evict()
+
+    def _evict(self) -> None:
+        if not self.max_bytes:
+            return
+        with self._lock:
+            entries = []
+            total = 0
+            for dirpath, _, files in os.walk(self.root):
+                for name in files:
+                    if not name.endswith(".json.z"):
+                        continue
+                    p = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(p)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, p))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()  # más antiguo primero
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(p)
+                    total -= size
+                    logger.info(f"🗄️ Cache de texto: desalojado {os.path.basename(p)[:12]}… (LRU).")
+                except OSError:
+                    pass
+
+
+@lru_cache(maxsize=1)
+def get_page_text_cache() -> Optional[PageTextCache]:
+    """Instancia compartida según settings; None si el cache está deshabilitado."""
+    if not settings.pdf_text_cache_enabled or not settings.pdf_text_cache_dir:
+        return None
+    try:
+        return PageTextCache(settings.pdf_text_cache_dir, settings.pdf_text_cache_max_mb * 1024 * 1024)
+    except Exception as e:
+        logger.warning(f"Cache de texto deshabilitado: {e}")
+        return None
@@ -0,0 +1,139 @@
+# src/utils/response_cache.py
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key       TEXT PRIMARY KEY,
+    model     TEXT NOT NULL,
+    created   REAL NOT NULL,
+    last_used REAL NOT NULL,
+    size      INTEGER NOT NULL,
+    value     BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used);
+"""
+
+
+def response_key(model_id: str, generation_config: Optional[Dict[str, Any]], payload: Any) -> str:
+    """SHA-256 de (modelo, generation_config, prompt/partes); JSON canónico para que sea estable."""
+    raw = json.dumps(
+        {"model": model_id, "config": generation_config or {}, "payload": payload},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache persistente prompt → respuesta de Vertex en SQLite (un archivo, modo WAL).
+      • Clave: `response_key(...)`; valor: texto comprimido con zlib.
+      • TTL: una entrada más vieja que `ttl_s` es un miss y se borra.
+      • Tope de tamaño total con desalojo LRU por `last_used`.
+      • Contadores de hits/misses/escrituras/desalojos del proceso (`stats()`).
+    Un reintento del job (Cloud Tasks) o un re-run con el mismo PDF y prompts responde
+    al instante las llamadas que ya se hicieron.
+    """
+
+    def __init__(self, path: str, *, max_bytes: int, ttl_s: float):
+        self.path = path
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_s = max(0.0, float(ttl_s))
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT created, value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_s and now - row[0] > self.ttl_s:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._counts["misses"] += 1
+                return None
+            try:
+                text = zlib.decompress(row[1]).decode("utf-8")
+            except Exception as e:
+                logger.warning(f"Cache de respuestas: entrada corrupta {key[:12]}… ({e}); se descarta.")
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._counts["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))  # LRU
+            self._counts["hits"] += 1
+        return text
+
+    def put(self, key: str, text: str, *, model_id: str = "") -> None:
+        blob = zlib.compress((text or "").encode("utf-8"), 6)
+        if self.max_bytes and len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, created, last_used, size, value) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_id, now, now, len(blob), blob),
+            )
+            self._counts["writes"] += 1
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.ttl_s:
+            cur = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_s,))
+            self._counts["evictions"] += max(0, cur.rowcount)
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self._counts["evictions"] += len(doomed)
+        logger.info(f"🗄️ Cache de respuestas: {len(doomed)} entrada(s) desalojada(s) (LRU).")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> Optional[ResponseCache]:
+    """Instancia compartida según settings; None si el cache está deshabilitado (default)."""
+    if not settings.vertex_response_cache_enabled or not settings.vertex_response_cache_path:
+        return None
+    try:
+        return ResponseCache(
+            settings.vertex_response_cache_path,
+            max_bytes=settings.vertex_response_cache_max_mb * 1024 * 1024,
+            ttl_s=settings.vertex_response_cache_ttl_s,
+        )
+    except Exception as e:
+        logger.warning(f"Cache de respuestas deshabilitado: {e}")
+        return None
@@ -0,0 +1,43 @@
+# src/utils/timing.py
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+import threading
+import time
+
+
+class StageTimer:
+    """
+    Acumula la duración (wall time) de cada etapa de un job.
+    Thread-safe: las etapas que corren en otro hilo (pipeline) también se registran.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def timed(self, name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Ejecuta `fn` registrando su duración como `name` (útil con executor.submit)."""
+        with self.stage(name):
+            return fn(*args, **kwargs)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def summary(self) -> str:
+        with self._lock:
+            items = list(self._stages.items())
+        return " | ".join(f"{k}={v:.2f}s" for k, v in items) or "(sin etapas)"
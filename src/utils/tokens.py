@@ -0,0 +1,11 @@
+# src/utils/tokens.py
+from __future__ import annotations
+
+# Aproximación estándar para Gemini en texto latino: ~4 caracteres por token.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (sin tokenizer remoto)."""
+    n = len(text or "")
+    return (n + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
@@ -0,0 +1,74 @@
+# tests/test_drive_download_unit.py
+import hashlib
+import os
+
+import pytest
+
+drive_client = pytest.importorskip("src.clients.drive_client")
+
+_CHUNK = 256 * 1024  # mínimo que acepta _download_chunk_size
+
+
+class _FakeDrive:
+    def __init__(self, data):
+        self.data = data
+        self.requested = []
+
+    def files(self):
+        return self
+
+    def get_media(self, fileId, supportsAllDrives):
+        self.requested.append(fileId)
+        return self.data
+
+
+class _FakeDownload:
+    """Como MediaIoBaseDownload: escribe `chunksize` bytes por `next_chunk()` en `fd`."""
+    writes = []
+
+    def __init__(self, fd, request, chunksize):
+        self.fd, self.data, self.chunksize, self.pos = fd, request, chunksize, 0
+
+    def next_chunk(self):
+        if self.pos and self.data.startswith(b"corte"):  # falla a mitad de descarga
+            raise ConnectionError("descarga interrumpida")
+        block = self.data[self.pos:self.pos + self.chunksize]
+        self.fd.write(block)
+        type(self).writes.append(len(block))
+        self.pos += len(block)
+        return None, self.pos >= len(self.data)
+
+
+@pytest.fixture
+def fake_drive(monkeypatch, tmp_path):
+    monkeypatch.setattr(drive_client, "MediaIoBaseDownload", _FakeDownload)
+    monkeypatch.setattr(drive_client.settings, "drive_download_dir", str(tmp_path))
+    _FakeDownload.writes = []
+
+    def install(data):
+        drive = _FakeDrive(data)
+        monkeypatch.setattr(drive_client, "build_drive_client", lambda: drive)
+        return drive
+
+    return install
+
+
+def test_download_streams_in_chunks_and_hashes_on_the_fly(fake_drive, tmp_path):
+    data = os.urandom(_CHUNK * 2 + 1000)
+    drive = fake_drive(data)
+
+    path, sha = drive_client.download_file_to_tempfile("ABC", chunk_size=_CHUNK)
+
+    assert drive.requested == ["ABC"]
+    assert _FakeDownload.writes == [_CHUNK, _CHUNK, 1000]  # por bloques, nunca el archivo entero
+    assert os.path.dirname(path) == str(tmp_path) and path.endswith(".pdf")
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert sha == hashlib.sha256(data).hexdigest()
+
+
+def test_failed_download_removes_temp_file(fake_drive, tmp_path):
+    fake_drive(b"corte" + os.urandom(_CHUNK * 2))
+    with pytest.raises(ConnectionError):
+        drive_client.download_file_to_tempfile("ABC", chunk_size=_CHUNK)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,20 @@
+# tests/test_es_text_unit.py
+from src.utils import es_text
+
+
+def test_fold_keeps_length_and_strips_accents():
+    s = "¿AMENAZÓ la Señora Flaca? Pingüino"
+    assert es_text.fold(s) == "¿amenazo la senora flaca? pinguino"
+    assert len(es_text.fold(s)) == len(s)
+
+
+def test_tokens_stem_and_drop_stopwords():
+    assert es_text.tokens("¿Amenazó la coyote?") == ["amenaz", "coyot"]
+    stems = {es_text.tokens(w)[0] for w in ("amenaza", "amenazas", "amenazaron", "amenazó")}
+    assert stems == {"amenaz"}
+    assert es_text.tokens("¿Qué pasó con los días?") == ["pas", "dia"]
+
+
+def test_question_lines():
+    txt = "Preguntas de regreso\n  ¿Usaron armas?  \nNota: sin pregunta\n¿Quién?"
+    assert es_text.question_lines(txt) == ["¿Usaron armas?", "¿Quién?"]
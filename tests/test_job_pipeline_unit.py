@@ -0,0 +1,113 @@
+# tests/test_job_pipeline_unit.py
+import hashlib
+import os
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+bq = pytest.importorskip("src.services.back_questions")
+from src.services import pdf_text
+from src.utils.page_text_cache import PageTextCache
+
+
+def _pdf_file(tmp_path, n_pages=90) -> str:
+    doc = fitz.open()
+    for i in range(n_pages):
+        doc.new_page().insert_text((72, 72), f"Declaracion pagina {i + 1}")
+    path = str(tmp_path / "descarga.pdf")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def _run(monkeypatch, download, *, prompts_fail=False, detect=None, cache=None):
+    monkeypatch.setattr(bq, "assert_sa_has_access", lambda *a, **k: None)
+    # Sin cache de texto en disco salvo que el test pase uno propio (aislado en tmp_path)
+    monkeypatch.setattr(pdf_text, "get_page_text_cache", lambda: cache)
+
+    def get_doc(doc_id):
+        if prompts_fail:
+            raise PermissionError("sin acceso al prompt")
+        return f"contenido {doc_id}"
+
+    monkeypatch.setattr(bq, "get_document_content", get_doc)
+    monkeypatch.setattr(bq, "download_file_to_tempfile", download)
+    if detect is not None:
+        monkeypatch.setattr(bq, "_detect_back_questions_via_model_text", detect)
+    return bq.process_back_questions_job(
+        system_instructions_doc_id="sys", base_prompt_doc_id="base",
+        pdf_url="https://drive.google.com/file/d/ABC/view", output_doc_id="out", drive_file_id=None,
+        sampling_first_pages=40, sampling_last_pages=40,
+        additional_params={"locate_section": False, "strip_boilerplate": False},
+    )
+
+
+def _download_of(path):
+    def download(fid):
+        return path, hashlib.sha256(open(path, "rb").read()).hexdigest()
+    return download
+
+
+def test_download_error_propagates(monkeypatch):
+    def download(fid):
+        raise ConnectionError("Drive caído")
+
+    with pytest.raises(ConnectionError, match="Drive caído"):
+        _run(monkeypatch, download)
+
+
+def test_prompt_error_discards_downloaded_file(monkeypatch, tmp_path):
+    path = _pdf_file(tmp_path)
+    with pytest.raises(PermissionError):
+        _run(monkeypatch, _download_of(path), prompts_fail=True)
+    assert not os.path.exists(path)
+
+
+def test_unreadable_pdf_propagates_and_removes_temp_file(monkeypatch, tmp_path):
+    path = str(tmp_path / "roto.pdf")
+    with open(path, "wb") as f:
+        f.write(b"esto no es un PDF")
+    with pytest.raises(Exception):
+        _run(monkeypatch, _download_of(path))
+    assert not os.path.exists(path)
+
+
+def _spy_opened(monkeypatch):
+    opened = []
+    real_init = bq.ParsedPdf.__init__
+
+    def spy_init(self, *a, **k):
+        real_init(self, *a, **k)
+        opened.append(self)
+
+    monkeypatch.setattr(bq.ParsedPdf, "__init__", spy_init)
+    return opened
+
+
+def _failing_detect(text, max_questions):
+    raise RuntimeError("detector caído")
+
+
+def test_failure_after_open_closes_pdf_and_removes_temp_file(monkeypatch, tmp_path):
+    path = _pdf_file(tmp_path)
+    opened = _spy_opened(monkeypatch)
+
+    with pytest.raises(RuntimeError, match="detector caído"):
+        _run(monkeypatch, _download_of(path), detect=_failing_detect)
+    assert len(opened) == 1 and opened[0].backend == "pymupdf"  # el PDF sí se abrió
+    assert opened[0]._fitz_doc is None
+    assert not os.path.exists(path)
+
+
+def test_cache_hit_skips_parsing_and_still_removes_temp_file(monkeypatch, tmp_path):
+    path = _pdf_file(tmp_path)
+    cache = PageTextCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    sha = hashlib.sha256(open(path, "rb").read()).hexdigest()
+    cache.put(sha, [f"Declaracion pagina {i + 1}" for i in range(90)], backend="pymupdf")
+    opened = _spy_opened(monkeypatch)
+
+    with pytest.raises(RuntimeError, match="detector caído"):
+        _run(monkeypatch, _download_of(path), detect=_failing_detect, cache=cache)
+    assert len(opened) == 1 and opened[0].backend == "cache" and opened[0]._fitz_doc is None
+    assert opened[0].page_count == 90
+    assert not os.path.exists(path)
@@ -0,0 +1,35 @@
+# tests/test_json_parse_unit.py
+import pytest
+
+from src.utils import json_parse
+from src.utils.json_parse import parse_json_object
+
+
+def _delta(before, kind):
+    after = json_parse.parse_stats().get(kind, {"ok": 0, "recovered": 0, "failed": 0})
+    prev = before.get(kind, {"ok": 0, "recovered": 0, "failed": 0})
+    return {k: after[k] - prev[k] for k in after}
+
+
+def test_clean_fenced_and_wrapped_output():
+    before = json_parse.parse_stats()
+    assert parse_json_object('{"answers": []}', kind="t1") == {"answers": []}
+    assert parse_json_object('```json\n{"a": "x}"}\n```', kind="t1") == {"a": "x}"}
+    assert parse_json_object('Claro: {"a": {"b": [1, 2]}} espero que sirva {', kind="t1") == {"a": {"b": [1, 2]}}
+    assert _delta(before, "t1") == {"ok": 1, "recovered": 2, "failed": 0}
+
+
+def test_truncated_output_keeps_complete_answers():
+    raw = ('{"chunk_id": 3, "answers": [{"id": "q1", "answer": "La Flaca {amenazó}"}, '
+           '{"id": "q2", "answer": "Sí, con armas"}, {"id": "q3", "answer": "Los casti')
+    data = parse_json_object(raw, array_key="answers", kind="t2")
+    assert [a["id"] for a in data["answers"]] == ["q1", "q2"]
+
+
+def test_unrecoverable_output_is_counted_and_raises():
+    before = json_parse.parse_stats()
+    with pytest.raises(ValueError):
+        parse_json_object("no hay json aquí", array_key="answers", kind="t3")
+    with pytest.raises(ValueError):
+        parse_json_object('{"answers": [{"id": "q1", "ans', array_key="answers", kind="t3")
+    assert _delta(before, "t3") == {"ok": 0, "recovered": 0, "failed": 2}
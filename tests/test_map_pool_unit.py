@@ -0,0 +1,89 @@
+# tests/test_map_pool_unit.py
+import json
+import re
+import threading
+import time
+
+from google.api_core import exceptions as gex
+
+from src.services import back_questions as bq
+
+
+def _chunk_of(prompt):
+    return int(re.search(r"<<<\nchunk (\d+)", prompt).group(1))
+
+
+def test_map_pool_merges_out_of_order_results_by_chunk_id(monkeypatch):
+    delays = {0: 0.30, 1: 0.05, 2: 0.20, 3: 0.10, 4: 0.15, 5: 0.01}
+    in_flight, peak, lock = [0], [0], threading.Lock()
+
+    def fake_json(prompt, *, model_id=None, response_schema=None):
+        cidx = _chunk_of(prompt)
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(delays[cidx])
+        with lock:
+            in_flight[0] -= 1
+        return json.dumps({"chunk_id": cidx, "answers": [{"id": "q1", "answer": f"c{cidx}"},
+                                                         {"id": f"q{cidx + 10}", "answer": "propia"}]})
+
+    monkeypatch.setattr(bq, "generate_json", fake_json)
+    jobs = [(c, f"chunk {c}", [{"id": "q1", "text": "¿A?"}, {"id": f"q{c + 10}", "text": "¿B?"}]) for c in delays]
+    progress = []
+
+    t0 = time.perf_counter()
+    partials, slowest = bq._run_map_pool(jobs, workers=3, throttle_s=0.0, on_progress=lambda d, t: progress.append((d, t)))
+    elapsed = time.perf_counter() - t0
+
+    assert partials["q1"] == [f"c{c}" for c in range(6)]  # orden de chunk, no de llegada
+    assert partials["q13"] == ["propia"]
+    assert progress == [(i, 6) for i in range(1, 7)]
+    assert peak[0] == 3                                   # nunca más llamadas en vuelo que workers
+    assert slowest >= 0.30
+    assert elapsed < sum(delays.values()) * 0.75          # serial: 0.81 s
+
+
+def test_map_pool_keeps_other_chunks_when_a_worker_fails(monkeypatch):
+    subsets = []
+
+    def fake_json(prompt, *, model_id=None, response_schema=None):
+        cidx = _chunk_of(prompt)
+        ids = re.findall(r'"id": "(q\d+)"', prompt)
+        subsets.append((cidx, ids))
+        if cidx == 1:
+            raise RuntimeError("Vertex caído")
+        if cidx == 2 and len(ids) > 1:
+            raise gex.ResourceExhausted("cuota")  # 429 → reintento con la mitad de las preguntas
+        return json.dumps({"chunk_id": cidx, "answers": [{"id": i, "answer": f"c{cidx}"} for i in ids]})
+
+    monkeypatch.setattr(bq, "generate_json", fake_json)
+    qs = [{"id": "q1", "text": "¿A?"}, {"id": "q2", "text": "¿B?"}]
+    jobs = [(c, f"chunk {c}", qs) for c in range(4)]
+
+    partials, _ = bq._run_map_pool(jobs, workers=2, throttle_s=0.0)
+
+    assert partials["q1"] == ["c0", "c2", "c3"]  # el chunk 1 falló sin tumbar a los demás
+    assert partials["q2"] == ["c0", "c3"]        # el reintento del chunk 2 sólo lleva q1
+    assert sorted(ids for c, ids in subsets if c == 2) == [["q1"], ["q1", "q2"]]
+
+
+def test_map_pool_with_one_worker_runs_serially(monkeypatch):
+    in_flight, peak, order = [0], [0], []
+
+    def fake_json(prompt, *, model_id=None, response_schema=None):
+        cidx = _chunk_of(prompt)
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        order.append(cidx)
+        time.sleep(0.01)
+        in_flight[0] -= 1
+        return json.dumps({"chunk_id": cidx, "answers": [{"id": "q1", "answer": f"c{cidx}"}]})
+
+    monkeypatch.setattr(bq, "generate_json", fake_json)
+    jobs = [(c, f"chunk {c}", [{"id": "q1", "text": "¿A?"}]) for c in (3, 0, 2, 1)]
+
+    partials, _ = bq._run_map_pool(jobs, workers=1, throttle_s=0.0)
+
+    assert peak[0] == 1 and order == [3, 0, 2, 1]  # map_concurrency=1: una llamada a la vez, en orden de envío
+    assert partials["q1"] == ["c0", "c1", "c2", "c3"]
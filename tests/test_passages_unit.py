@@ -0,0 +1,60 @@
+# tests/test_passages_unit.py
+from src.services.passages import PassageIndex
+from src.utils.tokens import estimate_tokens
+
+
+def _chunk(pages):
+    text = "\n".join(pages)
+    offsets, pos = [], 0
+    for p in pages:
+        offsets.append(pos)
+        pos += len(p) + 1
+    return text, offsets
+
+
+def test_context_keeps_relevant_windows_with_page_marks():
+    filler = "el declarante respondió las preguntas de la oficial sobre su viaje. " * 40
+    pages = [filler] * 20
+    pages[13] = filler[:600] + " La coyote Flaca amenazó con armas al grupo en la frontera. " + filler[:600]
+    text, offsets = _chunk(pages)
+
+    idx = PassageIndex(text, page_start=101, page_offsets=offsets, window_tokens=100)
+    ctx = idx.context_for(["¿Qué amenazas hizo la coyote Flaca?"], token_budget=300)
+
+    assert "coyote Flaca amenazó" in ctx
+    assert ctx.startswith("[p. 114")
+    assert estimate_tokens(ctx) <= 300 + 10  # marcas de página
+    assert estimate_tokens(ctx) * 10 < estimate_tokens(text)
+
+
+def test_context_falls_back_to_full_text():
+    text, offsets = _chunk(["uno dos tres " * 200, "cuatro cinco " * 200])
+    idx = PassageIndex(text, page_offsets=offsets, window_tokens=50)
+    assert idx.context_for(["¿Nada que ver aquí?"], token_budget=100) == text  # sin coincidencias
+    assert idx.context_for(["¿tres?"], token_budget=0) == text                 # deshabilitado
+
+
+def test_windows_match_whole_words_only():
+    decoy = "El pasaporte y la media de la guardia quedaron en el ocaso. " * 30
+    text = decoy + " Nadie sabe qué pasó esos días en la casa. " + decoy
+    idx = PassageIndex(text, window_tokens=60)
+    top = idx.ranking("¿Qué pasó con los días en la casa?")
+    s, e = idx.windows[top[0]]
+    assert "pasó esos días" in text[s:e]
+    assert all("pasó" in text[slice(*idx.windows[w])] for w in top)
+
+
+def test_map_context_reports_whether_the_whole_chunk_was_sent():
+    from src.services.back_questions import _map_context
+
+    filler = "el declarante respondió las preguntas de la oficial sobre su viaje. " * 40
+    pages = [filler] * 10
+    pages[4] = filler[:600] + " La coyote Flaca amenazó con armas al grupo. " + filler[:600]
+    text, offsets = _chunk(pages)
+    chunk = {"text": text, "page_start": 1, "page_offsets": offsets, "est_tokens": estimate_tokens(text)}
+    flaca = [{"id": "q1", "text": "¿Qué amenazas hizo la coyote Flaca?"}]
+
+    ctx, whole = _map_context(chunk, flaca, 300, 100)
+    assert "coyote Flaca" in ctx and not whole                           # pasajes propios de la pregunta
+    assert _map_context(chunk, flaca, 0, 100) == (text, True)            # presupuesto 0
+    assert _map_context(chunk, [{"id": "q2", "text": "¿Zzz?"}], 300, 100) == (text, True)  # sin coincidencias
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from src.services.pdf_text import ParsedPdf
+from src.utils.page_text_cache import PageTextCache
+from src.utils.tokens import estimate_tokens
+
+
+def _make_pdf(n_pages: int) -> bytes:
+    doc = fitz.open()
+    for i in range(n_pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Pagina {i + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_parsed_pdf_page_count_and_sample():
+    with ParsedPdf(_make_pdf(10), use_cache=False) as pdf:
+        assert pdf.page_count == 10
+        assert pdf.sample_ranges(2, 3) == [(0, 2), (7, 10)]
+        # muestra más grande que el PDF: sin solapes ni duplicados
+        assert pdf.sample_ranges(8, 8) == [(0, 10)]
+        assert pdf.normalize_ranges([(5, 7), (-3, 1), (6, 9), (9, 40)]) == [(0, 1), (5, 10)]
+        assert pdf.text_for_ranges([(4, 5)]).strip() == "Pagina 5"
+        txt = pdf.sample_text(2, 3)
+        assert "Pagina 1" in txt and "Pagina 10" in txt and "Pagina 5" not in txt
+
+
+def test_parsed_pdf_chunks_cover_all_pages_once():
+    with ParsedPdf(_make_pdf(12), use_cache=False) as pdf:
+        chunks = pdf.token_chunks(token_budget=0, max_pages=5)  # modo clásico: páginas fijas
+        assert [(c["page_start"], c["page_end"]) for c in chunks] == [(1, 5), (6, 10), (11, 12)]
+        assert "Pagina 6" in chunks[1]["text"] and "Pagina 12" in chunks[2]["text"]
+        assert chunks[1]["text"] == "\n".join(pdf.page_texts(5, 10))
+
+
+def test_parsed_pdf_parallel_matches_serial():
+    data = _make_pdf(9)
+    with ParsedPdf(data, workers=1, use_cache=False) as serial, \
+            ParsedPdf(data, workers=2, parallel_min_pages=1, use_cache=False) as par:
+        assert par.page_texts() == serial.page_texts()
+
+
+def test_parsed_pdf_cache_hit_skips_parsing(tmp_path):
+    cache = PageTextCache(str(tmp_path), max_bytes=10 * 1024 * 1024)
+    data = _make_pdf(6)
+    with ParsedPdf(data, cache=cache) as first:
+        expected = first.page_texts()
+        assert first.backend != "cache"
+    with ParsedPdf(data, cache=cache) as second:
+        assert second.backend == "cache"
+        assert second.page_count == 6
+        assert second.page_texts() == expected
+
+
+def test_page_text_cache_lru_eviction(tmp_path):
+    cache = PageTextCache(str(tmp_path), max_bytes=0)
+    cache.put("a" * 64, ["uno"])
+    cache.put("b" * 64, ["dos"])
+    for i, f in enumerate(sorted(tmp_path.rglob("*.json.z"))):
+        os.utime(f, (1000 + i, 1000 + i))  # 'a' más antiguo que 'b'
+    assert cache.get("a" * 64) == ["uno"]  # el hit convierte a 'a' en el más reciente
+    cache.max_bytes = max(f.stat().st_size for f in tmp_path.rglob("*.json.z")) + 1
+    cache._evict()
+    assert cache.get("a" * 64) == ["uno"]
+    assert cache.get("b" * 64) is None
+
+
+def test_parsed_pdf_from_path_removes_owned_file(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(_make_pdf(3))
+    pdf = ParsedPdf(str(path), owns_file=True, use_cache=False)
+    assert pdf.page_count == 3 and "Pagina 2" in pdf.full_text()
+    pdf.close()
+    assert not path.exists()
+
+
+def test_token_chunks_respect_budget_and_overlap():
+    with ParsedPdf(_make_pdf(10), use_cache=False) as pdf:
+        per_page = max(estimate_tokens(t) for t in pdf.page_texts())  # "Pagina N" ~ mismo tamaño
+        chunks = pdf.token_chunks(token_budget=per_page * 3, max_pages=100)
+        assert [(c["page_start"], c["page_end"]) for c in chunks] == [(1, 3), (4, 6), (7, 9), (10, 10)]
+        assert all(c["est_tokens"] > 0 for c in chunks)
+
+        overl = pdf.token_chunks(token_budget=per_page * 3, max_pages=100, overlap_pages=1)
+        assert [(c["page_start"], c["page_end"]) for c in overl][:2] == [(1, 3), (3, 5)]
+        assert overl[-1]["page_end"] == 10
+
+        fixed = pdf.token_chunks(token_budget=0, max_pages=4)
+        assert [(c["page_start"], c["page_end"]) for c in fixed] == [(1, 4), (5, 8), (9, 10)]
+
+
+def test_request_zero_chunk_budget_selects_page_count_chunking(monkeypatch):
+    from src.services import back_questions as bq
+
+    monkeypatch.setattr(bq.settings, "backq_chunk_token_budget", 4000)
+    monkeypatch.setattr(bq.settings, "backq_chunk_overlap_pages", 1)
+    monkeypatch.setattr(bq.settings, "pdf_max_pages_per_chunk", 5)
+    with ParsedPdf(_make_pdf(12), use_cache=False) as pdf:
+        chunks = bq._build_text_chunks(pdf, {"chunk_token_budget": 0, "chunk_overlap_pages": 0})
+        assert [(c["page_start"], c["page_end"]) for c in chunks] == [(1, 5), (6, 10), (11, 12)]
+        # sin override: presupuesto de settings (todo cabe en un chunk)
+        assert len(bq._build_text_chunks(pdf, {})) == 1
+
+
+def test_parallel_prefetch_reuses_one_pool_and_spills_bytes_once():
+    with ParsedPdf(_make_pdf(12), workers=2, parallel_min_pages=1, use_cache=False) as pdf:
+        pdf.prefetch(0, 6)
+        pool, path = pdf._pool, pdf._worker_path
+        assert pool is not None and isinstance(path, str) and os.path.exists(path)
+        pdf.prefetch(6, 12)
+        assert pdf._pool is pool and pdf._worker_path == path
+        assert pdf.page_text(11).strip() == "Pagina 12"
+    assert pdf._pool is None and not os.path.exists(path)
@@ -0,0 +1,39 @@
+# tests/test_question_dedup_unit.py
+from src.services.question_dedup import dedup_questions, fan_out
+
+
+def test_near_duplicates_merge_and_fan_out_in_original_order():
+    qs = [
+        {"id": "q1", "text": "¿Mencionó la coyote Flaca alguna amenaza?", "page_hint": None},
+        {"id": "q2", "text": "¿Usaron armas durante los diez días?", "page_hint": None},
+        {"id": "q3", "text": "¿Mencionó la coyote “Flaca” alguna amenaza?", "page_hint": 12},
+        {"id": "q4", "text": "¿No usaron armas durante los diez días?", "page_hint": None},
+    ]
+    reps, groups = dedup_questions(qs, threshold=0.85)
+    assert [r["id"] for r in reps] == ["q1", "q2", "q4"]
+    assert groups == [[0, 2], [1], [3]]
+    assert reps[0]["page_hint"] == 12  # hereda la pista del duplicado
+
+    qas = fan_out(["A1", "A2", "A4"], qs, groups)
+    assert [qa["question"] for qa in qas] == [q["text"] for q in qs]
+    assert [qa["answer"] for qa in qas] == ["A1", "A2", "A1", "A4"]
+
+
+def test_questions_differing_only_by_date_are_not_merged():
+    base = "¿Qué hizo el testigo el día {d} de marzo de 2019 cuando llegó a la casa de la señora en la frontera?"
+    qs = [{"id": "q1", "text": base.format(d=12)}, {"id": "q2", "text": base.format(d=13)},
+          {"id": "q3", "text": base.format(d="12")}]
+    reps, groups = dedup_questions(qs)
+    assert [r["id"] for r in reps] == ["q1", "q2"]
+    assert groups == [[0, 2], [1]]
+
+
+def test_questions_differing_only_by_name_are_not_merged():
+    qs = [
+        {"id": "q1", "text": "¿Qué le dijo Martínez al declarante cuando cruzaron juntos el río hacia la frontera norte?"},
+        {"id": "q2", "text": "¿Qué le dijo Ramírez al declarante cuando cruzaron juntos el río hacia la frontera norte?"},
+        {"id": "q3", "text": "¿QUÉ LE DIJO MARTÍNEZ AL DECLARANTE CUANDO CRUZARON JUNTOS EL RÍO HACIA LA FRONTERA NORTE?"},
+    ]
+    reps, groups = dedup_questions(qs, threshold=0.75)  # Jaccard ~0.8: sólo el nombre los separa
+    assert [r["id"] for r in reps] == ["q1", "q2"]
+    assert groups == [[0, 2], [1]]
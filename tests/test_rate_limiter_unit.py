@@ -0,0 +1,71 @@
+# tests/test_rate_limiter_unit.py
+import pytest
+
+vertex_client = pytest.importorskip("src.clients.vertex_client")
+from google.api_core import exceptions as gex
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, s):
+        self.now += s
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(vertex_client.time, "monotonic", c.monotonic)
+    monkeypatch.setattr(vertex_client.time, "sleep", c.sleep)
+    return c
+
+
+def test_bucket_paces_requests_to_rpm(clock):
+    lim = vertex_client.AdaptiveRateLimiter("m", rpm=60, tpm=1_000_000)
+    for _ in range(10):  # ráfaga de ~10 s de cupo sin espera
+        assert lim.acquire() == 0.0
+    for _ in range(30):
+        lim.acquire()
+    assert clock.now == pytest.approx(30.0, abs=1.0)  # después, 1 request/s
+
+
+def test_tokens_per_minute_budget(clock):
+    lim = vertex_client.AdaptiveRateLimiter("m", rpm=1000, tpm=6000)  # 100 tokens/s, ráfaga 1000
+    lim.acquire(1000)
+    lim.acquire(500)
+    assert clock.now == pytest.approx(5.0, abs=0.1)
+
+
+def test_aimd_halves_on_429_and_recovers_additively(clock):
+    lim = vertex_client.AdaptiveRateLimiter("m", rpm=60, tpm=1_000_000, min_factor=0.1, recover_step=0.1)
+    lim.on_throttled()
+    lim.on_throttled()
+    assert lim.factor == pytest.approx(0.25)
+    for _ in range(5):
+        lim.on_throttled()
+    assert lim.factor == pytest.approx(0.1)
+    for _ in range(3):
+        lim.on_success()
+    assert lim.factor == pytest.approx(0.4)
+    for _ in range(20):
+        lim.on_success()
+    assert lim.factor == 1.0
+
+
+def test_call_with_retry_feeds_limiter(clock):
+    lim = vertex_client.AdaptiveRateLimiter("m", rpm=600, tpm=1_000_000)
+    calls = []
+
+    def make_call():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise gex.ResourceExhausted("quota")
+        return "ok"
+
+    out = vertex_client._call_with_retry(make_call, desc="t", first_wait=0.0, limiter=lim, tokens=10)
+    assert out == "ok" and len(calls) == 2
+    assert lim.factor == pytest.approx(0.5 + lim.recover_step)
@@ -0,0 +1,48 @@
+# tests/test_reduce_batch_unit.py
+import json
+import re
+
+from src.services import back_questions as bq
+
+
+def test_batched_reduce_packs_questions_and_short_circuits_single_candidates(monkeypatch):
+    calls = []
+
+    def fake_json(prompt, *, model_id=None, response_schema=None):
+        ids = re.findall(r'"id": "(q\d+)"', prompt.split("Preguntas con sus candidatos", 1)[1])
+        calls.append((model_id, ids))
+        return json.dumps({"answers": [{"id": i, "answer": f"final {i}"} for i in ids if i != "q4"]})
+
+    monkeypatch.setattr(bq, "generate_json", fake_json)
+    monkeypatch.setattr(bq, "generate_text", lambda prompt, model_id=None: calls.append((model_id, "single")) or "solo")
+    questions = [{"id": f"q{i}", "text": f"¿Pregunta {i}?"} for i in range(1, 7)]
+    partials = {
+        "q1": ["a", "b"], "q2": ["c", "d"], "q3": ["corto"], "q4": ["e", "f"], "q5": ["g", "h"],
+    }
+
+    out = bq._reduce_answers_batched(
+        "sys", "base", questions, partials,
+        batch_tokens=10_000, batch_size=3, single_mode="skip", single_max_tokens=50,
+    )
+
+    assert out["q3"] == "corto"                       # 1 candidato corto: sin llamada
+    assert "No se encontró evidencia" in out["q6"]    # sin candidatos: sin llamada
+    assert [c[1] for c in calls] == [["q1", "q2", "q4"], "single", "single"]
+    assert out["q1"] == "final q1" and out["q2"] == "final q2"
+    assert out["q4"] == "solo" and out["q5"] == "solo"  # id faltante en el lote y lote de 1 → individual
+    assert all(mdl == bq.settings.reduce_model_id for mdl, _ in calls)
+
+
+def test_unknown_single_candidate_mode_warns_and_falls_back_to_skip(monkeypatch, caplog):
+    calls = []
+    monkeypatch.setattr(bq, "generate_json", lambda *a, **k: calls.append("json") or "{}")
+    monkeypatch.setattr(bq, "generate_text", lambda *a, **k: calls.append("text") or "x")
+    questions = [{"id": "q1", "text": "¿A?"}, {"id": "q2", "text": "¿B?"}]
+
+    out = bq._reduce_answers_batched(
+        "sys", "base", questions, {"q1": ["corto"], "q2": ["otro"]},
+        batch_tokens=10_000, batch_size=8, single_mode="flahs", single_max_tokens=50,
+    )
+
+    assert out == {"q1": "corto", "q2": "otro"} and calls == []  # como "skip": sin llamadas
+    assert any("flahs" in r.getMessage() for r in caplog.records)
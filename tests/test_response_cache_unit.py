@@ -0,0 +1,44 @@
+# tests/test_response_cache_unit.py
+import time
+
+from src.utils.response_cache import ResponseCache, response_key
+
+
+def test_hit_miss_and_key_sensitivity(tmp_path):
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=1 << 20, ttl_s=0)
+    k = response_key("flash", None, "¿Qué pasó?")
+    assert k == response_key("flash", {}, "¿Qué pasó?")
+    assert k != response_key("pro", None, "¿Qué pasó?")
+    assert k != response_key("flash", {"response_mime_type": "application/json"}, "¿Qué pasó?")
+
+    assert cache.get(k) is None
+    cache.put(k, "respuesta ñ", model_id="flash")
+    assert cache.get(k) == "respuesta ñ"
+    assert cache.stats() == {"hits": 1, "misses": 1, "writes": 1, "evictions": 0}
+
+    # persiste entre instancias (reintento del job en el mismo contenedor)
+    cache.close()
+    again = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=1 << 20, ttl_s=0)
+    assert again.get(k) == "respuesta ñ"
+
+
+def test_ttl_expires_entries(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=0, ttl_s=60)
+    cache.put("k", "v")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("k") is None
+
+
+def test_lru_eviction_by_size(tmp_path):
+    import os
+    big = lambda i: os.urandom(3000).hex()  # hex aleatorio: ~3.3 KB comprimido
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=8_000, ttl_s=0)
+    cache.put("a", big(0))
+    cache.put("b", big(1))
+    time.sleep(0.01)
+    assert cache.get("a") is not None  # "a" pasa a ser la más reciente
+    cache.put("c", big(2))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
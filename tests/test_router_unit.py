@@ -1,5 +1,15 @@
 # tests/test_router_unit.py
-from src.services.back_questions import _route_questions_to_chunks
+import random
+
+import pytest
+
+from src.services.back_questions import (
+    _plan_questions_to_chunks,
+    _route_questions_to_chunks,
+    _select_topk_chunks_for_question,
+)
+from src.services.chunk_index import ChunkIndex
+from src.utils import es_text
 
 def test_route_questions_simple():
     # 3 preguntas, 2 chunks de texto (simulados)
@@ -28,3 +38,126 @@ def test_route_questions_simple():
             covered.add(q["id"])
 
     assert {"q1","q2","q3"}.issubset(covered), f"Preguntas sin cobertura: { {'q1','q2','q3'}-covered }"
+
+
+def test_route_single_chunk_with_min_cover_above_chunk_count():
+    questions = [{"id": "q1", "text": "¿Usaron armas?"}, {"id": "q2", "text": "¿Hubo amenazas?"}]
+    routing = _route_questions_to_chunks(
+        questions=questions,
+        chunk_texts=["Había armas y amenazas."],
+        k_top=3,
+        min_cover=2,
+        chunk_cap=20,
+    )
+    assert [q["id"] for q in routing[0]] == ["q1", "q2"]
+
+
+def _reference_topk(question, chunk_texts, k):
+    # Scorer directo (conteo de tokens completos por chunk, sin índice) como referencia
+    tokens = es_text.tokens(question)
+    scores = sorted(((sum(es_text.tokens(txt).count(t) for t in tokens), i) for i, txt in enumerate(chunk_texts)), reverse=True)
+    return [i for sc, i in scores[:k] if sc > 0] or list(range(0, min(k, len(chunk_texts))))
+
+
+def test_chunk_index_matches_reference_rankings():
+    rnd = random.Random(7)
+    vocab = "amenaza amenazas armas armados coyote flaca escapar días golpes policía frontera casa".split()
+    chunks = [" ".join(rnd.choice(vocab) for _ in range(rnd.randint(0, 60))) for _ in range(15)]
+    index = ChunkIndex(chunks)
+    for _ in range(50):
+        q = "¿" + " ".join(rnd.choice(vocab + ["el", "de", "que"]) for _ in range(rnd.randint(1, 6))) + "?"
+        for k in (1, 2, 3, 5):
+            assert _select_topk_chunks_for_question(q, chunks, k=k, index=index) == _reference_topk(q, chunks, k)
+
+
+def test_stems_match_whole_words_not_substrings():
+    # "pasó"/"días" → stems "pas"/"dia": no deben contar "pasaporte", "media", "guardia"…
+    decoy = "El pasaporte y la media de la guardia quedaron en el ocaso; pasaportes, medias, guardias. " * 4
+    relevant = "Nadie sabe qué pasó esos días en la casa; pasaron días enteros sin comer."
+    chunks = [decoy, relevant]
+    q = "¿Qué pasó con los días en la casa?"
+    assert es_text.tokens(q) == ["pas", "dia", "cas"]
+    assert ChunkIndex(chunks).ranking(q) == [1]
+    assert _select_topk_chunks_for_question(q, chunks, k=1) == [1]
+
+
+def test_bm25_prefers_rare_terms_and_routes():
+    pytest.importorskip("numpy")
+    from src.services.chunk_index import Bm25Index, build_chunk_index
+
+    filler = "el declarante manifestó ante la corte que " * 30
+    chunks = [
+        filler + "armas armas",
+        "La coyote Flaca amenazó al grupo. " + filler,
+        filler,
+    ]
+    index = build_chunk_index(chunks, "bm25")
+    assert isinstance(index, Bm25Index)
+    index.prepare(["¿Qué dijo la coyote Flaca a la corte?", "¿Había armas?"])
+    assert index.topk("¿Qué dijo la coyote Flaca a la corte?", 1) == [1]
+    assert index.topk("¿Había armas?", 1) == [0]
+    assert index.topk("¿Sin relación alguna?", 2) == [0, 1]
+
+    questions = [{"id": "q1", "text": "¿Había armas?"}, {"id": "q2", "text": "¿Amenazó la coyote Flaca?"}]
+    routing = _route_questions_to_chunks(questions, chunks, k_top=1, min_cover=1, chunk_cap=5, index=index)
+    assert [q["id"] for q in routing[0]] == ["q1"]
+    assert [q["id"] for q in routing[1]] == ["q2"]
+
+
+def test_route_never_duplicates_question_on_a_chunk():
+    # Ranking con un solo chunk relevante + min_cover=3: antes quedaba "cubierta en [0, 1, 1]"
+    chunks = ["nada", "armas armas armas", "nada tampoco"]
+    questions = [{"id": f"q{i}", "text": "¿Había armas?"} for i in range(4)]
+    routing = _route_questions_to_chunks(questions, chunks, k_top=3, min_cover=3, chunk_cap=2)
+    for cidx, lst in routing.items():
+        ids = [q["id"] for q in lst]
+        assert len(ids) == len(set(ids)), (cidx, ids)
+    covered = {q["id"] for lst in routing.values() for q in lst}
+    assert covered == {q["id"] for q in questions}
+
+
+def test_spills_into_a_chunk_never_push_it_over_the_cap():
+    # Chunk 0 atrae a todas las preguntas; el derrame llena los siguientes y el último no pasa de 8
+    chunks = ["armas amenaza coyote " * 5, "armas", "amenaza", "coyote"]
+    questions = [{"id": f"q{i}", "text": "¿Había armas, amenaza o coyote?"} for i in range(30)]
+    routing = _route_questions_to_chunks(questions, chunks, k_top=1, min_cover=1, chunk_cap=8)
+    assert all(len(lst) <= 8 for lst in routing.values()), {c: len(lst) for c, lst in routing.items()}
+    covered = {q["id"] for lst in routing.values() for q in lst}
+    assert covered == {q["id"] for q in questions}
+
+
+def test_planner_covers_every_question_with_fewer_calls():
+    rnd = random.Random(3)
+    vocab = "amenaza armas coyote frontera policía golpes escapar casa deuda pandilla".split()
+    chunks = [" ".join(rnd.choice(vocab) for _ in range(80)) for _ in range(30)]
+    questions = [{"id": f"q{i}", "text": "¿" + " ".join(rnd.sample(vocab, 3)) + "?"} for i in range(40)]
+    params = dict(k_top=3, min_cover=2, chunk_cap=8)
+
+    plan = _plan_questions_to_chunks(questions, chunks, **params)
+    greedy = _route_questions_to_chunks(questions, chunks, **params)
+
+    cover = {}
+    for cidx, lst in plan.items():
+        assert len(lst) <= params["chunk_cap"]
+        ids = [q["id"] for q in lst]
+        assert len(ids) == len(set(ids))
+        for qid in ids:
+            cover[qid] = cover.get(qid, 0) + 1
+    assert all(cover.get(q["id"], 0) >= params["min_cover"] for q in questions)
+    assert sum(1 for lst in plan.values() if lst) <= sum(1 for lst in greedy.values() if lst)
+
+
+def test_page_hint_pins_covering_chunk():
+    chunks = ["armas armas armas", "nada", "armas en la casa"]
+    page_ranges = [(1, 10), (11, 20), (21, 30)]
+    questions = [
+        {"id": "q1", "text": "¿Había armas?", "page_hint": 15},
+        {"id": "q2", "text": "¿Qué armas se mencionan en la página 25?", "page_hint": None},
+        {"id": "q3", "text": "¿Había armas?", "page_hint": None},
+    ]
+    routing = _route_questions_to_chunks(
+        questions, chunks, k_top=1, min_cover=1, chunk_cap=5, page_ranges=page_ranges
+    )
+    cover = {q["id"]: c for c, lst in routing.items() for q in lst}
+    assert cover == {"q1": 1, "q2": 2, "q3": 0}
+
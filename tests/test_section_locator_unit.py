@@ -0,0 +1,96 @@
+# tests/test_section_locator_unit.py
+import pytest
+
+from src.services.back_questions import _ANY_VARIANT
+from src.services.section_locator import locate_question_section
+
+
+def test_locates_heading_page_and_extends_over_questions():
+    pages = [(i, f"Texto de la declaración, página {i}.") for i in range(40)]
+    pages[30] = (30, "PREGUNTAS DE REGRESO\n¿Usaron armas?\n¿Hubo amenazas?")
+    pages[31] = (31, "¿Quién era la Flaca?")
+    pages[36] = (36, "¿Pregunta suelta?")
+    win = locate_question_section(pages, _ANY_VARIANT, before=1, after=2, max_pages=12)
+    assert (win["page"], win["start"], win["end"]) == (30, 29, 33)
+    assert win["questions"] == 3
+
+
+def test_question_density_without_heading_and_no_hit():
+    pages = [(i, "nada relevante") for i in range(10)]
+    assert locate_question_section(pages, _ANY_VARIANT) is None
+    pages[4] = (4, "¿Uno?\n¿Dos?\n¿Tres?")
+    win = locate_question_section(pages, _ANY_VARIANT, before=0, after=0)
+    assert (win["start"], win["end"]) == (4, 5)
+
+
+def _questions_pdf(n_pages: int, q_page: int) -> bytes:
+    fitz = pytest.importorskip("fitz")
+    doc = fitz.open()
+    for i in range(n_pages):
+        page = doc.new_page()
+        lines = [f"Declaracion pagina {i + 1}"]
+        if i == q_page:
+            lines += ["Preguntas de regreso", "¿Quién lo amenazó?", "¿Usaron armas?", "¿Cuándo cruzó?"]
+        for j, line in enumerate(lines):
+            page.insert_text((72, 72 + 16 * j), line)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_adaptive_detection_sends_each_window_once(monkeypatch):
+    bq = pytest.importorskip("src.services.back_questions")
+    from src.services.pdf_text import ParsedPdf
+    from src.utils.timing import StageTimer
+
+    sent = []
+    monkeypatch.setattr(bq, "_detect_back_questions_via_model_text", lambda text, max_questions: sent.append(text) or [])
+    with ParsedPdf(_questions_pdf(100, q_page=2), use_cache=False) as pdf:
+        windows = []
+        questions, _ = bq._detect_with_locator(
+            pdf, take_first=40, take_last=40, width=5, max_q=10, timer=StageTimer(), sent_windows=windows,
+        )
+    # anchos 5 → 10 → 20 → 40: la ventana alrededor de p.3 no cambia → una sola llamada
+    assert questions == [] and len(sent) == 1 and len(windows) == 1
+    assert "¿Usaron armas?" in sent[0]
+    assert bq._ranges_covered([(1, 3)], windows) and not bq._ranges_covered([(0, 40)], windows)
+
+
+def test_adaptive_detection_stops_at_first_hit(monkeypatch):
+    bq = pytest.importorskip("src.services.back_questions")
+    from src.services.pdf_text import ParsedPdf
+    from src.utils.timing import StageTimer
+
+    sent = []
+    found = [{"id": "q1", "text": "¿Quién lo amenazó?"}]
+    monkeypatch.setattr(bq, "_detect_back_questions_via_model_text", lambda text, max_questions: sent.append(text) or found)
+    with ParsedPdf(_questions_pdf(100, q_page=85), use_cache=False) as pdf:
+        windows = []
+        questions, _ = bq._detect_with_locator(
+            pdf, take_first=40, take_last=40, width=5, max_q=10, timer=StageTimer(), sent_windows=windows,
+        )
+    # la sección (p.86) aparece recién con extremos de 20 páginas; antes no hay ventana ni llamada
+    assert questions == found and len(sent) == 1
+    assert windows[0][0] <= 85 < windows[0][1]
+
+
+def test_fixed_mode_with_asymmetric_sample_calls_detector_once(monkeypatch):
+    bq = pytest.importorskip("src.services.back_questions")
+    from src.services.pdf_text import ParsedPdf
+    from src.utils.timing import StageTimer
+
+    sent, passes = [], []
+
+    def locate(pdf, ranges):  # una ventana distinta por pasada: cada pasada extra costaría una llamada
+        passes.append(ranges)
+        return {"page": len(passes), "start": len(passes), "end": len(passes) + 1, "questions": 1}
+
+    monkeypatch.setattr(bq, "_locate_detection_window", locate)
+    monkeypatch.setattr(bq, "_detect_back_questions_via_model_text", lambda text, max_questions: sent.append(text) or [])
+    with ParsedPdf(_questions_pdf(100, q_page=85), use_cache=False) as pdf:
+        width = bq._locator_width("fixed", 10, 40, {})
+        bq._detect_with_locator(
+            pdf, take_first=10, take_last=40, width=width, max_q=10, timer=StageTimer(), sent_windows=[],
+        )
+    assert len(passes) == 1 and len(sent) == 1
+    assert passes[0] == pdf.sample_ranges(10, 40)
@@ -0,0 +1,67 @@
+from src.services.text_normalize import TextNormalizer
+
+
+_BODY = ["El coyote dijo que", "La Flaca contó que", "Otro testigo vio que", "Nadie sabía si"]
+
+
+def _pages():
+    pages = []
+    for i in range(1, 11):
+        pages.append(
+            "BUFETE ORTEGA & ASOCIADOS\n"
+            f"{_BODY[i % len(_BODY)]} es-\n"
+            f"taba armado y   que nadie saliera ({'x' * i}).\n"
+            "¿Quién le amenazó?\n"
+            f"CONFIDENCIAL — Bates ORT{i:06d}\n"
+            f"Página {i} de 10\n"
+        )
+    return pages
+
+
+def test_fit_strips_repeated_lines_but_keeps_content():
+    pages = _pages()
+    norm = TextNormalizer.fit(pages, min_ratio=0.5)
+    out = norm.normalize(pages[3])
+    assert "BUFETE" not in out
+    assert "Bates" not in out and "Página 4" not in out
+    assert "estaba armado y que nadie saliera (xxxx)." in out
+    # líneas interrogativas nunca se consideran boilerplate
+    assert "¿Quién le amenazó?" in out
+    st = norm.stats()
+    assert st["pages"] == 1 and st["chars_saved"] > 0 and st["tokens_saved"] > 0
+
+
+def test_fit_ignores_lines_seen_on_few_pages():
+    pages = _pages()
+    pages[0] += "Nota única del abogado\n"
+    norm = TextNormalizer.fit(pages, min_ratio=0.5)
+    assert "Nota única del abogado" in norm.normalize(pages[0])
+
+
+def test_transcript_answer_lines_survive():
+    answers = ["R. Sí.", "R. No.", "R. No recuerdo.", "R. Llegamos el día 5 de marzo."]
+    pages = []
+    for i in range(1, 21):
+        body = []
+        for j, ans in enumerate(answers):
+            body += [f"P. ¿Pregunta {j} de la página {i}?", ans]
+        pages.append(
+            "TRANSCRIPCIÓN DE ENTREVISTA\n"
+            + "\n".join(body + [answers[i % len(answers)]]) + "\n"
+            + f"CONFIDENCIAL — Bates ORT{i:06d}\n"
+            + f"Página {i} de 20\n"
+        )
+    norm = TextNormalizer.fit(pages)
+    out = norm.normalize(pages[6])
+    for ans in answers:
+        assert ans in out
+    assert out.count("R. Llegamos el día 5 de marzo.") == 2  # también la que cae en la zona de pie
+    assert "TRANSCRIPCIÓN" not in out and "Bates" not in out and "Página 7" not in out
+
+
+def test_lines_differing_by_a_date_are_not_folded():
+    pages = [f"Declaración del día {i} de marzo\ncuerpo {i}\nPágina {i} de 12\n" for i in range(1, 13)]
+    norm = TextNormalizer.fit(pages)
+    out = norm.normalize(pages[2])
+    assert "Declaración del día 3 de marzo" in out
+    assert "Página 3" not in out
@@ -0,0 +1,185 @@
+# tests/test_vertex_client_unit.py
+import asyncio
+
+import pytest
+
+vertex_client = pytest.importorskip("src.clients.vertex_client")
+
+
+class _Resp:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModel:
+    created = 0
+
+    def __init__(self, model_id, generation_config=None):
+        type(self).created += 1
+        self.model_id = model_id
+        self.generation_config = generation_config
+
+    def generate_content(self, prompt):
+        return _Resp(f"{self.model_id}:{prompt}")
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(0.01)
+        return _Resp(f"{self.model_id}:{prompt}")
+
+
+@pytest.fixture
+def fake_vertex(monkeypatch):
+    inits = []
+    _FakeModel.created = 0
+    monkeypatch.setattr(vertex_client, "GenerativeModel", _FakeModel)
+    monkeypatch.setattr(vertex_client, "init_vertex_ai", lambda: inits.append(1) or True)
+    monkeypatch.setattr(vertex_client, "_vertex_ready", False)
+    monkeypatch.setattr(vertex_client, "_models", {})
+    monkeypatch.setattr(vertex_client, "get_rate_limiter", lambda mdl: None)
+    return inits
+
+
+def test_models_are_reused_per_model_and_config(fake_vertex):
+    for i in range(5):
+        assert vertex_client.generate_text(f"p{i}", model_id="flash") == f"flash:p{i}"
+    vertex_client.generate_text("x", model_id="pro")
+    vertex_client.get_model("flash", {"response_mime_type": "application/json"})
+    assert _FakeModel.created == 3
+    assert len(fake_vertex) == 1  # init_vertex_ai una sola vez por proceso
+
+
+def test_generate_text_async_runs_calls_concurrently(fake_vertex):
+    async def run():
+        return await asyncio.gather(*(vertex_client.generate_text_async(f"q{i}", model_id="flash") for i in range(200)))
+
+    out = asyncio.run(run())
+    assert out == [f"flash:q{i}" for i in range(200)]
+    assert _FakeModel.created == 1
+
+
+def test_response_cache_short_circuits_model_calls(fake_vertex, monkeypatch, tmp_path):
+    from src.utils.response_cache import ResponseCache
+
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=1 << 20, ttl_s=0)
+    monkeypatch.setattr(vertex_client, "get_response_cache", lambda: cache)
+    calls = []
+    monkeypatch.setattr(_FakeModel, "generate_content", lambda self, p: calls.append(p) or _Resp(f"r:{p}"))
+
+    assert vertex_client.generate_text("hola", model_id="flash") == "r:hola"
+    assert vertex_client.generate_text("hola", model_id="flash") == "r:hola"
+    assert vertex_client.generate_text("hola", model_id="pro") == "r:hola"
+    assert calls == ["hola", "hola"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_context_cache_registers_shared_prefix_once(fake_vertex, monkeypatch):
+    monkeypatch.setattr(vertex_client, "get_response_cache", lambda: None)
+    backend = vertex_client.FakeContextCacheBackend(responder=lambda prefix, prompt: f"{len(prefix)}|{prompt}")
+    ctx = vertex_client.ContextCache(backend, min_tokens=100, min_uses=2)
+    header = "[SYSTEM]\n" + "instrucciones " * 100
+    chunk = "[INPUT_CHUNK]\n" + "texto del chunk " * 100
+
+    # 1ª llamada: completa (None → el caller usa generate_text); desde la 2ª, sólo el sufijo viaja
+    assert ctx.generate([header, chunk], "P1", model_id="flash") is None
+    assert ctx.generate([header, "otro chunk"], "P2", model_id="flash") == f"{len(header)}|otro chunkP2"
+    assert ctx.generate([header, chunk], "P3", model_id="flash") == f"{len(header) + len(chunk)}|P3"
+    assert ctx.generate([header, chunk], "P4", model_id="flash") == f"{len(header) + len(chunk)}|P4"
+    assert len(backend.prefixes) == 2
+    assert [p for _, p in backend.calls] == ["otro chunkP2", "P3", "P4"]
+
+    # otro modelo → otro prefijo; prefijos chicos nunca se registran
+    assert ctx.generate([header], "P5", model_id="pro") is None
+    assert ctx.generate(["corto"], "P6", model_id="flash") is None
+    stats = ctx.stats()
+    assert stats["prefixes"] == 2 and stats["cached_calls"] == 3 and stats["tokens_saved"] > 0
+
+    ctx.close()
+    assert len(backend.deleted) == 2 and not backend.prefixes
+
+
+def test_reduce_uses_context_cache_after_first_call(monkeypatch):
+    bq = pytest.importorskip("src.services.back_questions")
+    sent = []
+    monkeypatch.setattr(bq, "generate_text", lambda prompt, model_id=None: sent.append(prompt) or "full")
+    monkeypatch.setattr(vertex_client, "get_response_cache", lambda: None)
+    monkeypatch.setattr(vertex_client, "get_rate_limiter", lambda mdl: None)
+    backend = vertex_client.FakeContextCacheBackend(responder=lambda prefix, prompt: "cached")
+    ctx = vertex_client.ContextCache(backend, min_tokens=50)
+    system, base = "sistema " * 60, "prompt base " * 60
+
+    outs = [bq._reduce_answers_for_question(system, base, f"¿Q{i}?", ["cand"], ctx_cache=ctx) for i in range(3)]
+    assert outs == ["full", "cached", "cached"]
+    assert len(sent) == 1 and sent[0].startswith("[SYSTEM]")
+    assert all("[SYSTEM]" not in p and p.startswith("Pregunta: ¿Q") for _, p in backend.calls)
+
+
+def test_per_question_map_caches_chunk_prefix_only_for_whole_chunks(monkeypatch):
+    bq = pytest.importorskip("src.services.back_questions")
+    monkeypatch.setattr(bq, "generate_text", lambda prompt, model_id=None: "full")
+    monkeypatch.setattr(vertex_client, "get_response_cache", lambda: None)
+    monkeypatch.setattr(vertex_client, "get_rate_limiter", lambda mdl: None)
+    backend = vertex_client.FakeContextCacheBackend(responder=lambda prefix, prompt: "cached")
+    ctx = vertex_client.ContextCache(backend, min_tokens=50)
+    system, base = "sistema " * 60, "prompt base " * 60
+    chunk = "texto completo del chunk " * 60
+
+    for i in range(3):  # pasajes propios de cada pregunta: sólo el header es prefijo
+        bq._answer_one_question_over_text_chunks(
+            question_text=f"¿Q{i}?", system_text=system, base_prompt=base,
+            selected_chunk_texts=[f"pasaje {i} " * 60], params={}, ctx_cache=ctx, whole_chunks=[False],
+        )
+    assert not any("[INPUT_CHUNK]" in p for p in backend.prefixes.values())
+
+    for i in range(3):  # chunk completo: header + chunk se registra y se reutiliza
+        bq._answer_one_question_over_text_chunks(
+            question_text=f"¿W{i}?", system_text=system, base_prompt=base,
+            selected_chunk_texts=[chunk], params={}, ctx_cache=ctx, whole_chunks=[True],
+        )
+    assert any(chunk in p for p in backend.prefixes.values())
+    assert all(chunk not in p for _, p in backend.calls[-2:])
+
+
+def test_response_cache_does_not_replay_malformed_json(fake_vertex, monkeypatch, tmp_path):
+    from src.utils.response_cache import ResponseCache
+
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=1 << 20, ttl_s=0)
+    monkeypatch.setattr(vertex_client, "get_response_cache", lambda: cache)
+    outs = iter(['{"answers": [{"id": "q1", "answer": "a"}, {"id": "q2", "ans', '{"answers": []}'])
+    calls = []
+    monkeypatch.setattr(_FakeModel, "generate_content", lambda self, p: calls.append(p) or _Resp(next(outs)))
+
+    assert vertex_client.generate_json("map", model_id="flash").endswith('"ans')  # truncada: no se guarda
+    assert vertex_client.generate_json("map", model_id="flash") == '{"answers": []}'
+    assert vertex_client.generate_json("map", model_id="flash") == '{"answers": []}'  # ésta sí, desde cache
+    assert len(calls) == 2
+    assert cache.stats()["writes"] == 1
+
+
+def test_context_cache_registers_outside_the_lock(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(vertex_client, "get_response_cache", lambda: None)
+    monkeypatch.setattr(vertex_client, "get_rate_limiter", lambda mdl: None)
+    release, entered = threading.Event(), threading.Event()
+
+    class _SlowBackend(vertex_client.FakeContextCacheBackend):
+        def create(self, model_id, text, ttl_s):
+            entered.set()
+            assert release.wait(5)
+            return super().create(model_id, text, ttl_s)
+
+    backend = _SlowBackend(responder=lambda prefix, prompt: "cached")
+    ctx = vertex_client.ContextCache(backend, min_tokens=50)
+    header, other = "cabecera " * 60, "otra cabecera " * 60
+    assert ctx.generate([header], "P1", model_id="flash") is None
+
+    t = threading.Thread(target=lambda: ctx.generate([header], "P2", model_id="flash"))
+    t.start()
+    assert entered.wait(5)
+    # registro en vuelo: otros workers siguen (llamada completa) sin esperar ni duplicarlo
+    assert ctx.generate([header], "P3", model_id="flash") is None
+    assert ctx.generate([other], "P4", model_id="flash") is None
+    release.set()
+    t.join(5)
+    assert ctx.generate([header], "P5", model_id="flash") == "cached"
+    assert ctx.stats()["prefixes"] == 1 and len(backend.prefixes) == 1
@@ -0,0 +1,128 @@
+# tools/bench_router.py
+"""
+Benchmark del router preguntas→chunks con datos sintéticos.
+
+    python -m tools.bench_router --questions 1000 --chunks 500 [--scorer bm25] [--router planner] [--legacy]
+
+Mide por separado el scoring (índice + rankings de todas las preguntas) y el ruteo
+(asignación, cobertura mínima, cap y derrame). Con --legacy compara contra el router
+anterior (búsquedas lineales por id, asignaciones duplicadas).
+"""
+import argparse
+import logging
+import random
+import time
+from collections import defaultdict
+
+from src.services.back_questions import (
+    _plan_questions_to_chunks,
+    _route_questions_to_chunks,
+    _select_topk_chunks_for_question,
+)
+from src.services.chunk_index import build_chunk_index
+
+VOCAB = (
+    "amenaza armas coyote frontera policía golpes escapar casa trabajo deuda dinero "
+    "hermano madre pandilla cartel migración asilo miedo denuncia lesiones hospital "
+    "documentos pasaporte visa abogado corte juez testigo declaración violencia"
+).split()
+
+
+def synth(num_questions: int, num_chunks: int, words_per_chunk: int, seed: int):
+    rnd = random.Random(seed)
+    chunks = [" ".join(rnd.choice(VOCAB) for _ in range(words_per_chunk)) for _ in range(num_chunks)]
+    questions = [
+        {"id": f"q{i}", "text": "¿" + " ".join(rnd.sample(VOCAB, rnd.randint(2, 6))) + "?"}
+        for i in range(num_questions)
+    ]
+    return questions, chunks
+
+
+def legacy_route(questions, chunk_texts, *, k_top, min_cover, chunk_cap, index):
+    """Router anterior (referencia de rendimiento): next(...) por id y list.index en el orden."""
+    num_chunks = len(chunk_texts)
+    sentry = [0, max(0, num_chunks - 1)]
+    prelim, assigned = defaultdict(list), defaultdict(list)
+    for q in questions:
+        for c in _select_topk_chunks_for_question(q["text"], chunk_texts, k=k_top, index=index) or sentry[:]:
+            prelim[c].append(q["id"])
+            assigned[q["id"]].append(c)
+    need = min(min_cover, num_chunks)
+    for q in questions:
+        cur = list(dict.fromkeys(assigned[q["id"]]))
+        while len(cur) < need:
+            for sc in sentry:
+                if sc not in cur:
+                    prelim[sc].append(q["id"])
+                    cur.append(sc)
+                if len(cur) >= need:
+                    break
+    routing = defaultdict(list)
+    q_order = {q["id"]: _select_topk_chunks_for_question(q["text"], chunk_texts, k=max(k_top, min_cover), index=index) for q in questions}
+    overflow = []
+    for cidx in range(num_chunks):
+        qids = prelim[cidx]
+        if len(qids) > chunk_cap:
+            qids.sort(key=lambda qid: q_order[qid].index(cidx) if cidx in q_order[qid] else 999)
+        for qid in qids[:chunk_cap]:
+            routing[cidx].append(next(x for x in questions if x["id"] == qid))
+        for qid in qids[chunk_cap:]:
+            for alt in q_order[qid]:
+                if alt != cidx and len(routing[alt]) < chunk_cap:
+                    routing[alt].append(next(x for x in questions if x["id"] == qid))
+                    break
+            else:
+                overflow.append(qid)
+    for qid in overflow:
+        routing[num_chunks - 1].append(next(x for x in questions if x["id"] == qid))
+    return routing
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--questions", type=int, default=1000)
+    ap.add_argument("--chunks", type=int, default=500)
+    ap.add_argument("--words-per-chunk", type=int, default=400)
+    ap.add_argument("--k-top", type=int, default=3)
+    ap.add_argument("--min-cover", type=int, default=2)
+    ap.add_argument("--chunk-cap", type=int, default=20)
+    ap.add_argument("--scorer", default="heuristic")
+    ap.add_argument("--router", default="greedy", choices=["greedy", "planner"])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--legacy", action="store_true")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    logging.disable(logging.INFO)  # 1 línea de cobertura por pregunta: no medir el logging
+    questions, chunks = synth(args.questions, args.chunks, args.words_per_chunk, args.seed)
+    params = dict(k_top=args.k_top, min_cover=args.min_cover, chunk_cap=args.chunk_cap)
+
+    t0 = time.perf_counter()
+    index = build_chunk_index(chunks, args.scorer)
+    index.prepare(q["text"] for q in questions)
+    t_score = time.perf_counter() - t0
+
+    route_fn = _plan_questions_to_chunks if args.router == "planner" else _route_questions_to_chunks
+    runs = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        routing = route_fn(questions, chunks, index=index, **params)
+        runs.append(time.perf_counter() - t0)
+    calls = sum(1 for lst in routing.values() if lst)
+    dups = sum(len(lst) - len({q["id"] for q in lst}) for lst in routing.values())
+
+    print(f"{args.questions} preguntas × {args.chunks} chunks ({type(index).__name__}, router={args.router})")
+    print(f"  scoring (índice + rankings): {t_score * 1000:.1f} ms")
+    print(f"  ruteo: min {min(runs) * 1000:.1f} ms | mediana {sorted(runs)[len(runs) // 2] * 1000:.1f} ms")
+    print(f"  chunks con preguntas (llamadas MAP): {calls} | duplicados: {dups}")
+
+    if args.legacy:
+        t0 = time.perf_counter()
+        old = legacy_route(questions, chunks, index=index, **params)
+        t_old = time.perf_counter() - t0
+        old_dups = sum(len(lst) - len({q["id"] for q in lst}) for lst in old.values())
+        print(f"  ruteo anterior: {t_old * 1000:.1f} ms | duplicados: {old_dups}")
+
+
+if __name__ == "__main__":
+    main()
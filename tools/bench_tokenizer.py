@@ -0,0 +1,74 @@
+# tools/bench_tokenizer.py
+"""
+Throughput (MB/s) del tokenizer compartido (src/utils/es_text.py) sobre texto sintético.
+
+    python -m tools.bench_tokenizer --mb 20
+
+Mide fold, tokens (sin/con stem), detección de encabezados y líneas '¿…?' por separado,
+y lo compara con la tokenización anterior del router (regex + lower + split).
+"""
+import argparse
+import random
+import re
+import time
+
+from src.services.back_questions import _ANY_VARIANT
+from src.utils import es_text
+
+WORDS = (
+    "la coyote Flaca amenazó al grupo durante los diez días en la frontera; hombres armados "
+    "vigilaban la casa y los intentos de escapar eran castigados. El declarante manifestó "
+    "ante la oficial de asilo que tenía miedo de regresar a su país por la pandilla. "
+    "¿Mencionó alguna amenaza? ¿Usaron armas? Página 12 de 300 BUFETE ORTEGA CONFIDENCIAL"
+).split()
+_OLD_CLEAN = re.compile(r"[^\w\sáéíóúüñÁÉÍÓÚÜÑ]")
+
+
+def synth(mb: float, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    target = int(mb * 1024 * 1024)
+    lines, size = [], 0
+    while size < target:
+        line = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 18)))
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return "\n".join(lines)
+
+
+def old_tokens(text: str):
+    q = _OLD_CLEAN.sub(" ", text.lower())
+    return [t for t in q.split() if len(t) > 2]
+
+
+def bench(name, fn, text, mb, repeat, setup=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - t0)
+    print(f"  {name:<28} {mb / best:8.1f} MB/s  ({best * 1000:.0f} ms)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=float, default=10.0)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    text = synth(args.mb)
+    mb = len(text.encode("utf-8")) / (1024 * 1024)
+    print(f"Texto sintético: {mb:.1f} MB")
+    bench("fold", es_text.fold, text, mb, args.repeat)
+    bench("tokens (sin stem)", lambda t: es_text.tokens(t, use_stem=False, cache=False), text, mb, args.repeat)
+    bench("tokens+stem (frío)", lambda t: es_text.tokens(t, cache=False), text, mb, args.repeat,
+          setup=es_text.stem.cache_clear)
+    bench("tokens+stem", lambda t: es_text.tokens(t, cache=False), text, mb, args.repeat)
+    bench("encabezados (_ANY_VARIANT)", lambda t: _ANY_VARIANT.search(es_text.fold(t)), text, mb, args.repeat)
+    bench("question_lines", es_text.question_lines, text, mb, args.repeat)
+    bench("anterior (lower+split)", old_tokens, text, mb, args.repeat)
+
+
+if __name__ == "__main__":
+    main()